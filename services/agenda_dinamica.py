@@ -7,23 +7,42 @@ Permite configuração flexível de horários através de 3 níveis:
 2. Exceções Mensais (bloqueios_pontuais, slots_personalizados) - onde está o poder
 3. Slots Auto-gerados - combinação dos níveis anteriores
 
+Opcionalmente, "recursos" lista cadeiras/barbeiros atendendo em paralelo,
+cada um com seu próprio horario_funcionamento (dias omitidos seguem o da
+barbearia). Sem essa chave, a agenda tem um único barbeiro (RECURSO_PADRAO).
+
 Substitui DEFAULT_SLOTS hardcoded por geração dinâmica baseada em JSON.
 """
 
 import os
 import json
-from datetime import datetime, timedelta
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Dict, List, Optional, Tuple, Any
 
+from services import config_registry
+
 # =========================================================
 # Configuração
 # =========================================================
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "agenda_config.json")
 
-# Cache em memória (evita ler JSON toda vez)
-_config_cache: Optional[Dict] = None
-_cache_timestamp: Optional[datetime] = None
-CACHE_DURATION_SECONDS = 60  # Recarregar config a cada 1 minuto
+DIAS_SEMANA = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
+
+# Recurso implícito quando a agenda não define "recursos"
+RECURSO_PADRAO = "principal"
+
+# Configuração padrão em uso quando o arquivo não existe. O arquivo em si
+# fica no config_registry, que relê quando mtime/inode mudam (inclusive
+# quando outro processo salva a agenda).
+_config_padrao: Optional[Dict] = None
+
+# Agenda compilada (templates semanais, bloqueios e slots personalizados)
+_compilado: Optional[Dict[str, Any]] = None
+_compilado_de: Optional[Dict] = None
+_compilar_lock = threading.Lock()
 
 # =========================================================
 # Carregamento de Configuração
@@ -32,7 +51,7 @@ CACHE_DURATION_SECONDS = 60  # Recarregar config a cada 1 minuto
 def carregar_config(force_reload: bool = False) -> Dict:
     """
     Carrega configuração da agenda do arquivo JSON.
-    Usa cache em memória por 60 segundos para performance.
+    Usa cache em memória enquanto o arquivo não mudar (mtime/inode).
     
     Args:
         force_reload: Se True, ignora cache e recarrega do arquivo
@@ -40,31 +59,16 @@ def carregar_config(force_reload: bool = False) -> Dict:
     Returns:
         Dict com configuração completa da agenda
     """
-    global _config_cache, _cache_timestamp
+    global _config_padrao
     
-    # Verifica se pode usar cache
-    agora = datetime.now()
-    if not force_reload and _config_cache and _cache_timestamp:
-        if (agora - _cache_timestamp).total_seconds() < CACHE_DURATION_SECONDS:
-            return _config_cache
-    
-    # Carrega do arquivo
-    if not os.path.exists(CONFIG_PATH):
-        # Retorna configuração padrão se arquivo não existir
-        return _get_default_config()
-    
-    try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        
-        # Atualiza cache
-        _config_cache = config
-        _cache_timestamp = agora
-        
+    config = config_registry.obter_original(CONFIG_PATH, forcar=force_reload)
+    if config is not None:
         return config
-    except Exception as e:
-        print(f"Erro ao carregar agenda_config.json: {e}")
-        return _get_default_config()
+    
+    # Usa configuração padrão se arquivo não existir
+    if force_reload or _config_padrao is None:
+        _config_padrao = _get_default_config()
+    return _config_padrao
 
 
 def _get_default_config() -> Dict:
@@ -101,17 +105,25 @@ def salvar_config(config: Dict) -> bool:
     Returns:
         True se salvou com sucesso, False caso contrário
     """
-    global _config_cache, _cache_timestamp
-    
     try:
         os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
         
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
+        # Grava em arquivo temporário e troca: outros processos nunca
+        # leem JSON pela metade e veem o novo inode no próximo acesso
+        tmp_path = f"{CONFIG_PATH}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, CONFIG_PATH)
         
         # Invalida cache
-        _config_cache = None
-        _cache_timestamp = None
+        config_registry.invalidar(CONFIG_PATH)
+        
+        # Grades de disponibilidade dependem da agenda
+        try:
+            from services import cache_disponibilidade
+            cache_disponibilidade.invalidar_tudo()
+        except ImportError:
+            pass
         
         return True
     except Exception as e:
@@ -141,40 +153,23 @@ def gerar_slots_dia(data_str: str, incluir_ocupados: bool = False) -> List[str]:
     Returns:
         Lista de horários no formato HH:MM (ex: ["08:00", "09:00", ...])
     """
-    config = carregar_config()
+    compilado = _obter_compilado()
     
     # 1. Verificar bloqueio pontual
-    if eh_dia_bloqueado(data_str, config):
+    if data_str in compilado["bloqueios"]:
         return []
     
     # 2. Verificar se tem slots personalizados para este dia
-    slots_personalizados = config.get("slots_personalizados", {})
-    if data_str in slots_personalizados:
-        return slots_personalizados[data_str]
-    
-    # 3. Usar horário padrão do dia da semana
-    try:
-        data_obj = datetime.strptime(data_str, "%d/%m/%Y")
-        dia_semana = _get_nome_dia_semana(data_obj.weekday())
-    except Exception:
-        return []
-    
-    horario_funcionamento = config.get("horario_funcionamento", {})
-    horario_dia = horario_funcionamento.get(dia_semana, {})
+    personalizado = compilado["personalizados"].get(data_str)
+    if personalizado is not None:
+        return list(personalizado["slots"])
     
-    # Se dia não está ativo, retorna vazio
-    if not horario_dia.get("ativo", False):
+    # 3/4. Usar template compilado do dia da semana (já sem intervalos)
+    template = _template_dia(compilado, data_str)
+    if template is None:
         return []
     
-    # 4. Gerar slots baseado em início, fim e duração
-    inicio_str = horario_dia.get("inicio", "08:00")
-    fim_str = horario_dia.get("fim", "18:00")
-    intervalos = horario_dia.get("intervalos", [])
-    
-    cfg_gerais = config.get("configuracoes_gerais", {})
-    duracao_slot = cfg_gerais.get("duracao_slot_minutos", 60)
-    
-    slots = _gerar_slots_entre_horarios(inicio_str, fim_str, duracao_slot, intervalos)
+    slots = list(template["slots"])
     
     # 5. Filtrar ocupados (se solicitado)
     if not incluir_ocupados:
@@ -185,8 +180,17 @@ def gerar_slots_dia(data_str: str, incluir_ocupados: bool = False) -> List[str]:
 
 def _get_nome_dia_semana(weekday: int) -> str:
     """Converte número do dia da semana para nome."""
-    dias = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
-    return dias[weekday]
+    return DIAS_SEMANA[weekday]
+
+
+@lru_cache(maxsize=1024)
+def _dia_semana(data_str: str) -> Optional[int]:
+    """Dia da semana (0=segunda) de uma data DD/MM/YYYY, None se inválida."""
+    try:
+        dia, mes, ano = map(int, data_str.split("/"))
+        return date(ano, mes, dia).weekday()
+    except Exception:
+        return None
 
 
 def _gerar_slots_entre_horarios(
@@ -207,23 +211,18 @@ def _gerar_slots_entre_horarios(
     Returns:
         Lista de horários (HH:MM)
     """
-    try:
-        hora_inicio = datetime.strptime(inicio, "%H:%M")
-        hora_fim = datetime.strptime(fim, "%H:%M")
-    except Exception:
+    hora_inicio = hhmm_para_minutos(inicio)
+    hora_fim = hhmm_para_minutos(fim)
+    if hora_inicio is None or hora_fim is None or duracao_minutos <= 0:
         return []
     
-    slots = []
-    hora_atual = hora_inicio
+    pausas = _intervalos_em_minutos(intervalos)
     
-    while hora_atual < hora_fim:
-        hora_str = hora_atual.strftime("%H:%M")
-        
+    slots = []
+    for minuto in range(hora_inicio, hora_fim, duracao_minutos):
         # Verificar se horário está dentro de algum intervalo
-        if not _horario_em_intervalo(hora_str, intervalos):
-            slots.append(hora_str)
-        
-        hora_atual += timedelta(minutes=duracao_minutos)
+        if not any(p_inicio <= minuto < p_fim for p_inicio, p_fim in pausas):
+            slots.append(f"{minuto // 60:02d}:{minuto % 60:02d}")
     
     return slots
 
@@ -239,22 +238,235 @@ def _horario_em_intervalo(horario: str, intervalos: List[Dict]) -> bool:
     Returns:
         True se horário está em algum intervalo, False caso contrário
     """
-    try:
-        hora_obj = datetime.strptime(horario, "%H:%M")
-    except Exception:
+    minuto = hhmm_para_minutos(horario)
+    if minuto is None:
         return False
     
-    for intervalo in intervalos:
+    return any(p_inicio <= minuto < p_fim for p_inicio, p_fim in _intervalos_em_minutos(intervalos))
+
+
+def hhmm_para_minutos(horario: str) -> Optional[int]:
+    """Converte HH:MM em minutos desde a meia-noite (None se inválido)."""
+    try:
+        hora, minuto = map(int, str(horario).strip().split(":"))
+        return hora * 60 + minuto
+    except Exception:
+        return None
+
+
+def _intervalos_em_minutos(intervalos: List[Dict]) -> List[Tuple[int, int]]:
+    """Converte intervalos {'inicio','fim'} em pares (inicio, fim) em minutos."""
+    pausas = []
+    for intervalo in intervalos or []:
         try:
-            intervalo_inicio = datetime.strptime(intervalo["inicio"], "%H:%M")
-            intervalo_fim = datetime.strptime(intervalo["fim"], "%H:%M")
-            
-            if intervalo_inicio <= hora_obj < intervalo_fim:
-                return True
-        except Exception:
+            p_inicio = hhmm_para_minutos(intervalo.get("inicio", ""))
+            p_fim = hhmm_para_minutos(intervalo.get("fim", ""))
+        except AttributeError:
             continue
+        if p_inicio is not None and p_fim is not None and p_fim > p_inicio:
+            pausas.append((p_inicio, p_fim))
+    return pausas
+
+
+# =========================================================
+# Agenda Compilada
+# =========================================================
+
+def _compilar_dia_semana(horario_dia: Dict, duracao_slot: int) -> Optional[Dict[str, Any]]:
+    """Template de um dia da semana: slots, expediente e pausas em minutos."""
+    if not horario_dia.get("ativo", False):
+        return None
     
-    return False
+    inicio_str = horario_dia.get("inicio", "08:00")
+    fim_str = horario_dia.get("fim", "18:00")
+    intervalos = horario_dia.get("intervalos", [])
+    
+    return {
+        "slots": tuple(_gerar_slots_entre_horarios(inicio_str, fim_str, duracao_slot, intervalos)),
+        "inicio": hhmm_para_minutos(inicio_str),
+        "fim": hhmm_para_minutos(fim_str),
+        "pausas": tuple(_intervalos_em_minutos(intervalos)),
+    }
+
+
+def _compilar(config: Dict) -> Dict[str, Any]:
+    """
+    Pré-processa a configuração uma única vez por versão:
+    - bloqueios_pontuais -> dict data -> motivo
+    - slots_personalizados -> dict data -> slots/expediente
+    - horario_funcionamento -> 7 templates com slots já gerados
+    - recursos -> expediente/pausas semanais de cada cadeira/barbeiro
+    """
+    cfg_gerais = config.get("configuracoes_gerais", {})
+    duracao_slot = cfg_gerais.get("duracao_slot_minutos", 60)
+    
+    bloqueios = {}
+    for bloqueio in config.get("bloqueios_pontuais", []):
+        # Bloqueio pode ser string (data) ou dict com data e motivo
+        if isinstance(bloqueio, str):
+            bloqueios[bloqueio] = ""
+        elif isinstance(bloqueio, dict) and bloqueio.get("data"):
+            bloqueios[bloqueio["data"]] = bloqueio.get("motivo") or ""
+    
+    personalizados = {}
+    for data_str, slots in (config.get("slots_personalizados") or {}).items():
+        minutos = [m for m in (hhmm_para_minutos(s) for s in slots) if m is not None]
+        personalizados[data_str] = {
+            "slots": tuple(slots),
+            "inicio": min(minutos) if minutos else None,
+            "fim": max(minutos) + duracao_slot if minutos else None,
+        }
+    
+    horario_funcionamento = config.get("horario_funcionamento", {})
+    semana = [
+        _compilar_dia_semana(horario_funcionamento.get(dia, {}), duracao_slot)
+        for dia in DIAS_SEMANA
+    ]
+    
+    recursos = []
+    for recurso in config.get("recursos") or []:
+        if not isinstance(recurso, dict) or not recurso.get("id") or not recurso.get("ativo", True):
+            continue
+        proprio = recurso.get("horario_funcionamento") or {}
+        recursos.append({
+            "id": str(recurso["id"]),
+            "nome": recurso.get("nome") or str(recurso["id"]),
+            "semana": tuple(
+                _compilar_dia_semana(proprio[dia], duracao_slot) if dia in proprio else semana[i]
+                for i, dia in enumerate(DIAS_SEMANA)
+            ),
+        })
+    
+    return {
+        "bloqueios": MappingProxyType(bloqueios),
+        "personalizados": personalizados,
+        "semana": semana,
+        "duracao_slot": duracao_slot,
+        "recursos": tuple(recursos),
+    }
+
+
+def _obter_compilado(config: Optional[Dict] = None) -> Dict[str, Any]:
+    """Agenda compilada da configuração atual (recompila se ela mudou)."""
+    global _compilado, _compilado_de
+    
+    if config is None:
+        config = carregar_config()
+    
+    compilado = _compilado
+    if compilado is not None and _compilado_de is config:
+        return compilado
+    
+    with _compilar_lock:
+        if _compilado is None or _compilado_de is not config:
+            _compilado = _compilar(config)
+            _compilado_de = config
+        return _compilado
+
+
+def bloqueios_indexados() -> "MappingProxyType[str, str]":
+    """
+    Bloqueios pontuais da versão atual da agenda (data -> motivo).
+    O objeto só muda quando a configuração muda.
+    """
+    return _obter_compilado()["bloqueios"]
+
+
+def _template_dia(compilado: Dict[str, Any], data_str: str) -> Optional[Dict[str, Any]]:
+    """Template semanal da data (None se data inválida ou dia inativo)."""
+    weekday = _dia_semana(data_str)
+    if weekday is None:
+        return None
+    return compilado["semana"][weekday]
+
+
+def obter_janela_dia(data_str: str) -> Optional[Dict[str, Any]]:
+    """
+    Retorna a janela de atendimento de uma data, sem consultar o Excel.
+
+    Usada pelo motor de disponibilidade para varrer vários dias sem
+    regerar a grade completa de cada um.
+
+    Args:
+        data_str: Data no formato DD/MM/YYYY
+
+    Returns:
+        Dict com 'slots' (HH:MM), 'inicio'/'fim' (minutos), 'pausas'
+        (lista de (inicio, fim) em minutos) e 'fonte'; None se o dia
+        estiver fechado ou bloqueado.
+    """
+    compilado = _obter_compilado()
+
+    if data_str in compilado["bloqueios"]:
+        return None
+
+    personalizado = compilado["personalizados"].get(data_str)
+    if personalizado is not None:
+        if personalizado["inicio"] is None:
+            return None
+        return {
+            "slots": list(personalizado["slots"]),
+            "inicio": personalizado["inicio"],
+            "fim": personalizado["fim"],
+            "pausas": [],
+            "fonte": "personalizado",
+        }
+
+    template = _template_dia(compilado, data_str)
+    if template is None or template["inicio"] is None or template["fim"] is None:
+        return None
+
+    return {
+        "slots": list(template["slots"]),
+        "inicio": template["inicio"],
+        "fim": template["fim"],
+        "pausas": list(template["pausas"]),
+        "fonte": "padrao_semanal",
+    }
+
+
+def listar_recursos() -> List[Dict[str, str]]:
+    """Cadeiras/barbeiros configurados: [{"id", "nome"}] (um implícito se nenhum)."""
+    recursos = _obter_compilado()["recursos"]
+    if not recursos:
+        return [{"id": RECURSO_PADRAO, "nome": "Barbeiro"}]
+    return [{"id": r["id"], "nome": r["nome"]} for r in recursos]
+
+
+def obter_recursos_dia(data_str: str) -> List[Dict[str, Any]]:
+    """
+    Recursos que atendem na data, com o expediente próprio de cada um.
+
+    Returns:
+        Lista (na ordem da configuração) de dicts com 'id', 'nome',
+        'inicio'/'fim' (minutos) e 'pausas'. O recurso implícito tem
+        inicio/fim None: segue apenas a janela da barbearia.
+    """
+    compilado = _obter_compilado()
+    recursos = compilado["recursos"]
+    if not recursos:
+        return [{"id": RECURSO_PADRAO, "nome": "Barbeiro", "inicio": None, "fim": None, "pausas": ()}]
+
+    if data_str in compilado["bloqueios"]:
+        return []
+
+    personalizado = compilado["personalizados"].get(data_str)
+    weekday = _dia_semana(data_str)
+    dia = []
+    for recurso in recursos:
+        if personalizado is not None:
+            # Slots personalizados valem para a barbearia inteira
+            if personalizado["inicio"] is None:
+                continue
+            dia.append({"id": recurso["id"], "nome": recurso["nome"],
+                        "inicio": personalizado["inicio"], "fim": personalizado["fim"], "pausas": ()})
+            continue
+        template = recurso["semana"][weekday] if weekday is not None else None
+        if template is None or template["inicio"] is None or template["fim"] is None:
+            continue
+        dia.append({"id": recurso["id"], "nome": recurso["nome"],
+                    "inicio": template["inicio"], "fim": template["fim"], "pausas": template["pausas"]})
+    return dia
 
 
 def _filtrar_slots_disponiveis(data_str: str, slots: List[str]) -> List[str]:
@@ -297,21 +509,7 @@ def eh_dia_bloqueado(data_str: str, config: Optional[Dict] = None) -> bool:
     Returns:
         True se dia está bloqueado, False caso contrário
     """
-    if config is None:
-        config = carregar_config()
-    
-    bloqueios = config.get("bloqueios_pontuais", [])
-    
-    # Bloqueio pode ser string (data) ou dict com data e motivo
-    for bloqueio in bloqueios:
-        if isinstance(bloqueio, str):
-            if bloqueio == data_str:
-                return True
-        elif isinstance(bloqueio, dict):
-            if bloqueio.get("data") == data_str:
-                return True
-    
-    return False
+    return data_str in _obter_compilado(config)["bloqueios"]
 
 
 def horarios_disponiveis_com_verificacao(data_str: str) -> List[str]:
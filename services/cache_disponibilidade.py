@@ -0,0 +1,307 @@
+# services/cache_disponibilidade.py
+"""
+Cache LRU das grades de disponibilidade (data + serviço).
+
+A mesma grade de horários é recalculada para cada cliente que consulta
+o dia e a cada transição do fluxo. Este módulo guarda as grades já
+calculadas, com chave (data, servico_id, versão do catálogo, versão da
+agenda), e as descarta quando:
+
+1. Um agendamento daquela data muda de estado (invalidar_data)
+2. A agenda é salva ou a lista de feriados muda (invalidar_tudo / versão)
+3. Outro processo grava a planilha (mtime diferente do último conhecido)
+   ou cria/remove uma reserva temporária (versão de reservas_temporarias)
+
+O cache é por processo; a verificação de mtime da planilha e da versão
+das reservas cobre as mudanças feitas por outros workers.
+
+Cálculos concorrentes da mesma grade são feitos uma única vez (os demais
+esperam o resultado), e o pré-cálculo em segundo plano (pre_calcular)
+permite ao fluxo preencher o cache assim que o cliente escolhe o serviço.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services import config_registry
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+MAX_ENTRADAS = int(os.getenv("CACHE_DISPONIBILIDADE_MAX", "256"))
+PRE_CALCULO_WORKERS = int(os.getenv("PRE_CALCULO_WORKERS", "2"))  # 0 desliga o pré-cálculo
+ESPERA_CALCULO_S = 15  # Teto de espera por uma grade sendo calculada por outra thread
+
+CATALOGOS = ["servicos.json", "servicos_detalhados.json"]
+
+# =========================================================
+# Estado
+# =========================================================
+_lock = threading.Lock()
+_entradas: "OrderedDict[Tuple, Any]" = OrderedDict()
+_geracao = 0                     # incrementada a cada invalidar_tudo()
+_estado_externo: Optional[Tuple[int, int]] = None   # (mtime da planilha, versão das reservas)
+_versao_data: Dict[str, int] = {}                   # sobe a cada invalidar_data da data
+_mudancas = 0                                       # sobe a cada invalidação (qualquer data)
+_em_calculo: Dict[Tuple, threading.Event] = {}
+_stats = {
+    "hits": 0, "misses": 0, "esperas": 0, "descartes": 0,
+    "invalidacoes_data": 0, "invalidacoes_total": 0,
+    "pre_calculos": 0, "pre_calculos_substituidos": 0,
+}
+
+# Pré-cálculo em segundo plano, um trabalho por conversa
+_executor: Optional[ThreadPoolExecutor] = None
+_pre_calculos: Dict[str, Future] = {}
+
+
+# =========================================================
+# Versões
+# =========================================================
+
+def _mtime(path: Optional[str]) -> int:
+    """mtime em ns do arquivo (0 se não existir)."""
+    if not path:
+        return 0
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def versao_catalogo() -> Tuple[int, ...]:
+    """Versão dos catálogos de serviços (config_registry)."""
+    return tuple(config_registry.versao(nome) for nome in CATALOGOS)
+
+
+def versao_agenda() -> Tuple[Any, ...]:
+    """Versão da agenda: config semanal + feriados + geração local."""
+    try:
+        from services import agenda_dinamica as ag
+        agenda_path = ag.CONFIG_PATH
+    except ImportError:
+        agenda_path = None
+    try:
+        from services import excel_services as exc
+        feriados_path = exc.FERIADOS_JSON
+    except ImportError:
+        feriados_path = None
+    return (
+        (agenda_path, config_registry.versao(agenda_path)) if agenda_path else None,
+        (feriados_path, config_registry.versao(feriados_path)) if feriados_path else None,
+        _geracao,
+    )
+
+
+def _caminho_planilha() -> Optional[str]:
+    try:
+        from services import excel_services as exc
+        return exc.FILE_PATH
+    except ImportError:
+        return None
+
+
+def _versao_reservas() -> int:
+    try:
+        from services import reservas_temporarias
+        return reservas_temporarias.versao()
+    except ImportError:
+        return 0
+
+
+def _estado_atual() -> Tuple[int, int]:
+    return (_mtime(_caminho_planilha()), _versao_reservas())
+
+
+def _verificar_planilha_externa():
+    """Limpa tudo se planilha/reservas mudaram em outro processo (chamar com _lock)."""
+    global _estado_externo, _mudancas
+    atual = _estado_atual()
+    if _estado_externo is None:
+        _estado_externo = atual
+    elif atual != _estado_externo:
+        _entradas.clear()
+        _stats["invalidacoes_total"] += 1
+        _estado_externo = atual
+        _mudancas += 1
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def marca() -> Tuple[Any, ...]:
+    """
+    Marca do estado atual, para quem lê os agendamentos antes de chamar
+    obter() (ex.: pré-cálculo de vários dias com uma única leitura).
+    """
+    with _lock:
+        _verificar_planilha_externa()
+        return (_mudancas, _geracao)
+
+
+def obter(
+    data_str: str,
+    servico_id: str,
+    calcular: Callable[[], Any],
+    desde: Optional[Tuple[Any, ...]] = None
+) -> Any:
+    """
+    Retorna a grade em cache ou calcula, guarda e retorna.
+    
+    Se outra thread já está calculando a mesma grade, espera por ela em
+    vez de recalcular. Um resultado calculado enquanto a data foi
+    invalidada é devolvido, mas não guardado.
+    
+    Args:
+        data_str: Data DD/MM/YYYY
+        servico_id: ID do serviço
+        calcular: Função sem argumentos que gera a grade
+        desde: marca() tirada antes de ler os dados usados por `calcular`;
+               se houve qualquer invalidação depois dela, não guarda
+    
+    Returns:
+        Grade calculada (não modificar o objeto retornado)
+    """
+    chave = (data_str, servico_id, versao_catalogo(), versao_agenda())
+    
+    while True:
+        with _lock:
+            _verificar_planilha_externa()
+            if chave in _entradas:
+                _entradas.move_to_end(chave)
+                _stats["hits"] += 1
+                return _entradas[chave]
+            evento = _em_calculo.get(chave)
+            if evento is None:
+                _stats["misses"] += 1
+                evento = _em_calculo[chave] = threading.Event()
+                inicio = (_estado_externo, _versao_data.get(data_str, 0))
+                break
+            _stats["esperas"] += 1
+        # Outra thread (ex.: pré-cálculo) está gerando esta grade
+        if not evento.wait(ESPERA_CALCULO_S):
+            return calcular()
+    
+    try:
+        valor = calcular()
+    finally:
+        with _lock:
+            _em_calculo.pop(chave, None)
+        evento.set()
+    
+    with _lock:
+        _verificar_planilha_externa()
+        alterado = (_estado_externo, _versao_data.get(data_str, 0)) != inicio
+        if alterado or (desde is not None and (_mudancas, _geracao) != desde):
+            _stats["descartes"] += 1
+            return valor
+        _entradas[chave] = valor
+        _entradas.move_to_end(chave)
+        while len(_entradas) > max(MAX_ENTRADAS, 1):
+            _entradas.popitem(last=False)
+    return valor
+
+
+def invalidar_data(*datas: str):
+    """
+    Descarta as grades das datas informadas.
+    Chamado após gravar na planilha uma mudança de agendamento.
+    """
+    global _estado_externo, _mudancas
+    alvos = {str(d).strip() for d in datas if d}
+    with _lock:
+        for chave in [c for c in _entradas if c[0] in alvos]:
+            del _entradas[chave]
+        for data_str in alvos:
+            _versao_data[data_str] = _versao_data.get(data_str, 0) + 1
+        _mudancas += 1
+        _stats["invalidacoes_data"] += 1
+        # A mudança foi nossa: não precisa limpar as demais datas
+        _estado_externo = _estado_atual()
+
+
+def invalidar_tudo():
+    """Descarta todas as grades (agenda salva, feriados alterados)."""
+    global _geracao
+    with _lock:
+        _entradas.clear()
+        _geracao += 1
+        _stats["invalidacoes_total"] += 1
+
+
+def pre_calcular(conversa: str, calcular: Callable[[], Any]) -> Optional[Future]:
+    """
+    Agenda `calcular` (que preenche o cache) em segundo plano.
+    
+    Há no máximo um pré-cálculo por conversa: um novo pedido (ex.: o
+    cliente trocou de serviço) substitui o anterior se ele ainda não
+    começou.
+    
+    Args:
+        conversa: Identificador da conversa (chat_id)
+        calcular: Função sem argumentos executada no pool
+    
+    Returns:
+        Future do trabalho (None se o pré-cálculo estiver desligado)
+    """
+    global _executor
+    if PRE_CALCULO_WORKERS <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=PRE_CALCULO_WORKERS, thread_name_prefix="pre_calculo"
+            )
+        anterior = _pre_calculos.get(conversa)
+        futuro = _executor.submit(calcular)
+        _pre_calculos[conversa] = futuro
+        _stats["pre_calculos"] += 1
+    
+    # Fora do _lock: cancel() roda na hora o _concluir do anterior, que
+    # pega o _lock de novo
+    if anterior is not None and anterior.cancel():
+        with _lock:
+            _stats["pre_calculos_substituidos"] += 1
+    
+    def _concluir(f: Future):
+        with _lock:
+            if _pre_calculos.get(conversa) is f:
+                del _pre_calculos[conversa]
+        if not f.cancelled() and f.exception() is not None:
+            logger.warning(f"[CACHE] Pré-cálculo falhou para {conversa}: {f.exception()}")
+    
+    futuro.add_done_callback(_concluir)
+    return futuro
+
+
+def pre_calculo_pendente(conversa: str) -> bool:
+    """True se a conversa tem pré-cálculo na fila ou em execução."""
+    with _lock:
+        return conversa in _pre_calculos
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Contadores para ajuste do tamanho do cache."""
+    with _lock:
+        consultas = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entradas": len(_entradas),
+            "max_entradas": MAX_ENTRADAS,
+            "pre_calculos_pendentes": len(_pre_calculos),
+            "taxa_acerto": round(_stats["hits"] / consultas, 3) if consultas else 0.0,
+        }
+
+
+def resetar_estatisticas():
+    """Zera os contadores (mantém as entradas)."""
+    with _lock:
+        for k in _stats:
+            _stats[k] = 0
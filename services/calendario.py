@@ -0,0 +1,223 @@
+# services/calendario.py
+"""
+Índice de dias sem atendimento (feriados + bloqueios).
+
+Junta em um único índice, por ordinal da data:
+1. Feriados de config/feriados.json (lista de datas ou {"data", "nome"})
+2. Bloqueios pontuais da agenda (agenda_dinamica.bloqueios_pontuais)
+3. Feriados nacionais recorrentes (fixos + Sexta-feira Santa), que podem
+   ser desligados com "feriados_nacionais": false no feriados.json
+
+O índice é reconstruído apenas quando uma das fontes muda (versão do
+config_registry / nova compilação da agenda), então o seletor de datas,
+o motor de disponibilidade e o painel admin descartam dias fechados com
+uma consulta O(1), antes de qualquer leitura da planilha.
+"""
+
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from services import config_registry
+
+# =========================================================
+# Configuração
+# =========================================================
+FERIADOS_NACIONAIS_FIXOS = {
+    (1, 1): "Confraternização Universal",
+    (21, 4): "Tiradentes",
+    (1, 5): "Dia do Trabalho",
+    (7, 9): "Independência do Brasil",
+    (12, 10): "Nossa Senhora Aparecida",
+    (2, 11): "Finados",
+    (15, 11): "Proclamação da República",
+    (20, 11): "Dia da Consciência Negra",
+    (25, 12): "Natal",
+}
+
+TIPO_FERIADO = "feriado"
+TIPO_BLOQUEIO = "bloqueio"
+
+_lock = threading.Lock()
+_indice: Dict[int, Tuple[str, str]] = {}
+_indice_chave: Optional[Tuple[Any, ...]] = None
+_indice_bloqueios: Any = None   # referência aos bloqueios usados no índice
+_nacionais_ativos = True
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+@lru_cache(maxsize=2048)
+def _data_de_str(data_str: str) -> Optional[date]:
+    try:
+        dia, mes, ano = map(int, data_str.strip().split("/"))
+        return date(ano, mes, dia)
+    except Exception:
+        return None
+
+
+def _para_data(data: Union[str, date]) -> Optional[date]:
+    """Aceita date/datetime ou string DD/MM/YYYY."""
+    if isinstance(data, date):
+        return date(data.year, data.month, data.day)
+    return _data_de_str(str(data or ""))
+
+
+def _pascoa(ano: int) -> date:
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher)."""
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+
+@lru_cache(maxsize=32)
+def _feriados_nacionais(ano: int) -> Dict[int, str]:
+    """Feriados nacionais do ano (ordinal -> nome)."""
+    feriados = {
+        date(ano, mes, dia).toordinal(): nome
+        for (dia, mes), nome in FERIADOS_NACIONAIS_FIXOS.items()
+    }
+    feriados[(_pascoa(ano) - timedelta(days=2)).toordinal()] = "Sexta-feira Santa"
+    return feriados
+
+
+def _fontes() -> Tuple[Optional[str], Any]:
+    """Caminho do feriados.json e bloqueios atuais da agenda."""
+    try:
+        from services import excel_services as exc
+        feriados_path = exc.FERIADOS_JSON
+    except ImportError:
+        feriados_path = None
+    try:
+        from services import agenda_dinamica as ag
+        bloqueios = ag.bloqueios_indexados()
+    except ImportError:
+        bloqueios = {}
+    return feriados_path, bloqueios
+
+
+def _indice_atual() -> Dict[int, Tuple[str, str]]:
+    """Índice explícito (ordinal -> (tipo, motivo)), reconstruído se as fontes mudaram."""
+    global _indice, _indice_chave, _indice_bloqueios, _nacionais_ativos
+
+    feriados_path, bloqueios = _fontes()
+    versao = config_registry.versao(feriados_path) if feriados_path else 0
+    chave = (feriados_path, versao)
+    if chave == _indice_chave and bloqueios is _indice_bloqueios:
+        return _indice
+
+    with _lock:
+        if chave == _indice_chave and bloqueios is _indice_bloqueios:
+            return _indice
+
+        indice: Dict[int, Tuple[str, str]] = {}
+        config = config_registry.obter(feriados_path, {}) if feriados_path else {}
+        for item in config.get("feriados", ()):
+            if isinstance(item, str):
+                data_str, nome = item, "Feriado"
+            else:
+                data_str, nome = item.get("data", ""), item.get("nome") or "Feriado"
+            d = _data_de_str(str(data_str))
+            if d:
+                indice[d.toordinal()] = (TIPO_FERIADO, nome)
+
+        # Bloqueio do admin prevalece sobre feriado na mesma data
+        for data_str, motivo in bloqueios.items():
+            d = _data_de_str(str(data_str))
+            if d:
+                indice[d.toordinal()] = (TIPO_BLOQUEIO, motivo or "Dia bloqueado")
+
+        _nacionais_ativos = bool(config.get("feriados_nacionais", True))
+        _indice = indice
+        _indice_chave = chave
+        _indice_bloqueios = bloqueios
+        return indice
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def obter_fechamento(data: Union[str, date]) -> Optional[Dict[str, str]]:
+    """
+    Motivo de a data não ter atendimento por feriado ou bloqueio.
+
+    Args:
+        data: date ou string DD/MM/YYYY
+
+    Returns:
+        {"tipo": "feriado"|"bloqueio", "motivo": "..."} ou None se for dia normal
+    """
+    d = _para_data(data)
+    if d is None:
+        return None
+
+    ordinal = d.toordinal()
+    indice = _indice_atual()
+    if ordinal in indice:
+        tipo, motivo = indice[ordinal]
+        return {"tipo": tipo, "motivo": motivo}
+
+    if _nacionais_ativos:
+        nome = _feriados_nacionais(d.year).get(ordinal)
+        if nome:
+            return {"tipo": TIPO_FERIADO, "motivo": nome}
+
+    return None
+
+
+def eh_dia_fechado(data: Union[str, date]) -> bool:
+    """True se a data é feriado ou está bloqueada."""
+    return obter_fechamento(data) is not None
+
+
+def eh_feriado(data: Union[str, date]) -> bool:
+    """True se a data é feriado (arquivo ou nacional)."""
+    fechamento = obter_fechamento(data)
+    return bool(fechamento and fechamento["tipo"] == TIPO_FERIADO)
+
+
+def dia_de_atendimento(data: Union[str, date]) -> bool:
+    """True se a data não está fechada e a agenda tem expediente nela."""
+    d = _para_data(data)
+    if d is None or eh_dia_fechado(d):
+        return False
+    try:
+        from services import agenda_dinamica as ag
+    except ImportError:
+        return d.weekday() != 6
+    return ag.obter_janela_dia(d.strftime("%d/%m/%Y")) is not None
+
+
+def proximos_dias_de_atendimento(
+    inicio: date,
+    quantidade: int,
+    limite_dias: int = 60
+) -> List[date]:
+    """
+    Próximas `quantidade` datas com atendimento a partir de `inicio` (inclusive).
+
+    Args:
+        inicio: Primeira data candidata
+        quantidade: Quantas datas retornar
+        limite_dias: Máximo de dias corridos a verificar
+    """
+    datas: List[date] = []
+    for offset in range(max(limite_dias, 0)):
+        if len(datas) >= quantidade:
+            break
+        d = inicio + timedelta(days=offset)
+        if dia_de_atendimento(d):
+            datas.append(d)
+    return datas
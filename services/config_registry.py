@@ -0,0 +1,152 @@
+# services/config_registry.py
+"""
+Registro único dos arquivos de configuração JSON.
+
+Cada arquivo (servicos.json, servicos_detalhados.json, feriados.json,
+admins.json, agenda_config.json) é lido do disco uma única vez e mantido
+em memória. A cada acesso só é feito um os.stat: se a assinatura
+(mtime, inode, tamanho) mudou, o arquivo é relido e sua versão sobe.
+
+As versões servem de chave para caches derivados (ex.: grades de
+disponibilidade). Os dados são entregues como visões imutáveis
+(MappingProxyType / tuple) para que nenhum consumidor altere o cache.
+"""
+
+import os
+import json
+import logging
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+
+class _Entrada:
+    __slots__ = ("assinatura", "dados", "visao", "versao")
+
+    def __init__(self, assinatura, dados, versao: int):
+        self.assinatura = assinatura
+        self.dados = dados
+        self.visao = _congelar(dados)
+        self.versao = versao
+
+
+_lock = threading.Lock()
+_entradas: Dict[str, _Entrada] = {}
+_stats = {"leituras": 0, "erros": 0}
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def caminho(nome: str) -> str:
+    """Caminho absoluto: nomes relativos são buscados em config/."""
+    if not os.path.isabs(nome):
+        nome = os.path.join(CONFIG_DIR, nome)
+    return os.path.abspath(nome)
+
+
+def _assinatura(path: str) -> Optional[Tuple[int, int, int]]:
+    """(mtime_ns, inode, tamanho) do arquivo, ou None se não existir."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def _congelar(obj: Any) -> Any:
+    """Cópia imutável de uma estrutura JSON (dict -> MappingProxyType, list -> tuple)."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _congelar(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_congelar(v) for v in obj)
+    return obj
+
+
+def _entrada(nome: str, forcar: bool = False) -> _Entrada:
+    """Entrada atualizada do arquivo (relê apenas se a assinatura mudou)."""
+    path = caminho(nome)
+    assinatura = _assinatura(path)
+
+    entrada = _entradas.get(path)
+    if entrada is not None and not forcar and entrada.assinatura == assinatura:
+        return entrada
+
+    with _lock:
+        entrada = _entradas.get(path)
+        if entrada is not None and not forcar and entrada.assinatura == assinatura:
+            return entrada
+
+        dados = None
+        if assinatura is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+                _stats["leituras"] += 1
+            except Exception as e:
+                _stats["erros"] += 1
+                logger.warning(f"[CONFIG] Falha lendo {os.path.basename(path)}: {e}")
+                if entrada is not None:
+                    # Mantém a última versão válida até o arquivo ser corrigido
+                    entrada.assinatura = assinatura
+                    return entrada
+
+        nova = _Entrada(assinatura, dados, (entrada.versao + 1) if entrada else 1)
+        _entradas[path] = nova
+        return nova
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def obter(nome: str, padrao: Any = None) -> Any:
+    """
+    Retorna a visão imutável do JSON (ou `padrao` se o arquivo não existir).
+
+    Args:
+        nome: Nome do arquivo em config/ ou caminho absoluto
+        padrao: Valor retornado se o arquivo não existir/for inválido
+    """
+    entrada = _entrada(nome)
+    return padrao if entrada.dados is None else entrada.visao
+
+
+def obter_original(nome: str, forcar: bool = False) -> Any:
+    """
+    Retorna o objeto JSON mutável compartilhado (None se não existir).
+    Para módulos que editam e salvam o próprio arquivo (agenda).
+    """
+    return _entrada(nome, forcar=forcar).dados
+
+
+def versao(nome: str) -> int:
+    """Versão do arquivo: sobe a cada releitura por mudança no disco."""
+    return _entrada(nome).versao
+
+
+def invalidar(nome: str):
+    """Força releitura no próximo acesso (após gravar o arquivo)."""
+    with _lock:
+        entrada = _entradas.get(caminho(nome))
+        if entrada is not None:
+            entrada.assinatura = ("invalidado",)
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Leituras de disco e versões atuais dos arquivos carregados."""
+    with _lock:
+        return {
+            **_stats,
+            "arquivos": {
+                os.path.basename(p): e.versao for p, e in _entradas.items()
+            },
+        }
@@ -0,0 +1,256 @@
+# services/dedup_eventos.py
+"""
+Deduplicação dos eventos do webhook do WAHA, com prazo (TTL).
+
+O webhook guardava os ids vistos em um deque(maxlen=2000) e procurava
+cada id com `in` (busca linear). Além disso, o deque era por processo:
+com 2 workers do gunicorn, um reenvio do WAHA que caía no outro worker
+era processado de novo. Aqui cada id fica marcado por DEDUP_TTL_S e a
+verificação + marcação é uma operação só (atômica no backend).
+
+Backends (variável DEDUP_BACKEND):
+1. "memoria" (padrão): dict + fila de expiração no processo, O(1) por
+   evento e no máximo DEDUP_MAX ids. Suficiente com um único processo.
+2. "sqlite": arquivo SQLite compartilhado entre os workers do gunicorn
+   (DEDUP_DB, padrão: dedup_eventos.sqlite3 ao lado da planilha).
+3. "redis": SET NX EX em DEDUP_REDIS_URL (requer o pacote redis; sem
+   ele, usa memória). Para vários containers/hosts.
+
+Falha no backend compartilhado não bloqueia mensagens: o evento é
+tratado como novo (melhor processar em dobro do que perder).
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+BACKEND = os.getenv("DEDUP_BACKEND", "memoria").strip().lower()
+TTL_S = float(os.getenv("DEDUP_TTL_S", "900"))
+MAX_IDS = int(os.getenv("DEDUP_MAX", "20000"))
+DB_PATH = os.getenv("DEDUP_DB", "")
+REDIS_URL = os.getenv("DEDUP_REDIS_URL", "redis://localhost:6379/0")
+PREFIXO_REDIS = "zapwaha:evento:"
+LIMPEZA_A_CADA = 500  # Inserções entre limpezas dos ids vencidos (sqlite)
+
+_stats = {"novos": 0, "duplicados": 0, "erros": 0}
+_stats_lock = threading.Lock()
+
+
+# =========================================================
+# Backends
+# =========================================================
+
+class _BackendMemoria:
+    """Ids em um dict do processo; a fila guarda a ordem de expiração."""
+
+    def __init__(self, ttl: float, maximo: int):
+        self.ttl = ttl
+        self.maximo = max(maximo, 1)
+        self._lock = threading.Lock()
+        self._vistos: Dict[str, float] = {}              # id -> expira (monotonic)
+        self._expiracao: Deque[Tuple[float, str]] = deque()
+
+    def _remover_vencidos(self, agora: float):
+        while self._expiracao and (self._expiracao[0][0] <= agora or len(self._vistos) > self.maximo):
+            expira, evento_id = self._expiracao.popleft()
+            if self._vistos.get(evento_id) == expira:
+                del self._vistos[evento_id]
+
+    def marcar(self, evento_id: str) -> bool:
+        agora = time.monotonic()
+        with self._lock:
+            self._remover_vencidos(agora)
+            if evento_id in self._vistos:
+                return False
+            expira = agora + self.ttl
+            self._vistos[evento_id] = expira
+            self._expiracao.append((expira, evento_id))
+            if len(self._vistos) > self.maximo:
+                self._remover_vencidos(agora)
+            return True
+
+    def esquecer(self, evento_id: str):
+        with self._lock:
+            self._vistos.pop(evento_id, None)  # a entrada na fila de expiração vira órfã e é ignorada
+
+    def tamanho(self) -> int:
+        with self._lock:
+            return len(self._vistos)
+
+
+class _BackendSQLite:
+    """Ids em um arquivo SQLite compartilhado entre processos."""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._insercoes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        con = self._conexao()
+        con.execute("CREATE TABLE IF NOT EXISTS eventos (id TEXT PRIMARY KEY, expira REAL NOT NULL)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_eventos_expira ON eventos (expira)")
+
+    def _conexao(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def marcar(self, evento_id: str) -> bool:
+        agora = time.time()
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("DELETE FROM eventos WHERE id = ? AND expira <= ?", (evento_id, agora))
+            novo = con.execute(
+                "INSERT OR IGNORE INTO eventos (id, expira) VALUES (?, ?)", (evento_id, agora + self.ttl)
+            ).rowcount == 1
+            self._insercoes += novo
+            if self._insercoes >= LIMPEZA_A_CADA:
+                con.execute("DELETE FROM eventos WHERE expira <= ?", (agora,))
+                self._insercoes = 0
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return novo
+
+    def esquecer(self, evento_id: str):
+        self._conexao().execute("DELETE FROM eventos WHERE id = ?", (evento_id,))
+
+    def tamanho(self) -> int:
+        return self._conexao().execute("SELECT COUNT(*) FROM eventos WHERE expira > ?", (time.time(),)).fetchone()[0]
+
+
+class _BackendRedis:
+    """SET NX EX: o primeiro processo a marcar o id vence."""
+
+    def __init__(self, cliente: Any, ttl: float):
+        self.cliente = cliente
+        self.ttl = max(int(ttl), 1)
+
+    def marcar(self, evento_id: str) -> bool:
+        return bool(self.cliente.set(f"{PREFIXO_REDIS}{evento_id}", 1, nx=True, ex=self.ttl))
+
+    def esquecer(self, evento_id: str):
+        self.cliente.delete(f"{PREFIXO_REDIS}{evento_id}")
+
+    def tamanho(self) -> Optional[int]:
+        return None  # contar chaves no Redis custa um SCAN; não vale para métrica
+
+
+def _caminho_db() -> str:
+    if DB_PATH:
+        return DB_PATH
+    try:
+        from services import excel_services as exc
+        pasta = os.path.dirname(exc.FILE_PATH)
+    except ImportError:
+        pasta = os.path.join(os.path.dirname(__file__), "..", "data")
+    return os.path.join(pasta, "dedup_eventos.sqlite3")
+
+
+def _criar_redis() -> Optional[_BackendRedis]:
+    try:
+        import redis
+    except ImportError:
+        logger.warning("[DEDUP] Pacote redis não instalado, usando memória")
+        return None
+    return _BackendRedis(redis.Redis.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1), TTL_S)
+
+
+_backends: Dict[Any, Any] = {}
+_backends_lock = threading.Lock()
+
+
+def _backend():
+    """Backend configurado (um por tipo/caminho, criado na primeira chamada)."""
+    chave = (BACKEND, TTL_S, MAX_IDS, _caminho_db() if BACKEND == "sqlite" else None)
+    backend = _backends.get(chave)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(chave)
+            if backend is None:
+                if BACKEND == "sqlite":
+                    backend = _BackendSQLite(chave[3], TTL_S)
+                elif BACKEND == "redis":
+                    backend = _criar_redis()
+                elif BACKEND != "memoria":
+                    logger.warning(f"[DEDUP] Backend desconhecido '{BACKEND}', usando memória")
+                if backend is None:
+                    backend = _BackendMemoria(TTL_S, MAX_IDS)
+                _backends[chave] = backend
+    return backend
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def ja_visto(evento_id: Optional[str]) -> bool:
+    """
+    Verifica e marca o evento numa operação só.
+
+    Returns:
+        True se o id já foi visto dentro do TTL (duplicado); False se é
+        novo (ou sem id, ou se o backend falhou)
+    """
+    if not evento_id:
+        return False
+    try:
+        novo = _backend().marcar(str(evento_id))
+    except Exception as e:
+        logger.error(f"[DEDUP] Falha no backend {BACKEND}: {e}")
+        with _stats_lock:
+            _stats["erros"] += 1
+        return False
+    with _stats_lock:
+        _stats["novos" if novo else "duplicados"] += 1
+    return not novo
+
+
+def esquecer(evento_id: Optional[str]):
+    """
+    Desfaz ja_visto(): o evento foi marcado mas não chegou a ser aceito
+    (falha ao enfileirar), então o reenvio do WAHA deve ser processado.
+    """
+    if not evento_id:
+        return
+    try:
+        _backend().esquecer(str(evento_id))
+    except Exception as e:
+        logger.error(f"[DEDUP] Falha ao desmarcar {evento_id} no backend {BACKEND}: {e}")
+        with _stats_lock:
+            _stats["erros"] += 1
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Eventos novos/duplicados, erros do backend e ids guardados."""
+    try:
+        guardados = _backend().tamanho()
+    except Exception:
+        guardados = None
+    with _stats_lock:
+        return {**_stats, "backend": BACKEND, "ttl_s": TTL_S, "ids_guardados": guardados}
+
+
+def resetar():
+    """Recria os backends (o de memória esquece os ids) e zera os contadores."""
+    with _backends_lock:
+        _backends.clear()
+    with _stats_lock:
+        for k in _stats:
+            _stats[k] = 0
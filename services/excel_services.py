@@ -1,12 +1,17 @@
 # services/excel_services.py
 import os
 import json
+import heapq
 import threading
+import tempfile
 from datetime import datetime, timedelta
-from typing import Iterable, Dict, List, Optional, Tuple, Any
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from openpyxl import Workbook, load_workbook
 import logging
 
+from services import config_registry
+from services import reservas_temporarias
+
 logger = logging.getLogger("ZapWaha")
 
 # =========================================================
@@ -17,8 +22,13 @@ SHEET_AG = os.getenv("AG_SHEET_NAME", "Agendamentos")
 SHEET_CLIENTES = os.getenv("CLIENTES_SHEET_NAME", "Clientes")  # opcional (para _read_rows_clientes)
 FERIADOS_JSON = os.path.join(os.path.dirname(__file__), "..", "config", "feriados.json")
 
-# Lock global para operações críticas de reserva
-_RESERVA_LOCK = threading.Lock()
+# Locks de reserva: a verificação de disponibilidade roda sob um lock por
+# data (listrado em N_LOCKS_DATA), então clientes reservando dias diferentes
+# não esperam uns pelos outros. Só a gravação da planilha (um arquivo para
+# todas as datas) é serializada em _ESCRITA_LOCK.
+N_LOCKS_DATA = 32
+_LOCKS_DATA = [threading.Lock() for _ in range(N_LOCKS_DATA)]
+_ESCRITA_LOCK = threading.RLock()
 
 HEADERS_AG = [
     "Chave",         # chave única do lançamento
@@ -40,8 +50,11 @@ HEADERS_AG = [
     "CriadoEm",      # timestamp
     "Remarcacoes",   # contador de remarcações (máximo 1)
     "LembreteEnviado", # timestamp do último lembrete enviado
+    "RecursoID",     # cadeira/barbeiro atribuído (agenda_config.json "recursos")
 ]
 
+RECURSO_PADRAO = "principal"  # agenda sem "recursos": um único barbeiro
+
 # estados que bloqueiam o mesmo slot (Data+Hora)
 BLOCKING_STATUSES = set([
     "Reservado",         # Reserva temporária ativa
@@ -51,33 +64,83 @@ BLOCKING_STATUSES = set([
     "Remarcado",
 ])
 
+# estados com prazo (ReservadoAte): vencido o prazo, o slot volta a ficar livre
+STATUS_COM_PRAZO = set([
+    "Reservado",
+    "Pendente Pagamento",
+])
+
+def reserva_vencida(status: Any, reservado_ate: Any, agora: Optional[datetime] = None) -> bool:
+    """
+    True se a linha é uma reserva (ou pagamento pendente) cujo prazo já passou.
+    Leituras tratam essas linhas como livres, sem precisar gravar "Expirado".
+    """
+    if str(status or "").strip() not in STATUS_COM_PRAZO or not reservado_ate:
+        return False
+    try:
+        limite = reservado_ate if isinstance(reservado_ate, datetime) else datetime.fromisoformat(str(reservado_ate).strip())
+    except ValueError:
+        return False
+    return (agora or datetime.now()) > limite
+
+def _status_bloqueia(status: Any, reservado_ate: Any, agora: Optional[datetime] = None) -> bool:
+    """Status bloqueante e, se for reserva temporária, ainda dentro do prazo."""
+    st = str(status or "").strip()
+    return st in BLOCKING_STATUSES and not reserva_vencida(st, reservado_ate, agora)
+
 # =========================================================
 # Helpers de planilha
 # =========================================================
+def _salvar_planilha(wb):
+    """
+    Grava a planilha de forma atômica (arquivo temporário + os.replace).
+    Leitores concorrentes (pré-cálculo, outros workers) nunca veem o
+    arquivo pela metade.
+    """
+    pasta = os.path.dirname(os.path.abspath(FILE_PATH))
+    fd, tmp = tempfile.mkstemp(prefix=".agendamentos_", suffix=".xlsx", dir=pasta)
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        os.replace(tmp, FILE_PATH)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 def _ensure_file_and_sheet():
     """Cria arquivo/sheet se não existirem; garante cabeçalho da aba de Agendamentos."""
     os.makedirs(os.path.dirname(FILE_PATH), exist_ok=True)
     if not os.path.exists(FILE_PATH):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = SHEET_AG
-        for idx, h in enumerate(HEADERS_AG, 1):
-            ws.cell(row=1, column=idx, value=h)
-        wb.save(FILE_PATH)
+        with _ESCRITA_LOCK:
+            if not os.path.exists(FILE_PATH):
+                wb = Workbook()
+                ws = wb.active
+                ws.title = SHEET_AG
+                for idx, h in enumerate(HEADERS_AG, 1):
+                    ws.cell(row=1, column=idx, value=h)
+                _salvar_planilha(wb)
         return
 
     wb = load_workbook(FILE_PATH)
     if SHEET_AG not in wb.sheetnames:
-        ws = wb.create_sheet(SHEET_AG)
-        for idx, h in enumerate(HEADERS_AG, 1):
-            ws.cell(row=1, column=idx, value=h)
-        wb.save(FILE_PATH)
+        with _ESCRITA_LOCK:
+            wb = load_workbook(FILE_PATH)
+            if SHEET_AG not in wb.sheetnames:
+                ws = wb.create_sheet(SHEET_AG)
+                for idx, h in enumerate(HEADERS_AG, 1):
+                    ws.cell(row=1, column=idx, value=h)
+                _salvar_planilha(wb)
         return
 
-    # garantir cabeçalhos na aba
+    # garantir cabeçalhos na aba (só grava se algo mudou: leituras
+    # não devem reescrever a planilha nem alterar seu mtime)
     ws = wb[SHEET_AG]
-    _ensure_headers(ws, HEADERS_AG)
-    wb.save(FILE_PATH)
+    if _ensure_headers(ws, HEADERS_AG):
+        with _ESCRITA_LOCK:
+            wb = load_workbook(FILE_PATH)
+            if _ensure_headers(wb[SHEET_AG], HEADERS_AG):
+                _salvar_planilha(wb)
 
 def _open_ws():
     _ensure_file_and_sheet()
@@ -106,6 +169,26 @@ def _ensure_headers(ws, headers: List[str]):
             changed = True
     return changed
 
+def _lock_data(data_str: str) -> threading.Lock:
+    """Lock da faixa correspondente à data (DD/MM/YYYY)."""
+    return _LOCKS_DATA[hash(str(data_str or "").strip()) % N_LOCKS_DATA]
+
+def _versao_planilha() -> Optional[Tuple[int, int]]:
+    """(mtime_ns, tamanho) da planilha: muda a cada gravação, de qualquer processo."""
+    try:
+        st = os.stat(FILE_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _notificar_mudanca(*datas: str):
+    """Invalida o cache de disponibilidade das datas alteradas."""
+    try:
+        from services import cache_disponibilidade
+    except ImportError:
+        return
+    cache_disponibilidade.invalidar_data(*datas)
+
 def _row_to_dict(ws, row_idx: int) -> dict:
     hm = _get_header_map(ws)
     out = {}
@@ -130,6 +213,7 @@ def _make_row(
     servico_duracao: Optional[int] = None,
     reservado_em: Optional[str] = None,
     reservado_ate: Optional[str] = None,
+    recurso_id: Optional[str] = None,
 ):
     hm = _get_header_map(ws)
     r = ws.max_row + 1
@@ -155,6 +239,7 @@ def _make_row(
     setv("PagamentoStatus", "")
     setv("ValorPago", valor_pago)
     setv("CriadoEm", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    setv("RecursoID", recurso_id or "")
     return r
 
 # =========================================================
@@ -171,6 +256,7 @@ def verificar_disponibilidade(data_str: str, hora_str: str, servico_id: Optional
     Para serviços simples: verifica se há conflito no slot Data+Hora.
     Para serviços fracionados: verifica se os períodos ocupados do serviço
     conflitam com períodos ocupados de outros agendamentos.
+    Reservas temporárias (em memória) também ocupam o horário.
     
     Args:
         data_str: Data no formato DD/MM/YYYY
@@ -180,65 +266,107 @@ def verificar_disponibilidade(data_str: str, hora_str: str, servico_id: Optional
     Returns:
         True se disponível, False caso contrário
     """
-    # Tentar usar verificação fracionada se disponível
-    try:
-        from services import servicos_fracionados as sf
-        
-        # Se servico_id não fornecido, assume simples
-        if not servico_id:
-            servico_id = "corte_simples"
-        
-        # Buscar todos os agendamentos ativos
-        _, ws = _open_ws()
-        hm = _get_header_map(ws)
-        c_data = hm.get("Data")
-        c_hora = hm.get("Hora")
-        c_status = hm.get("Status")
-        c_servico = hm.get("ServicoID")
+    _, ws = _open_ws()
+    return _verificar_disponibilidade_ws(ws, data_str, hora_str, servico_id)
+
+def _verificar_disponibilidade_ws(
+    ws,
+    data_str: str,
+    hora_str: str,
+    servico_id: Optional[str] = None,
+    ignorar_reserva: Optional[str] = None,
+) -> bool:
+    """verificar_disponibilidade sobre uma aba já carregada."""
+    return _recurso_livre_ws(ws, data_str, hora_str, servico_id, ignorar_reserva) is not None
+
+def _recurso_livre_ws(
+    ws,
+    data_str: str,
+    hora_str: str,
+    servico_id: Optional[str] = None,
+    ignorar_reserva: Optional[str] = None,
+    preferido: Optional[str] = None,
+) -> Optional[str]:
+    """Recurso livre no horário, considerando a aba carregada e as reservas temporárias."""
+    reservas = [
+        r for r in linhas_reservas_temporarias(data_str)
+        if r["Chave"] != ignorar_reserva
+    ]
+    return _recurso_livre(data_str, hora_str, servico_id, _linhas_bloqueantes(ws) + reservas, preferido)
+
+def _linhas_bloqueantes(ws, agora: Optional[datetime] = None) -> List[Dict[str, str]]:
+    """Data/Hora/ServicoID das linhas que ocupam horário."""
+    hm = _get_header_map(ws)
+    c_data = hm.get("Data")
+    c_hora = hm.get("Hora")
+    c_status = hm.get("Status")
+    c_servico = hm.get("ServicoID")
+    c_duracao = hm.get("ServicoDuracao")
+    c_recurso = hm.get("RecursoID")
+    c_ate = hm.get("ReservadoAte")
+    agora = agora or datetime.now()
+    
+    linhas = []
+    for r in range(2, ws.max_row + 1):
+        st = str(ws.cell(row=r, column=c_status).value or "").strip()
+        ate = ws.cell(row=r, column=c_ate).value if c_ate else None
+        if not _status_bloqueia(st, ate, agora):
+            continue
         
-        agendamentos_existentes = []
-        for r in range(2, ws.max_row + 1):
-            st = str(ws.cell(row=r, column=c_status).value or "").strip()
-            if st not in BLOCKING_STATUSES:
-                continue
-            
-            d = str(ws.cell(row=r, column=c_data).value or "").strip()
-            h = str(ws.cell(row=r, column=c_hora).value or "").strip()
-            s = str(ws.cell(row=r, column=c_servico).value or "corte_simples").strip()
-            
-            if d and h:
-                agendamentos_existentes.append({
-                    "Data": d,
-                    "Hora": h,
-                    "ServicoID": s
-                })
+        d = str(ws.cell(row=r, column=c_data).value or "").strip()
+        h = str(ws.cell(row=r, column=c_hora).value or "").strip()
+        s = str(ws.cell(row=r, column=c_servico).value or "corte_simples").strip() if c_servico else "corte_simples"
         
-        # Usar verificação fracionada
-        disponivel, mensagem = sf.verificar_disponibilidade_fracionado(
-            servico_id=servico_id,
-            data=data_str,
-            horario_inicio=hora_str,
-            agendamentos_existentes=agendamentos_existentes
+        if d and h:
+            linhas.append({
+                "Data": d,
+                "Hora": h,
+                "ServicoID": s,
+                "ServicoDuracao": ws.cell(row=r, column=c_duracao).value if c_duracao else None,
+                "RecursoID": str(ws.cell(row=r, column=c_recurso).value or "").strip() if c_recurso else "",
+            })
+    return linhas
+
+def _recurso_livre(
+    data_str: str,
+    hora_str: str,
+    servico_id: Optional[str],
+    agendamentos_existentes: List[Dict[str, Any]],
+    preferido: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Passo de atribuição: cadeira/barbeiro livre para o serviço no horário.
+    Checa contra agendamentos já filtrados como bloqueantes.
+    
+    Returns:
+        ID do recurso, ou None se o horário não está livre
+    """
+    # Se servico_id não fornecido, assume simples
+    if not servico_id:
+        servico_id = "corte_simples"
+    
+    # Ocupação por recurso em bitsets (inclui pausas de serviços fracionados)
+    try:
+        from services import slots_dinamicos
+        return slots_dinamicos.escolher_recurso(
+            data_str, hora_str, servico_id, agendamentos_existentes, preferido
         )
-        
-        return disponivel
-        
     except Exception as e:
-        # Fallback para verificação simples
-        _, ws = _open_ws()
-        hm = _get_header_map(ws)
-        c_data = hm.get("Data")
-        c_hora = hm.get("Hora")
-        c_status = hm.get("Status")
+        # Fallback para verificação simples (um único barbeiro)
+        logger.warning(f"[RESERVA] Falha na verificação por recurso, usando slot simples: {e}")
+        for ag in agendamentos_existentes:
+            if ag.get("Data") == data_str and ag.get("Hora") == hora_str:
+                return None
+        return RECURSO_PADRAO
 
-        for r in range(2, ws.max_row + 1):
-            d = str(ws.cell(row=r, column=c_data).value or "").strip()
-            h = str(ws.cell(row=r, column=c_hora).value or "").strip()
-            if d == data_str and h == hora_str:
-                st = str(ws.cell(row=r, column=c_status).value or "").strip()
-                if st in BLOCKING_STATUSES:
-                    return False
-        return True
+def _disponivel_entre(
+    data_str: str,
+    hora_str: str,
+    servico_id: Optional[str],
+    agendamentos_existentes: List[Dict[str, Any]],
+) -> bool:
+    """Checa o horário contra agendamentos já filtrados como bloqueantes."""
+    return _recurso_livre(data_str, hora_str, servico_id, agendamentos_existentes) is not None
 
 def adicionar_agendamento(
     data_str: str,
@@ -257,38 +385,81 @@ def adicionar_agendamento(
     Cria linha na planilha de agendamentos e retorna a 'Chave'.
     Se já houver bloqueio no slot, levanta ValueError.
     """
-    if not verificar_disponibilidade(data_str, hora_str, servico_id):
-        raise ValueError("Horário indisponível")
-
-    wb, ws = _open_ws()
-    _ensure_headers(ws, HEADERS_AG)
     chave = make_key(data_str, hora_str, chat_id)
 
-    _make_row(
-        ws=ws,
-        chave=chave,
-        data_str=data_str,
-        hora_str=hora_str,
-        chat_id=chat_id,
-        cliente_id=cliente_id,
-        cliente_nome=cliente_nome,
-        nasc=data_nasc,
-        cpf=cpf,
-        status=status,
-        valor_pago=valor_pago,
-        servico_id=servico_id,
-        servico_duracao=servico_duracao,
-    )
-    wb.save(FILE_PATH)
+    def inserir(ws, recurso_id):
+        _make_row(
+            ws=ws,
+            chave=chave,
+            data_str=data_str,
+            hora_str=hora_str,
+            chat_id=chat_id,
+            cliente_id=cliente_id,
+            cliente_nome=cliente_nome,
+            nasc=data_nasc,
+            cpf=cpf,
+            status=status,
+            valor_pago=valor_pago,
+            servico_id=servico_id,
+            servico_duracao=servico_duracao,
+            recurso_id=recurso_id,
+        )
+        return True
+
+    if not _inserir_se_disponivel(data_str, hora_str, servico_id, inserir):
+        raise ValueError("Horário indisponível")
     return chave
 
+def _inserir_se_disponivel(
+    data_str: str,
+    hora_str: str,
+    servico_id: Optional[str],
+    inserir: Callable[[Any, str], Any],
+    ignorar_reserva: Optional[str] = None,
+    recurso_preferido: Optional[str] = None,
+) -> Any:
+    """
+    Verifica o horário e grava a nova linha com lock por data + validação otimista.
+    inserir(ws, recurso_id) recebe a cadeira/barbeiro atribuído.
+
+    A leitura/verificação roda só sob o lock da data. No commit, já com
+    _ESCRITA_LOCK, a planilha é recarregada de qualquer forma para a
+    gravação; se a versão dela mudou desde a verificação (outra data ou
+    outro worker gravou, ou uma reserva temporária foi criada), a
+    disponibilidade é reconferida nessa cópia.
+
+    Returns:
+        Resultado de inserir(ws, recurso_id), ou None se o horário não está livre
+    """
+    with _lock_data(data_str):
+        versao = (_versao_planilha(), reservas_temporarias.versao())
+        _, ws = _open_ws()
+        recurso = _recurso_livre_ws(ws, data_str, hora_str, servico_id, ignorar_reserva, recurso_preferido)
+        if recurso is None:
+            return None
+
+        with _ESCRITA_LOCK:
+            wb, ws = _open_ws()
+            _ensure_headers(ws, HEADERS_AG)
+            if (_versao_planilha(), reservas_temporarias.versao()) != versao:
+                recurso = _recurso_livre_ws(ws, data_str, hora_str, servico_id, ignorar_reserva, recurso)
+                if recurso is None:
+                    logger.info(f"[RESERVA] Conflito no commit para {data_str} {hora_str}")
+                    return None
+            resultado = inserir(ws, recurso)
+            _salvar_planilha(wb)
+            _notificar_mudanca(data_str)
+            return resultado
+
 def _find_row_by_key(ws, chave: str) -> Optional[int]:
     hm = _get_header_map(ws)
     c_key = hm.get("Chave")
     if not c_key:
         return None
     chave = str(chave or "").strip()
-    for r in range(2, ws.max_row + 1):
+    # A linha mais recente vence (a mesma chave pode reaparecer após
+    # cancelamento ou reserva vencida)
+    for r in range(ws.max_row, 1, -1):
         v = str(ws.cell(row=r, column=c_key).value or "").strip()
         if v == chave:
             return r
@@ -314,30 +485,75 @@ def atualizar_status_por_chave(*args) -> bool:
     """
     Modo 1 (recomendado): atualizar_status_por_chave(chave, novo_status)
     Modo 2 (compat):      atualizar_status_por_chave(data, hora, chat_id, novo_status)
+
+    Se a chave for de uma reserva temporária, ela é gravada na planilha
+    (Pendente Pagamento / Confirmado) ou apenas descartada (demais status).
     """
-    wb, ws = _open_ws()
-    _ensure_headers(ws, HEADERS_AG)
-    hm = _get_header_map(ws)
-    c_status = hm.get("Status")
+    if len(args) == 2 and reservas_temporarias.obter(str(args[0] or "").strip()) is not None:
+        chave, new_status = str(args[0]).strip(), str(args[1] or "").strip()
+        if new_status in ("Pendente Pagamento", "Confirmado"):
+            return persistir_reserva(chave, new_status)
+        reserva = reservas_temporarias.remover(chave)
+        if reserva is not None:
+            _notificar_mudanca(reserva["data"])
+        return reserva is not None
 
-    row = None
-    new_status = None
+    with _ESCRITA_LOCK:
+        wb, ws = _open_ws()
+        _ensure_headers(ws, HEADERS_AG)
+        hm = _get_header_map(ws)
+        c_status = hm.get("Status")
 
-    if len(args) == 2:
-        chave, new_status = args
-        row = _find_row_by_key(ws, chave)
-    elif len(args) == 4:
-        data_str, hora_str, chat_id, new_status = args
-        row = _find_row_by_triplet(ws, data_str, hora_str, chat_id)
-    else:
-        raise TypeError("Uso: atualizar_status_por_chave(chave, status) OU atualizar_status_por_chave(data,hora,chat_id,status)")
+        row = None
+        new_status = None
 
-    if row is None:
-        return False
+        if len(args) == 2:
+            chave, new_status = args
+            row = _find_row_by_key(ws, chave)
+        elif len(args) == 4:
+            data_str, hora_str, chat_id, new_status = args
+            row = _find_row_by_triplet(ws, data_str, hora_str, chat_id)
+        else:
+            raise TypeError("Uso: atualizar_status_por_chave(chave, status) OU atualizar_status_por_chave(data,hora,chat_id,status)")
 
-    ws.cell(row=row, column=c_status, value=str(new_status or "").strip())
-    wb.save(FILE_PATH)
-    return True
+        if row is None:
+            return False
+
+        ws.cell(row=row, column=c_status, value=str(new_status or "").strip())
+        _salvar_planilha(wb)
+        c_data = hm.get("Data")
+        if c_data:
+            _notificar_mudanca(str(ws.cell(row=row, column=c_data).value or ""))
+        return True
+
+def atualizar_campos_por_chave(chave: str, campos: Dict[str, Any]) -> bool:
+    """
+    Grava colunas da linha mais recente da chave (ex.: PagamentoStatus,
+    LembreteEnviado) sob _ESCRITA_LOCK, com gravação atômica e
+    invalidação do cache da data. Quem altera a planilha fora deste
+    módulo deve passar por aqui: carregar e salvar sem o lock sobrescreve
+    linhas gravadas no meio do caminho.
+
+    Returns:
+        True se a linha existe e foi gravada
+    """
+    with _ESCRITA_LOCK:
+        wb, ws = _open_ws()
+        _ensure_headers(ws, HEADERS_AG)
+        hm = _get_header_map(ws)
+        row = _find_row_by_key(ws, chave)
+        if row is None:
+            return False
+        for nome, valor in campos.items():
+            col = hm.get(nome)
+            if col is None:
+                raise KeyError(f"Coluna desconhecida: {nome}")
+            ws.cell(row=row, column=col, value=valor)
+        _salvar_planilha(wb)
+        c_data = hm.get("Data")
+        if c_data:
+            _notificar_mudanca(str(ws.cell(row=row, column=c_data).value or ""))
+        return True
 
 def atualizar_status(chave: str, new_status: str) -> bool:
     """Fallback simples por chave."""
@@ -360,54 +576,60 @@ def atualizar_agendamento_remarcar(chave_antiga: str, nova_data: str, nova_hora:
         - sucesso: True se atualizado, False se erro
         - mensagem_erro: None se sucesso, string com erro caso contrário
     """
-    wb, ws = _open_ws()
-    _ensure_headers(ws, HEADERS_AG)
-    hm = _get_header_map(ws)
+    with _ESCRITA_LOCK:
+        wb, ws = _open_ws()
+        _ensure_headers(ws, HEADERS_AG)
+        hm = _get_header_map(ws)
     
-    row = _find_row_by_key(ws, chave_antiga)
-    if row is None:
-        return False, "Agendamento não encontrado."
+        row = _find_row_by_key(ws, chave_antiga)
+        if row is None:
+            return False, "Agendamento não encontrado."
     
-    # Verificar contador de remarcações
-    c_remarcacoes = hm.get("Remarcacoes")
-    remarcacoes_atuais = 0
-    if c_remarcacoes:
-        valor = ws.cell(row=row, column=c_remarcacoes).value
-        try:
-            remarcacoes_atuais = int(valor) if valor else 0
-        except (ValueError, TypeError):
-            remarcacoes_atuais = 0
+        # Verificar contador de remarcações
+        c_remarcacoes = hm.get("Remarcacoes")
+        remarcacoes_atuais = 0
+        if c_remarcacoes:
+            valor = ws.cell(row=row, column=c_remarcacoes).value
+            try:
+                remarcacoes_atuais = int(valor) if valor else 0
+            except (ValueError, TypeError):
+                remarcacoes_atuais = 0
     
-    # Verificar se já atingiu o limite de remarcações
-    if remarcacoes_atuais >= 1:
-        return False, "limite_atingido"
+        # Verificar se já atingiu o limite de remarcações
+        if remarcacoes_atuais >= 1:
+            return False, "limite_atingido"
     
-    # Obter ChatId para gerar nova chave
-    c_chat = hm.get("ChatId")
-    chat_id = str(ws.cell(row=row, column=c_chat).value or "").strip()
+        # Obter ChatId para gerar nova chave
+        c_chat = hm.get("ChatId")
+        chat_id = str(ws.cell(row=row, column=c_chat).value or "").strip()
+        data_antiga = str(ws.cell(row=row, column=hm["Data"]).value or "") if hm.get("Data") else ""
     
-    # Gerar nova chave
-    nova_chave = make_key(nova_data, nova_hora, chat_id)
+        # Gerar nova chave
+        nova_chave = make_key(nova_data, nova_hora, chat_id)
     
-    # Atualizar campos
-    c_chave = hm.get("Chave")
-    c_data = hm.get("Data")
-    c_hora = hm.get("Hora")
-    c_status = hm.get("Status")
+        # Atualizar campos
+        c_chave = hm.get("Chave")
+        c_data = hm.get("Data")
+        c_hora = hm.get("Hora")
+        c_status = hm.get("Status")
     
-    if c_chave:
-        ws.cell(row=row, column=c_chave, value=nova_chave)
-    if c_data:
-        ws.cell(row=row, column=c_data, value=nova_data)
-    if c_hora:
-        ws.cell(row=row, column=c_hora, value=nova_hora)
-    if c_status:
-        ws.cell(row=row, column=c_status, value="Confirmado")
-    if c_remarcacoes:
-        ws.cell(row=row, column=c_remarcacoes, value=remarcacoes_atuais + 1)
+        if c_chave:
+            ws.cell(row=row, column=c_chave, value=nova_chave)
+        if c_data:
+            ws.cell(row=row, column=c_data, value=nova_data)
+        if c_hora:
+            ws.cell(row=row, column=c_hora, value=nova_hora)
+        if c_status:
+            ws.cell(row=row, column=c_status, value="Confirmado")
+        if c_remarcacoes:
+            ws.cell(row=row, column=c_remarcacoes, value=remarcacoes_atuais + 1)
+        if hm.get("RecursoID"):
+            # Nova data: o índice atribui o primeiro recurso livre no novo horário
+            ws.cell(row=row, column=hm["RecursoID"], value="")
     
-    wb.save(FILE_PATH)
-    return True, None
+        _salvar_planilha(wb)
+        _notificar_mudanca(data_antiga, nova_data)
+        return True, None
 
 # =========================================================
 # Leitura (para painéis/relatórios)
@@ -498,6 +720,7 @@ def tem_agendamento_ativo_na_semana(chat_id: str) -> Tuple[bool, Optional[Dict[s
     c_data = hm.get("Data")
     c_hora = hm.get("Hora")
     c_status = hm.get("Status")
+    c_ate = hm.get("ReservadoAte")
     
     if not all([c_chat, c_data, c_hora, c_status]):
         return False, None
@@ -513,8 +736,9 @@ def tem_agendamento_ativo_na_semana(chat_id: str) -> Tuple[bool, Optional[Dict[s
         if jid != chat_id:
             continue
         
-        # Verificar se tem status bloqueante (não cancelado)
-        if status not in BLOCKING_STATUSES:
+        # Verificar se tem status bloqueante (não cancelado / reserva no prazo)
+        ate = ws.cell(row=r, column=c_ate).value if c_ate else None
+        if not _status_bloqueia(status, ate, agora):
             continue
         
         data_str = str(ws.cell(row=r, column=c_data).value or "").strip()
@@ -536,6 +760,22 @@ def tem_agendamento_ativo_na_semana(chat_id: str) -> Tuple[bool, Optional[Dict[s
         except Exception:
             continue
     
+    # Reserva temporária em andamento também conta
+    for reserva in reservas_temporarias.ativas(agora=agora):
+        if reserva.get("chat_id") != chat_id:
+            continue
+        try:
+            data_hora = datetime.strptime(f"{reserva['data']} {reserva['hora']}", "%d/%m/%Y %H:%M")
+        except (KeyError, ValueError):
+            continue
+        if reserva["data"] == hoje_str or data_hora >= agora:
+            return True, {
+                "Data": reserva["data"],
+                "Hora": reserva["hora"],
+                "Status": "Reservado",
+                "data_hora_obj": data_hora
+            }
+    
     return False, None
 
 def buscar_proximo_agendamento(chat_id: str) -> Optional[Dict[str, Any]]:
@@ -642,7 +882,7 @@ def buscar_historico_completo(cpf: str) -> List[Dict[str, Any]]:
 
 def eh_feriado(data_str: str) -> bool:
     """
-    Verifica se a data é um feriado bloqueado.
+    Verifica se a data é um feriado bloqueado (feriados.json ou nacional).
     
     Args:
         data_str: Data no formato DD/MM/YYYY
@@ -651,13 +891,13 @@ def eh_feriado(data_str: str) -> bool:
         True se é feriado, False caso contrário
     """
     try:
-        if not os.path.exists(FERIADOS_JSON):
-            return False
-        
-        with open(FERIADOS_JSON, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            feriados = config.get("feriados", [])
-            return data_str in feriados
+        from services import calendario
+        return calendario.eh_feriado(data_str)
+    except ImportError:
+        pass
+    try:
+        config = config_registry.obter(FERIADOS_JSON, {})
+        return data_str in config.get("feriados", ())
     except Exception:
         return False
 
@@ -706,6 +946,9 @@ def reservar_slot_temporario(
     """
     Reserva um slot temporariamente por X minutos.
     
+    A reserva fica só no backend de reservas temporárias (sem gravar a
+    planilha) e vai para o xlsx ao virar Pendente Pagamento/Confirmado.
+    
     Args:
         data_str: Data DD/MM/YYYY
         hora_str: Hora HH:MM
@@ -715,62 +958,156 @@ def reservar_slot_temporario(
         duracao_reserva_min: Minutos de reserva (padrão: 10)
     
     Returns:
-        Dict com: sucesso, chave, expira_em, mensagem
-    """
-    # LOCK CRÍTICO: verificar e reservar devem ser atômicos
-    with _RESERVA_LOCK:
-        # Verificar se horário ainda está livre
-        if not verificar_disponibilidade(data_str, hora_str):
-            return {
-                "sucesso": False,
-                "chave": None,
-                "expira_em": None,
-                "mensagem": "Horário já está ocupado"
-            }
-        
+        Dict com: sucesso, chave, expira_em, recurso, mensagem
+    """
+    chave = make_key(data_str, hora_str, chat_id)
+    reservado_em = datetime.now()
+    reservado_ate = reservado_em + timedelta(minutes=duracao_reserva_min)
+    reserva = {
+        "chave": chave,
+        "data": data_str,
+        "hora": hora_str,
+        "chat_id": chat_id,
+        "servico_id": servico_id,
+        "servico_duracao": servico_duracao,
+        "cliente_nome": cliente_nome,
+        "cliente_id": cliente_id,
+        "reservado_em": reservado_em.isoformat(),
+        "reservado_ate": reservado_ate.isoformat(),
+        "recurso_id": None,
+    }
+
+    # Verificar e reservar são atômicos: a validação final roda dentro
+    # do backend, contra as reservas ativas da data no mesmo instante
+    try:
+        with _lock_data(data_str):
+            versao = _versao_planilha()
+            _, ws = _open_ws()
+            existentes = _linhas_bloqueantes(ws)
+
+            def atribuir(ativas):
+                nonlocal existentes
+                # Outro worker pode ter gravado uma reserva na planilha (e
+                # tirado do backend) depois da leitura acima: persistir_reserva
+                # grava antes de remover, então dentro da transação basta
+                # reler a planilha se a versão dela mudou
+                if _versao_planilha() != versao:
+                    _, ws_atual = _open_ws()
+                    existentes = _linhas_bloqueantes(ws_atual)
+                # Passo de atribuição: grava na reserva a cadeira/barbeiro livre
+                recurso = _recurso_livre(
+                    data_str, hora_str, servico_id,
+                    existentes + [_linha_de_reserva(r) for r in ativas]
+                )
+                reserva["recurso_id"] = recurso
+                return recurso is not None
+
+            reservado = reservas_temporarias.criar(reserva, atribuir)
+    except Exception as e:
+        return {
+            "sucesso": False,
+            "chave": None,
+            "expira_em": None,
+            "mensagem": f"Erro ao reservar: {str(e)}"
+        }
+
+    if not reservado:
+        return {
+            "sucesso": False,
+            "chave": None,
+            "expira_em": None,
+            "mensagem": "Horário já está ocupado"
+        }
+
+    _notificar_mudanca(data_str)
+    _agendar_expiracao(chave, reservado_ate, ORIGEM_MEMORIA)
+    return {
+        "sucesso": True,
+        "chave": chave,
+        "expira_em": reservado_ate.strftime("%d/%m/%Y %H:%M:%S"),
+        "recurso": reserva["recurso_id"],
+        "mensagem": f"Slot reservado até {reservado_ate.strftime('%H:%M')}"
+    }
+
+
+def _linha_de_reserva(reserva: Dict[str, Any]) -> Dict[str, Any]:
+    """Reserva temporária no formato de linha da planilha."""
+    return {
+        "Chave": reserva.get("chave"),
+        "Data": reserva.get("data"),
+        "Hora": reserva.get("hora"),
+        "ChatId": reserva.get("chat_id"),
+        "ClienteID": reserva.get("cliente_id") or "",
+        "ClienteNome": reserva.get("cliente_nome") or "",
+        "ServicoID": reserva.get("servico_id") or "corte_simples",
+        "ServicoDuracao": reserva.get("servico_duracao") or 40,
+        "Status": "Reservado",
+        "ReservadoEm": reserva.get("reservado_em"),
+        "ReservadoAte": reserva.get("reservado_ate"),
+        "RecursoID": reserva.get("recurso_id") or "",
+    }
+
+
+def linhas_reservas_temporarias(data_str: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reservas temporárias ativas como linhas (para somar às da planilha)."""
+    return [_linha_de_reserva(r) for r in reservas_temporarias.ativas(data_str)]
+
+
+def persistir_reserva(chave: str, status: str) -> bool:
+    """
+    Grava na planilha a reserva temporária com o status informado
+    ("Pendente Pagamento" ou "Confirmado") e a remove da memória.
+    
+    Reserva ainda no prazo já garante o horário; se o prazo venceu,
+    o horário é reconferido antes de gravar.
+    
+    Returns:
+        True se gravado
+    """
+    reserva = reservas_temporarias.obter(chave)
+    if reserva is None:
+        return False
+    data_str, hora_str = reserva["data"], reserva["hora"]
+
+    def inserir(ws, recurso_id):
+        _make_row(
+            ws=ws,
+            chave=chave,
+            data_str=data_str,
+            hora_str=hora_str,
+            chat_id=reserva.get("chat_id"),
+            cliente_id=reserva.get("cliente_id"),
+            cliente_nome=reserva.get("cliente_nome"),
+            nasc=None,
+            cpf=None,
+            servico_id=reserva.get("servico_id"),
+            servico_duracao=reserva.get("servico_duracao"),
+            status=status,
+            reservado_em=reserva.get("reservado_em"),
+            reservado_ate=reserva.get("reservado_ate"),
+            valor_pago=None,
+            recurso_id=recurso_id,
+        )
+        return True
+
+    gravado = _inserir_se_disponivel(
+        data_str, hora_str, reserva.get("servico_id"), inserir,
+        ignorar_reserva=chave, recurso_preferido=reserva.get("recurso_id"),
+    )
+    if not gravado:
+        logger.info(f"[RESERVA] Reserva {chave} venceu e o horário foi ocupado")
+        reservas_temporarias.remover(chave)
+        return False
+
+    # Só remove da memória depois de gravar: o horário nunca fica livre no meio
+    reservas_temporarias.remover(chave)
+    _notificar_mudanca(data_str)
+    if status in STATUS_COM_PRAZO:
         try:
-            wb, ws = _open_ws()
-            _ensure_headers(ws, HEADERS_AG)
-            
-            chave = make_key(data_str, hora_str, chat_id)
-            reservado_em = datetime.now()
-            reservado_ate = reservado_em + timedelta(minutes=duracao_reserva_min)
-            
-            # Criar linha com status "Reservado"
-            _make_row(
-                ws=ws,
-                chave=chave,
-                data_str=data_str,
-                hora_str=hora_str,
-                chat_id=chat_id,
-                cliente_id=cliente_id,
-                cliente_nome=cliente_nome,
-                nasc=None,
-                cpf=None,
-                servico_id=servico_id,
-                servico_duracao=servico_duracao,
-                status="Reservado",
-                reservado_em=reservado_em.isoformat(),
-                reservado_ate=reservado_ate.isoformat(),
-                valor_pago=None
-            )
-            
-            wb.save(FILE_PATH)
-            
-            return {
-                "sucesso": True,
-                "chave": chave,
-                "expira_em": reservado_ate.strftime("%d/%m/%Y %H:%M:%S"),
-                "mensagem": f"Slot reservado até {reservado_ate.strftime('%H:%M')}"
-            }
-        
-        except Exception as e:
-            return {
-                "sucesso": False,
-                "chave": None,
-                "expira_em": None,
-                "mensagem": f"Erro ao reservar: {str(e)}"
-            }
+            _agendar_expiracao(chave, datetime.fromisoformat(reserva["reservado_ate"]), ORIGEM_PLANILHA)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return True
 
 
 def confirmar_reserva(chave: str) -> bool:
@@ -799,53 +1136,160 @@ def cancelar_reserva(chave: str) -> bool:
     return atualizar_status_por_chave(chave, "Cancelado")
 
 
+# Heap de expirações (ReservadoAte, chave, origem). Reservas em memória
+# entram em reservar_slot_temporario; linhas da planilha com prazo
+# (legado "Reservado" e "Pendente Pagamento") na gravação e na primeira
+# carga. Entradas obsoletas (reserva confirmada ou cancelada) são
+# descartadas quando chegam ao topo.
+ORIGEM_MEMORIA = "memoria"
+ORIGEM_PLANILHA = "planilha"
+_EXPIRACOES: List[Tuple[datetime, str, str]] = []
+_EXPIRACOES_CARREGADAS = False
+_EXPIRACOES_COND = threading.Condition()
+ESPERA_MAXIMA_EXPIRACAO_S = 300  # Teto de espera do timer sem reservas pendentes
+
+
+def _agendar_expiracao(chave: str, reservado_ate: datetime, origem: str = ORIGEM_PLANILHA):
+    """Registra a expiração de uma reserva e acorda o timer."""
+    with _EXPIRACOES_COND:
+        heapq.heappush(_EXPIRACOES, (reservado_ate, chave, origem))
+        _EXPIRACOES_COND.notify_all()
+
+
+def _carregar_expiracoes(forcar: bool = False):
+    """Popula o heap com as reservas pendentes (uma vez por processo)."""
+    global _EXPIRACOES_CARREGADAS
+    with _EXPIRACOES_COND:
+        if _EXPIRACOES_CARREGADAS and not forcar:
+            return
+        _EXPIRACOES_CARREGADAS = True
+    
+    pendentes = []
+    for row in _read_rows():
+        if str(row.get("Status") or "").strip() not in STATUS_COM_PRAZO:
+            continue
+        try:
+            reservado_ate = datetime.fromisoformat(str(row.get("ReservadoAte") or "").strip())
+        except ValueError:
+            continue
+        pendentes.append((reservado_ate, str(row.get("Chave") or "").strip(), ORIGEM_PLANILHA))
+    
+    # Backend compartilhado: reservas criadas antes deste processo subir
+    for reserva in reservas_temporarias.ativas():
+        try:
+            pendentes.append((datetime.fromisoformat(reserva["reservado_ate"]), reserva["chave"], ORIGEM_MEMORIA))
+        except (KeyError, TypeError, ValueError):
+            continue
+    
+    with _EXPIRACOES_COND:
+        for item in pendentes:
+            heapq.heappush(_EXPIRACOES, item)
+        _EXPIRACOES_COND.notify_all()
+
+
+def proxima_expiracao() -> Optional[datetime]:
+    """Momento em que a reserva temporária mais próxima vence (None se não houver)."""
+    _carregar_expiracoes()
+    with _EXPIRACOES_COND:
+        return _EXPIRACOES[0][0] if _EXPIRACOES else None
+
+
+def aguardar_proxima_expiracao(espera_maxima: float = ESPERA_MAXIMA_EXPIRACAO_S):
+    """
+    Bloqueia até a próxima reserva vencer (ou até espera_maxima segundos).
+    Uma nova reserva mais próxima acorda a espera e recalcula o prazo.
+    """
+    _carregar_expiracoes()
+    with _EXPIRACOES_COND:
+        if _EXPIRACOES:
+            espera = (_EXPIRACOES[0][0] - datetime.now()).total_seconds()
+        else:
+            espera = espera_maxima
+        if espera > 0:
+            _EXPIRACOES_COND.wait(min(espera, espera_maxima))
+
+
 def liberar_slots_expirados() -> int:
     """
-    Busca reservas expiradas e libera os slots.
+    Libera apenas as reservas vencidas do heap.
+    
+    Reservas em memória são só descartadas; linhas da planilha com prazo
+    vencido viram "Expirado". A planilha não é lida nem gravada quando
+    nenhuma linha dela venceu.
     
     Returns:
         Número de slots liberados
     """
-    wb, ws = _open_ws()
-    hm = _get_header_map(ws)
-    
-    c_status = hm.get("Status")
-    c_reservado_ate = hm.get("ReservadoAte")
-    
-    if not c_status or not c_reservado_ate:
-        return 0
+    _carregar_expiracoes()
     
     agora = datetime.now()
+    vencidas = set()
+    memoria_vencida = False
+    with _EXPIRACOES_COND:
+        while _EXPIRACOES and _EXPIRACOES[0][0] <= agora:
+            _, chave, origem = heapq.heappop(_EXPIRACOES)
+            if origem == ORIGEM_MEMORIA:
+                memoria_vencida = True
+            else:
+                vencidas.add(chave)
+    
     liberados = 0
+    if memoria_vencida:
+        expiradas = reservas_temporarias.remover_vencidas(agora)
+        if expiradas:
+            liberados += len(expiradas)
+            _notificar_mudanca(*{r["data"] for r in expiradas})
     
-    for r in range(2, ws.max_row + 1):
-        status = str(ws.cell(row=r, column=c_status).value or "").strip()
+    if not vencidas:
+        return liberados
+    
+    with _ESCRITA_LOCK:
+        wb, ws = _open_ws()
+        hm = _get_header_map(ws)
         
-        # Apenas processar reservas pendentes
-        if status != "Reservado":
-            continue
+        c_chave = hm.get("Chave")
+        c_status = hm.get("Status")
+        c_reservado_ate = hm.get("ReservadoAte")
+        c_data = hm.get("Data")
         
-        reservado_ate_str = str(ws.cell(row=r, column=c_reservado_ate).value or "").strip()
+        if not c_chave or not c_status or not c_reservado_ate:
+            return liberados
         
-        if not reservado_ate_str:
-            continue
+        expiradas_planilha = 0
+        datas_liberadas = set()
         
-        try:
-            # Parse ISO format
-            reservado_ate = datetime.fromisoformat(reservado_ate_str)
+        for r in range(2, ws.max_row + 1):
+            chave = str(ws.cell(row=r, column=c_chave).value or "").strip()
+            if chave not in vencidas:
+                continue
+            
+            status = str(ws.cell(row=r, column=c_status).value or "").strip()
+            
+            # Reserva já confirmada/cancelada: entrada obsoleta no heap
+            if status not in STATUS_COM_PRAZO:
+                continue
+            
+            reservado_ate_str = str(ws.cell(row=r, column=c_reservado_ate).value or "").strip()
+            
+            try:
+                reservado_ate = datetime.fromisoformat(reservado_ate_str)
+            except ValueError:
+                continue
             
-            # Se expirou
             if agora > reservado_ate:
                 ws.cell(row=r, column=c_status, value="Expirado")
-                liberados += 1
+                expiradas_planilha += 1
+                if c_data:
+                    datas_liberadas.add(str(ws.cell(row=r, column=c_data).value or ""))
+            else:
+                # Prazo estendido nesta linha: reagendar
+                _agendar_expiracao(chave, reservado_ate, ORIGEM_PLANILHA)
         
-        except Exception:
-            continue
+        if expiradas_planilha > 0:
+            _salvar_planilha(wb)
+            _notificar_mudanca(*datas_liberadas)
     
-    if liberados > 0:
-        wb.save(FILE_PATH)
-    
-    return liberados
+    return liberados + expiradas_planilha
 
 
 def verificar_reserva_ativa(data_str: str, hora_str: str, chat_id: str) -> bool:
@@ -857,6 +1301,10 @@ def verificar_reserva_ativa(data_str: str, hora_str: str, chat_id: str) -> bool:
     """
     chave = make_key(data_str, hora_str, chat_id)
     
+    reserva = reservas_temporarias.obter(chave)
+    if reserva is not None:
+        return not reserva_vencida("Reservado", reserva.get("reservado_ate"))
+    
     wb, ws = _open_ws()
     hm = _get_header_map(ws)
     
@@ -901,10 +1349,10 @@ def obter_agendamentos_do_dia(data_str: str) -> List[Dict[str, Any]]:
         data_str: Data no formato DD/MM/YYYY
     
     Returns:
-        Lista de dicts com dados dos agendamentos
+        Lista de dicts com dados dos agendamentos (inclui reservas temporárias ativas)
     """
     rows = _read_rows()
-    return [r for r in rows if r.get("Data") == data_str]
+    return [r for r in rows if r.get("Data") == data_str] + linhas_reservas_temporarias(data_str)
 
 
 def atualizar_pagamento_id(chave: str, payment_id: str, payment_status: str = "pending") -> bool:
@@ -919,27 +1367,32 @@ def atualizar_pagamento_id(chave: str, payment_id: str, payment_status: str = "p
     Returns:
         True se atualizado com sucesso
     """
+    # Pagamento gerado: a reserva temporária passa a existir na planilha
+    if reservas_temporarias.obter(chave) is not None:
+        if not persistir_reserva(chave, "Pendente Pagamento"):
+            return False
+    
     try:
-        wb, ws = _open_ws()
-        hm = _get_header_map(ws)
+        with _ESCRITA_LOCK:
+            wb, ws = _open_ws()
+            hm = _get_header_map(ws)
         
-        c_chave = hm.get("Chave")
-        c_pag_id = hm.get("PagamentoID")
-        c_pag_status = hm.get("PagamentoStatus")
+            c_chave = hm.get("Chave")
+            c_pag_id = hm.get("PagamentoID")
+            c_pag_status = hm.get("PagamentoStatus")
         
-        if not all([c_chave, c_pag_id, c_pag_status]):
-            return False
+            if not all([c_chave, c_pag_id, c_pag_status]):
+                return False
         
-        for r in range(2, ws.max_row + 1):
-            row_chave = str(ws.cell(row=r, column=c_chave).value or "").strip()
-            
-            if row_chave == chave:
-                ws.cell(row=r, column=c_pag_id, value=str(payment_id))
-                ws.cell(row=r, column=c_pag_status, value=payment_status)
-                wb.save(FILE_PATH)
-                return True
+            # Linha mais recente da chave (a reserva recém-gravada)
+            r = _find_row_by_key(ws, chave)
+            if r is None:
+                return False
         
-        return False
+            ws.cell(row=r, column=c_pag_id, value=str(payment_id))
+            ws.cell(row=r, column=c_pag_status, value=payment_status)
+            _salvar_planilha(wb)
+            return True
     
     except Exception as e:
         logger.error(f"Erro ao atualizar PagamentoID: {e}")
@@ -0,0 +1,413 @@
+# services/fila_entrada.py
+"""
+Fila de entrada do webhook do WAHA.
+
+O /chatbot/webhook/ fazia parsing, fluxo, leitura/escrita da planilha e
+envios antes de responder 200; com respostas lentas o WAHA reenviava o
+evento, gerando processamento duplicado. Agora o webhook só valida,
+deduplica e enfileira; as mensagens são processadas por threads
+(fila_envio.FilaPorChat), uma de cada vez por chat_id.
+
+Spool durável opcional (FILA_ENTRADA_SPOOL=caminho.sqlite3): cada
+mensagem é gravada antes do 200 e apagada após o processamento. Ao
+iniciar, o processo reprocessa as mensagens de processos que morreram
+(reinício do container/worker) sem tocar nas de workers vivos.
+
+Rajadas por chat: clientes mandam "oi", "bom dia", "quero agendar" em
+sequência e cada mensagem virava um turno do fluxo (planilha + resposta).
+1. Agrupamento (ENTRADA_DEBOUNCE_S > 0): a mensagem espera a janela; as
+   que chegam dentro dela entram no mesmo turno, com os textos unidos por
+   quebra de linha. A janela recomeça a cada mensagem, até
+   ENTRADA_DEBOUNCE_MAX_S desde a primeira
+2. Enxurrada: cada chat tem um balde de ENTRADA_LIMITE_RAJADA fichas que
+   enche a ENTRADA_LIMITE_MSG_MIN por minuto; sem ficha, permitir() recusa
+   e o webhook descarta a mensagem antes do spool e do fluxo
+
+Configuração (ENV):
+- FILA_ENTRADA_WORKERS: threads de processamento (padrão 4; 0 = processa
+  na thread do webhook, como antes)
+- FILA_ENTRADA_MAX: mensagens pendentes por processo (padrão 500)
+- FILA_ENTRADA_MAX_CHATS: chats com mensagens pendentes ao mesmo tempo
+  (padrão 200; um chat novo espera vaga). Chats processados em paralelo
+  = FILA_ENTRADA_WORKERS
+- FILA_ENTRADA_SPOOL: arquivo SQLite do spool (vazio = sem spool)
+- ENTRADA_DEBOUNCE_S: janela de agrupamento por chat (padrão 0 = desligado)
+- ENTRADA_DEBOUNCE_MAX_S: espera máxima de uma rajada (padrão 4)
+- ENTRADA_LIMITE_MSG_MIN / ENTRADA_LIMITE_RAJADA: mensagens por minuto e
+  rajada aceitas por chat (padrão 20 e 10; 0 desliga). Contado por processo
+"""
+
+import os
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.fila_envio import FilaPorChat
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+WORKERS = int(os.getenv("FILA_ENTRADA_WORKERS", "4"))
+MAX_PENDENTES = int(os.getenv("FILA_ENTRADA_MAX", "500"))
+MAX_CHATS = int(os.getenv("FILA_ENTRADA_MAX_CHATS", "200"))
+SPOOL_PATH = os.getenv("FILA_ENTRADA_SPOOL", "").strip()
+DEBOUNCE_S = float(os.getenv("ENTRADA_DEBOUNCE_S", "0"))
+DEBOUNCE_MAX_S = float(os.getenv("ENTRADA_DEBOUNCE_MAX_S", "4"))
+LIMITE_MSG_MIN = float(os.getenv("ENTRADA_LIMITE_MSG_MIN", "20"))
+LIMITE_RAJADA = float(os.getenv("ENTRADA_LIMITE_RAJADA", "10"))
+MAX_BALDES = 10000  # Chats com balde de enxurrada guardado (os mais antigos saem)
+
+# processar(chat_id, texto)
+Processador = Callable[[str, str], Any]
+
+_fila = FilaPorChat("fila_entrada", WORKERS, MAX_PENDENTES, MAX_CHATS)
+_processar: Optional[Processador] = None
+_spool: Optional["_Spool"] = None
+_spool_lock = threading.Lock()
+_dono_atual: Tuple[int, str] = (0, "")
+
+# Rajadas abertas (agrupamento) e baldes de enxurrada, por chat_id
+_rajadas: Dict[str, "_Rajada"] = {}
+_baldes: "OrderedDict[str, Tuple[float, float, bool]]" = OrderedDict()  # chat_id -> (fichas, atualizado, em enxurrada)
+_rajadas_lock = threading.Lock()
+_stats_rajadas = {"turnos_agrupados": 0, "agrupadas": 0, "descartadas": 0, "chats_descartados": 0}
+
+
+# =========================================================
+# Spool (SQLite)
+# =========================================================
+
+def _dono() -> str:
+    """
+    Identificador deste processo no spool: "pid:token". O token evita
+    confundir com um processo anterior que teve o mesmo pid (comum após
+    reiniciar o container).
+    """
+    global _dono_atual
+    pid = os.getpid()
+    if _dono_atual[0] != pid:
+        _dono_atual = (pid, uuid.uuid4().hex[:12])
+    return f"{pid}:{_dono_atual[1]}"
+
+
+def _dono_morto(dono: str) -> bool:
+    """True se o processo dono não existe mais."""
+    if dono == _dono():
+        return False
+    try:
+        pid = int(str(dono).split(":", 1)[0])
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        return True  # mesmo pid, outro token: processo anterior
+    return not _processo_vivo(pid)
+
+
+def _processo_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # existe, mas sem permissão de sinal
+    return True
+
+
+class _Spool:
+    """Mensagens aceitas e ainda não processadas, por processo dono."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conexao().execute(
+            "CREATE TABLE IF NOT EXISTS entrada ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL,"
+            " texto TEXT NOT NULL, dono TEXT NOT NULL, recebido_em REAL NOT NULL)"
+        )
+
+    def _conexao(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def gravar(self, chat_id: str, texto: str) -> int:
+        cur = self._conexao().execute(
+            "INSERT INTO entrada (chat_id, texto, dono, recebido_em) VALUES (?, ?, ?, ?)",
+            (chat_id, texto, _dono(), time.time()),
+        )
+        return cur.lastrowid
+
+    def gravar_lote(self, mensagens: List[Tuple[str, str]]) -> List[int]:
+        """Grava várias mensagens numa transação só (um fsync para o lote)."""
+        con = self._conexao()
+        dono, agora = _dono(), time.time()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                con.execute(
+                    "INSERT INTO entrada (chat_id, texto, dono, recebido_em) VALUES (?, ?, ?, ?)",
+                    (chat_id, texto, dono, agora),
+                ).lastrowid
+                for chat_id, texto in mensagens
+            ]
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return ids
+
+    def apagar(self, id_spool: int):
+        self._conexao().execute("DELETE FROM entrada WHERE id = ?", (id_spool,))
+
+    def assumir_orfas(self) -> List[Tuple[int, str, str]]:
+        """Passa para este processo as mensagens de processos mortos."""
+        con = self._conexao()
+        donos = [d for (d,) in con.execute("SELECT DISTINCT dono FROM entrada").fetchall()]
+        mortos = [d for d in donos if _dono_morto(d)]
+        if not mortos:
+            return []
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            marcadores = ",".join("?" * len(mortos))
+            con.execute(f"UPDATE entrada SET dono = ? WHERE dono IN ({marcadores})", (_dono(), *mortos))
+            linhas = con.execute(
+                "SELECT id, chat_id, texto FROM entrada WHERE dono = ? ORDER BY id", (_dono(),)
+            ).fetchall()
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return linhas
+
+    def pendentes(self) -> int:
+        return self._conexao().execute("SELECT COUNT(*) FROM entrada").fetchone()[0]
+
+
+def _obter_spool() -> Optional[_Spool]:
+    global _spool
+    if not SPOOL_PATH:
+        return None
+    if _spool is None or _spool.path != SPOOL_PATH:
+        with _spool_lock:
+            if _spool is None or _spool.path != SPOOL_PATH:
+                _spool = _Spool(SPOOL_PATH)
+    return _spool
+
+
+# =========================================================
+# Processamento
+# =========================================================
+
+def _executar(ids_spool: List[Optional[int]], chat_id: str, texto: str):
+    try:
+        if _processar is None:
+            raise RuntimeError("fila_entrada.iniciar() não foi chamado")
+        _processar(chat_id, texto)
+    finally:
+        # Apaga mesmo em erro: uma mensagem que derruba o fluxo não deve
+        # ser reprocessada a cada reinício
+        spool = _obter_spool()
+        for id_spool in ids_spool:
+            if spool is None or id_spool is None:
+                continue
+            try:
+                spool.apagar(id_spool)
+            except Exception as e:
+                logger.error(f"[FILA ENTRADA] Falha ao apagar {id_spool} do spool: {e}")
+
+
+class _Rajada:
+    """Mensagens de um chat esperando a janela de agrupamento fechar."""
+    __slots__ = ("textos", "ids_spool", "inicio", "timer")
+
+    def __init__(self):
+        self.textos: List[str] = []
+        self.ids_spool: List[Optional[int]] = []
+        self.inicio = time.monotonic()
+        self.timer: Optional[threading.Timer] = None
+
+
+def _fechar_rajada(chat_id: str, rajada: _Rajada):
+    """Janela fechou: a rajada vira um turno só na fila do chat."""
+    with _rajadas_lock:
+        if _rajadas.get(chat_id) is not rajada:
+            return  # já fechada por outro timer
+        del _rajadas[chat_id]
+        if len(rajada.textos) > 1:
+            _stats_rajadas["turnos_agrupados"] += 1
+    _fila.enfileirar(chat_id, _executar, rajada.ids_spool, chat_id, "\n".join(rajada.textos))
+
+
+def _aceitar(id_spool: Optional[int], chat_id: str, texto: str) -> bool:
+    """Manda para a fila do chat, direto ou pela rajada aberta do chat."""
+    if DEBOUNCE_S <= 0 or WORKERS <= 0:
+        return _fila.enfileirar(chat_id, _executar, [id_spool], chat_id, texto)
+    with _rajadas_lock:
+        rajada = _rajadas.get(chat_id)
+        if rajada is None:
+            rajada = _rajadas[chat_id] = _Rajada()
+        else:
+            rajada.timer.cancel()
+            _stats_rajadas["agrupadas"] += 1
+        rajada.textos.append(texto)
+        rajada.ids_spool.append(id_spool)
+        espera = min(DEBOUNCE_S, rajada.inicio + DEBOUNCE_MAX_S - time.monotonic())
+        rajada.timer = threading.Timer(max(espera, 0.0), _fechar_rajada, args=(chat_id, rajada))
+        rajada.timer.daemon = True
+        rajada.timer.start()
+    return True
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def iniciar(processar: Processador) -> int:
+    """
+    Registra a função que processa cada mensagem e reprocessa o spool
+    deixado por processos que morreram.
+
+    Returns:
+        Quantidade de mensagens recuperadas do spool
+    """
+    global _processar
+    _processar = processar
+
+    spool = _obter_spool()
+    if spool is None:
+        return 0
+    try:
+        orfas = spool.assumir_orfas()
+    except Exception as e:
+        logger.error(f"[FILA ENTRADA] Falha ao ler o spool: {e}")
+        return 0
+    for id_spool, chat_id, texto in orfas:
+        _fila.enfileirar(chat_id, _executar, [id_spool], chat_id, texto)
+    if orfas:
+        logger.info(f"[FILA ENTRADA] {len(orfas)} mensagens recuperadas do spool")
+    return len(orfas)
+
+
+def enfileirar(chat_id: str, texto: str) -> bool:
+    """
+    Aceita a mensagem para processamento em segundo plano.
+
+    Mensagens do mesmo chat_id são processadas uma de cada vez, na ordem
+    de chegada (com ENTRADA_DEBOUNCE_S, as de uma rajada num turno só).
+    Com spool, a mensagem é gravada antes de retornar.
+
+    Returns:
+        True se foi para a fila; False se foi processada na hora
+    """
+    id_spool = None
+    spool = _obter_spool()
+    if spool is not None:
+        try:
+            id_spool = spool.gravar(chat_id, texto)
+        except Exception as e:
+            logger.error(f"[FILA ENTRADA] Falha ao gravar no spool: {e}")
+    return _aceitar(id_spool, chat_id, texto)
+
+
+def enfileirar_lote(mensagens: List[Tuple[str, str]]) -> int:
+    """
+    Aceita várias mensagens (ex.: um POST com payload.messages) de uma vez.
+
+    A ordem é mantida dentro de cada chat_id; chats diferentes são
+    processados em paralelo pelas threads. Com spool, o lote é gravado
+    numa única transação.
+
+    Args:
+        mensagens: [(chat_id, texto), ...] na ordem de chegada
+
+    Returns:
+        Quantas foram para a fila (as demais foram processadas na hora)
+    """
+    if not mensagens:
+        return 0
+    ids: List[Optional[int]] = [None] * len(mensagens)
+    spool = _obter_spool()
+    if spool is not None:
+        try:
+            ids = spool.gravar_lote(mensagens)
+        except Exception as e:
+            logger.error(f"[FILA ENTRADA] Falha ao gravar lote no spool: {e}")
+    return sum(
+        _aceitar(id_spool, chat_id, texto)
+        for id_spool, (chat_id, texto) in zip(ids, mensagens)
+    )
+
+
+def permitir(chat_id: str) -> bool:
+    """
+    Controle de enxurrada: gasta uma ficha do balde do chat.
+
+    Returns:
+        True se a mensagem pode seguir; False se o chat passou do limite
+        (a mensagem deve ser descartada)
+    """
+    if LIMITE_MSG_MIN <= 0 or LIMITE_RAJADA <= 0:
+        return True
+    agora = time.monotonic()
+    with _rajadas_lock:
+        fichas, atualizado, enxurrada = _baldes.pop(chat_id, (LIMITE_RAJADA, agora, False))
+        fichas = min(LIMITE_RAJADA, fichas + (agora - atualizado) * LIMITE_MSG_MIN / 60.0)
+        permitido = fichas >= 1.0
+        if permitido:
+            fichas -= 1.0
+        else:
+            _stats_rajadas["descartadas"] += 1
+            if not enxurrada:
+                # Primeira recusa desta enxurrada: avisa uma vez só
+                _stats_rajadas["chats_descartados"] += 1
+                logger.warning(f"[FILA ENTRADA] Enxurrada de {chat_id}: descartando mensagens")
+        _baldes[chat_id] = (fichas, agora, not permitido)
+        while len(_baldes) > MAX_BALDES:
+            _baldes.popitem(last=False)
+    return permitido
+
+
+def aguardar_vazia(timeout: Optional[float] = None) -> bool:
+    """Espera até não haver mensagens pendentes nem rajadas abertas. Retorna False no timeout."""
+    limite = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _rajadas_lock:
+            abertas = bool(_rajadas)
+        if not abertas:
+            return _fila.aguardar_vazia(None if limite is None else max(limite - time.monotonic(), 0.0))
+        if limite is not None and time.monotonic() >= limite:
+            return False
+        time.sleep(0.02)
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Profundidade da fila, latências, mensagens no spool, agrupadas e descartadas."""
+    stats = _fila.estatisticas()
+    with _rajadas_lock:
+        stats.update(_stats_rajadas, rajadas_abertas=len(_rajadas))
+    spool = _obter_spool()
+    if spool is not None:
+        try:
+            stats["spool_pendentes"] = spool.pendentes()
+        except Exception:
+            stats["spool_pendentes"] = None
+    return stats
+
+
+def resetar_estatisticas():
+    """Zera os contadores e esvazia os baldes de enxurrada (mantém a fila)."""
+    _fila.resetar_estatisticas()
+    with _rajadas_lock:
+        _baldes.clear()
+        for k in _stats_rajadas:
+            _stats_rajadas[k] = 0
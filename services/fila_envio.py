@@ -0,0 +1,347 @@
+# services/fila_envio.py
+"""
+Despachante assíncrono de mensagens de saída.
+
+O webhook chamava send() de forma síncrona, então o tempo de resposta
+era a soma dos round-trips ao WAHA (alguns fluxos mandam 2–4 mensagens:
+PIX, "Aguardando confirmação", menus). Aqui os envios vão para uma fila
+limitada atendida por um pool de threads:
+
+1. Ordem FIFO garantida por chat_id: cada chat tem sua própria fila e
+   é atendido por no máximo uma thread por vez
+2. Chats diferentes são enviados em paralelo (round-robin entre chats)
+3. Fila cheia: o chamador espera por espaço (ESPERA_FILA_S) e, se não
+   houver, executa o envio na própria thread (nada é descartado; se o
+   chat já tem itens na fila, o novo entra atrás deles mesmo assim)
+4. WAHA fora do ar (circuito aberto em todas as sessões, ver
+   sessoes_waha): as threads param de enviar e as mensagens ficam estacionadas na fila até o
+   WAHA voltar; um envio que levanta Adiar volta para o início da fila
+   do seu chat
+5. Falha de envio: Adiar(segundos) devolve o item ao início da fila do
+   chat, que só volta a andar após o backoff (sem ocupar thread; os
+   outros chats seguem). Ver backoff() e MAX_TENTATIVAS
+
+Configuração (ENV):
+- FILA_ENVIO_WORKERS: threads de envio por processo (padrão 4; 0 = síncrono)
+- FILA_ENVIO_MAX: mensagens pendentes no total (padrão 1000)
+- FILA_ENVIO_TENTATIVAS: tentativas por mensagem antes de desistir (padrão 5)
+- FILA_ENVIO_BACKOFF_S / FILA_ENVIO_BACKOFF_MAX_S: espera após a 1ª falha
+  (padrão 2s), dobrando a cada falha até o teto (padrão 120s)
+"""
+
+import os
+import time
+import atexit
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple, Union
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+WORKERS = int(os.getenv("FILA_ENVIO_WORKERS", "4"))
+MAX_PENDENTES = int(os.getenv("FILA_ENVIO_MAX", "1000"))
+MAX_TENTATIVAS = int(os.getenv("FILA_ENVIO_TENTATIVAS", "5"))
+BACKOFF_S = float(os.getenv("FILA_ENVIO_BACKOFF_S", "2"))
+BACKOFF_MAX_S = float(os.getenv("FILA_ENVIO_BACKOFF_MAX_S", "120"))
+ESPERA_FILA_S = 5  # Quanto o chamador espera por espaço na fila cheia
+
+# Item da fila: (função, argumentos, momento em que entrou)
+_Item = Tuple[Callable[..., Any], Tuple[Any, ...], float]
+
+
+class Adiar(Exception):
+    """
+    Levantada pela função enfileirada: o item volta para o início da fila
+    do chat e é tentado de novo, após `segundos` (0 = quando houver thread).
+    """
+
+    def __init__(self, segundos: float = 0.0):
+        super().__init__(f"adiado por {segundos:.1f}s")
+        self.segundos = segundos
+
+
+def backoff(tentativa: int) -> float:
+    """Espera (s) após a falha número `tentativa`: exponencial com jitter."""
+    teto = min(BACKOFF_MAX_S, BACKOFF_S * 2 ** max(tentativa - 1, 0))
+    return random.uniform(teto / 2, teto)
+
+
+# =========================================================
+# Fila por chat
+# =========================================================
+
+class FilaPorChat:
+    """
+    Fila limitada atendida por um pool de threads, com ordem FIFO por
+    chave (chat_id) e chaves diferentes em paralelo. Usada para a saída
+    (este módulo) e para a entrada do webhook (fila_entrada).
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        workers: int,
+        max_pendentes: int,
+        max_chaves: int = 0,
+        pausa: Optional[Callable[[], float]] = None,
+    ):
+        """
+        Args:
+            nome: Prefixo das threads e dos logs
+            workers: Threads (= chaves atendidas ao mesmo tempo); 0 = síncrono
+            max_pendentes: Itens pendentes no total
+            max_chaves: Chaves com itens pendentes ao mesmo tempo (0 = sem limite)
+            pausa: Segundos que as threads devem esperar antes do próximo
+                   item (0 = seguir); os itens ficam na fila enquanto isso
+        """
+        self.nome = nome
+        self.workers = workers
+        self.max_pendentes = max_pendentes
+        self.max_chaves = max_chaves
+        self.pausa = pausa
+        self._cond = threading.Condition()
+        self._filas: Dict[str, Deque[_Item]] = {}   # chave -> itens pendentes
+        self._prontos: Deque[str] = deque()         # chaves com pendências e sem thread atendendo
+        self._em_execucao: Set[str] = set()         # chaves sendo atendidas agora
+        self._pendentes = 0
+        self._threads_pid: Optional[int] = None
+        self._stats = {
+            "enfileiradas": 0, "executadas": 0, "falhas": 0, "execucoes_sincronas": 0, "adiadas": 0,
+            "profundidade_max": 0, "tempo_execucao_ms": 0.0, "tempo_fila_ms": 0.0,
+        }
+
+    def _iniciar_workers(self):
+        """Sobe as threads na primeira chamada do processo (e após fork)."""
+        pid = os.getpid()
+        if self._threads_pid == pid:
+            return
+        with self._cond:
+            if self._threads_pid == pid:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"{self.nome}_{i}", daemon=True).start()
+            self._threads_pid = pid
+        logger.info(f"[{self.nome.upper()}] {self.workers} threads iniciadas")
+
+    def _executar(self, funcao: Callable[..., Any], args: Tuple[Any, ...]) -> Union[bool, Adiar]:
+        """True = ok; False = falhou; Adiar = tentar de novo."""
+        try:
+            funcao(*args)
+            return True
+        except Adiar as adiar:
+            return adiar
+        except Exception as e:
+            logger.error(f"[{self.nome.upper()}] Falha: {e}")
+            return False
+
+    def _segundos_de_pausa(self) -> float:
+        if self.pausa is None:
+            return 0.0
+        try:
+            return max(float(self.pausa()), 0.0)
+        except Exception:
+            return 0.0
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._prontos:
+                        self._cond.wait()
+                        continue
+                    espera = self._segundos_de_pausa()
+                    if espera <= 0:
+                        break
+                    self._cond.wait(espera)
+                chave = self._prontos.popleft()
+                self._em_execucao.add(chave)
+                funcao, args, enfileirado_em = self._filas[chave].popleft()
+
+            self._rodar(chave, funcao, args, enfileirado_em)
+
+    def _rodar(self, chave: str, funcao: Callable[..., Any], args: Tuple[Any, ...], enfileirado_em: float):
+        """Executa um item da chave (já marcada em _em_execucao) e libera a chave."""
+        inicio = time.perf_counter()
+        ok = self._executar(funcao, args)
+        fim = time.perf_counter()
+
+        espera = 0.0
+        with self._cond:
+            self._em_execucao.discard(chave)
+            if isinstance(ok, Adiar):
+                # Volta para o início da fila do chat (mantém a ordem)
+                self._filas[chave].appendleft((funcao, args, enfileirado_em))
+                self._stats["adiadas"] += 1
+                espera = ok.segundos
+            else:
+                self._pendentes -= 1
+                self._stats["executadas" if ok else "falhas"] += 1
+                self._stats["tempo_execucao_ms"] += (fim - inicio) * 1000
+                self._stats["tempo_fila_ms"] += (inicio - enfileirado_em) * 1000
+            if not self._filas[chave]:
+                del self._filas[chave]
+            elif espera <= 0:
+                # Volta para o fim: as outras chaves também andam
+                self._prontos.append(chave)
+            # Com espera, o chat fica parado até _liberar (backoff)
+            self._cond.notify_all()
+
+        if espera > 0:
+            timer = threading.Timer(espera, self._liberar, args=(chave,))
+            timer.daemon = True
+            timer.start()
+
+    def _liberar(self, chave: str):
+        """Fim do backoff: a chave volta a ser atendida."""
+        with self._cond:
+            if chave in self._filas and chave not in self._em_execucao and chave not in self._prontos:
+                self._prontos.append(chave)
+                self._cond.notify_all()
+
+    def _tem_espaco(self, chave: str) -> bool:
+        if self._pendentes >= self.max_pendentes:
+            return False
+        nova = chave not in self._filas
+        return not (nova and self.max_chaves > 0 and len(self._filas) >= self.max_chaves)
+
+    def enfileirar(self, chave: str, funcao: Callable[..., Any], *args: Any) -> bool:
+        """
+        Agenda `funcao(*args)` na fila da chave.
+
+        A ordem por chave vale sempre: se a fila continuar cheia após
+        ESPERA_FILA_S, o item só é executado na thread do chamador quando
+        a chave não tem nada pendente; senão entra na fila assim mesmo.
+
+        Returns:
+            True se foi para a fila; False se foi executada na hora
+            (sem workers ou fila cheia)
+        """
+        if self.workers <= 0:
+            if isinstance(self._executar(funcao, args), Adiar):
+                logger.warning(f"[{self.nome.upper()}] Item adiado sem fila (workers=0); descartado")
+            return False
+
+        self._iniciar_workers()
+        chave = str(chave)
+        agora = time.perf_counter()
+        with self._cond:
+            limite = time.monotonic() + ESPERA_FILA_S
+            while not self._tem_espaco(chave):
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+
+            cheia = not self._tem_espaco(chave)
+            ocupada = chave in self._filas
+            fila = self._filas.setdefault(chave, deque())
+            self._pendentes += 1
+            self._stats["profundidade_max"] = max(self._stats["profundidade_max"], self._pendentes)
+
+            if cheia and not ocupada:
+                # Executa aqui, com a chave marcada: o que chegar para ela
+                # enquanto isso espera na fila
+                self._em_execucao.add(chave)
+                self._stats["execucoes_sincronas"] += 1
+            else:
+                fila.append((funcao, args, agora))
+                if len(fila) == 1 and chave not in self._em_execucao:
+                    self._prontos.append(chave)
+                self._stats["enfileiradas"] += 1
+                self._cond.notify_all()
+                return True
+
+        logger.warning(f"[{self.nome.upper()}] Fila cheia; executando {chave} na thread atual")
+        self._rodar(chave, funcao, args, agora)
+        return False
+
+    def aguardar_vazia(self, timeout: Optional[float] = None) -> bool:
+        """Espera até não haver itens pendentes. Retorna False no timeout."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pendentes:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+        return True
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Profundidade da fila e latências médias (ms) de espera e de execução."""
+        with self._cond:
+            concluidas = self._stats["executadas"] + self._stats["falhas"]
+            return {
+                **self._stats,
+                "profundidade": self._pendentes,
+                "chats_pendentes": len(self._filas),
+                "chats_em_execucao": len(self._em_execucao),
+                "workers": self.workers,
+                "max_pendentes": self.max_pendentes,
+                "max_chats": self.max_chaves,
+                "latencia_execucao_ms": round(self._stats["tempo_execucao_ms"] / concluidas, 2) if concluidas else 0.0,
+                "espera_fila_ms": round(self._stats["tempo_fila_ms"] / concluidas, 2) if concluidas else 0.0,
+            }
+
+    def resetar_estatisticas(self):
+        """Zera os contadores (mantém a fila)."""
+        with self._cond:
+            for k in self._stats:
+                self._stats[k] = 0
+
+
+def _pausa_waha() -> float:
+    try:
+        from services import sessoes_waha
+    except ImportError:
+        return 0.0
+    return sessoes_waha.segundos_ate_tentar()
+
+
+_saida = FilaPorChat("fila_envio", WORKERS, MAX_PENDENTES, pausa=_pausa_waha)
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def enfileirar(chat_id: str, funcao: Callable[..., Any], *args: Any) -> bool:
+    """
+    Agenda `funcao(*args)` (envio de mensagem, "digitando"...) para o chat.
+
+    Chamadas para o mesmo chat_id executam na ordem em que foram
+    enfileiradas; chats diferentes executam em paralelo.
+
+    Args:
+        chat_id: Chat de destino (chave da ordem FIFO)
+        funcao: Função de envio
+        *args: Argumentos da função
+
+    Returns:
+        True se foi para a fila; False se foi executada na hora
+        (despachante desligado ou fila cheia)
+    """
+    return _saida.enfileirar(chat_id, funcao, *args)
+
+
+def aguardar_vazia(timeout: Optional[float] = None) -> bool:
+    """Espera até não haver envios pendentes. Retorna False no timeout."""
+    return _saida.aguardar_vazia(timeout)
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Profundidade da fila e latências médias (ms) de espera e de envio."""
+    return _saida.estatisticas()
+
+
+def resetar_estatisticas():
+    """Zera os contadores (mantém a fila)."""
+    _saida.resetar_estatisticas()
+
+
+# Na parada do processo, tenta entregar o que ficou na fila
+atexit.register(aguardar_vazia, 5)
@@ -0,0 +1,158 @@
+# services/limite_envio.py
+"""
+Limite de mensagens enviadas ao WAHA (token bucket por sessão).
+
+Os lembretes saem em rajada (às 18:00, o "1 dia antes" de toda a agenda
+do dia seguinte) e podiam inundar o WAHA, arriscando bloqueio do
+WhatsApp, enquanto as respostas às conversas disputavam a mesma conexão.
+Cada sessão do WAHA tem um balde de fichas que enche a WAHA_LIMITE_MSG_S
+por segundo; cada mensagem gasta uma ficha. Há duas faixas:
+
+1. INTERATIVO: respostas do fluxo; pode usar qualquer ficha do balde
+2. MASSA: lembretes e envios em lote; só usa fichas acima da reserva
+   (WAHA_LIMITE_RESERVA) e tem um teto próprio (WAHA_LIMITE_MASSA_MSG_S),
+   então uma resposta sempre encontra ficha e passa na frente
+
+reservar() não bloqueia: devolve quantos segundos esperar, e a fila de
+envio estaciona o chat por esse tempo (fila_envio.Adiar) sem ocupar
+thread.
+
+Configuração (ENV):
+- WAHA_LIMITE_MSG_S: mensagens por segundo por sessão (padrão 3; 0 desliga)
+- WAHA_LIMITE_RAJADA: tamanho do balde (padrão 10)
+- WAHA_LIMITE_RESERVA: fichas só da faixa interativa (padrão 4)
+- WAHA_LIMITE_MASSA_MSG_S: teto da faixa de massa (padrão 1)
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# =========================================================
+# Configuração
+# =========================================================
+TAXA_MSG_S = float(os.getenv("WAHA_LIMITE_MSG_S", "3"))
+RAJADA = float(os.getenv("WAHA_LIMITE_RAJADA", "10"))
+RESERVA_INTERATIVO = float(os.getenv("WAHA_LIMITE_RESERVA", "4"))
+TAXA_MASSA_MSG_S = float(os.getenv("WAHA_LIMITE_MASSA_MSG_S", "1"))
+
+INTERATIVO = "interativo"
+MASSA = "massa"
+FAIXAS = (INTERATIVO, MASSA)
+
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+class _Balde:
+    """Fichas que enchem a `taxa` por segundo até `capacidade`."""
+
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = max(capacidade, 1.0)
+        self.fichas = self.capacidade
+        self.atualizado = time.monotonic()
+
+    def repor(self, agora: float):
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    def espera(self, necessario: float) -> float:
+        """Segundos até haver `necessario` fichas (0 = já há)."""
+        falta = necessario - self.fichas
+        return 0.0 if falta <= 0 else falta / self.taxa
+
+
+# sessão -> (balde da sessão, teto da faixa de massa)
+_baldes: Dict[str, Tuple[_Balde, _Balde]] = {}
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def _obter_baldes(sessao: str):
+    baldes = _baldes.get(sessao)
+    if baldes is None or baldes[0].taxa != TAXA_MSG_S or baldes[1].taxa != TAXA_MASSA_MSG_S:
+        baldes = _baldes[sessao] = (
+            _Balde(TAXA_MSG_S, RAJADA),
+            _Balde(TAXA_MASSA_MSG_S, 1.0),
+        )
+    return baldes
+
+
+def _stats_faixa(faixa: str) -> Dict[str, float]:
+    return _stats.setdefault(faixa, {"liberadas": 0, "adiadas": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0})
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def reservar(faixa: str = INTERATIVO, sessao: str = "default", desde: Optional[float] = None) -> float:
+    """
+    Tenta pegar uma ficha para enviar uma mensagem.
+
+    Args:
+        faixa: INTERATIVO ou MASSA
+        sessao: Sessão do WAHA (cada uma tem seu balde)
+        desde: time.monotonic() do primeiro pedido desta mensagem, para a
+               métrica de espera por faixa
+
+    Returns:
+        0 se pode enviar agora (ficha gasta); senão, segundos a esperar
+        antes de pedir de novo (nenhuma ficha é gasta)
+    """
+    if TAXA_MSG_S <= 0:
+        return 0.0
+    massa = faixa == MASSA
+    with _lock:
+        agora = time.monotonic()
+        geral, teto_massa = _obter_baldes(sessao)
+        geral.repor(agora)
+        espera = geral.espera(1.0 + (min(RESERVA_INTERATIVO, geral.capacidade - 1) if massa else 0.0))
+        if massa and TAXA_MASSA_MSG_S > 0:
+            teto_massa.repor(agora)
+            espera = max(espera, teto_massa.espera(1.0))
+
+        stats = _stats_faixa(faixa)
+        if espera > 0:
+            stats["adiadas"] += 1
+            return espera
+
+        geral.fichas -= 1.0
+        if massa and TAXA_MASSA_MSG_S > 0:
+            teto_massa.fichas -= 1.0
+        stats["liberadas"] += 1
+        if desde is not None:
+            esperou_ms = (agora - desde) * 1000
+            stats["espera_total_ms"] += esperou_ms
+            stats["espera_max_ms"] = max(stats["espera_max_ms"], esperou_ms)
+        return 0.0
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Por faixa: mensagens liberadas, pedidos adiados e espera média/máxima (ms)."""
+    with _lock:
+        faixas = {}
+        for faixa in FAIXAS:
+            s = _stats_faixa(faixa)
+            faixas[faixa] = {
+                **s,
+                "espera_media_ms": round(s["espera_total_ms"] / s["liberadas"], 2) if s["liberadas"] else 0.0,
+            }
+        return {
+            "msg_s": TAXA_MSG_S,
+            "rajada": RAJADA,
+            "reserva_interativo": RESERVA_INTERATIVO,
+            "massa_msg_s": TAXA_MASSA_MSG_S,
+            "faixas": faixas,
+        }
+
+
+def resetar():
+    """Enche os baldes e zera os contadores."""
+    with _lock:
+        _baldes.clear()
+        _stats.clear()
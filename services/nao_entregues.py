@@ -0,0 +1,161 @@
+# services/nao_entregues.py
+"""
+Mensagens de saída que não foram entregues (dead-letter).
+
+Um envio que falhava terminava em print("[SEND-FALLBACK ...]") e a
+mensagem se perdia, inclusive PIX e confirmações do Mercado Pago. Agora
+cada mensagem tem um id e é tentada de novo pela fila de envio com
+backoff; esgotadas as tentativas, é gravada aqui em SQLite. Um admin
+lista, reenvia ou descarta pelos endpoints /debug/nao-entregues.
+
+Só é tentada de novo automaticamente a mensagem que certamente não saiu
+(WAHA recusou, sem conexão, circuito aberto). Sem resposta depois de o
+WAHA receber o pedido (timeout de leitura), a mensagem vem direto para
+cá, com o erro indicando que pode ter sido entregue: reenviar é decisão
+do admin, para não duplicar PIX e confirmações.
+
+Gravar de novo o mesmo id substitui a linha, então reenviar uma mensagem
+que volta a falhar não a duplica.
+
+Configuração (ENV):
+- NAO_ENTREGUES_PATH: arquivo SQLite (padrão: nao_entregues.sqlite3 na
+  pasta de AGENDAMENTOS_XLSX)
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+PATH = os.getenv("NAO_ENTREGUES_PATH") or os.path.join(
+    os.path.dirname(os.getenv("AGENDAMENTOS_XLSX", "/app/data/agendamentos.xlsx")),
+    "nao_entregues.sqlite3",
+)
+
+# Mensagem: {"id", "chat_id", "texto", "tentativas", "criado_em"}
+Envio = Dict[str, Any]
+
+_local = threading.local()
+_lock = threading.Lock()
+_tabela_criada: Optional[str] = None
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def _conexao() -> sqlite3.Connection:
+    global _tabela_criada
+    con = getattr(_local, "con", None)
+    if con is None or getattr(_local, "path", None) != PATH:
+        os.makedirs(os.path.dirname(os.path.abspath(PATH)), exist_ok=True)
+        con = sqlite3.connect(PATH, timeout=10, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        _local.con, _local.path = con, PATH
+    if _tabela_criada != PATH:
+        with _lock:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS mensagens ("
+                " id TEXT PRIMARY KEY, chat_id TEXT NOT NULL, texto TEXT NOT NULL,"
+                " tentativas INTEGER NOT NULL, erro TEXT, criado_em REAL NOT NULL,"
+                " falhou_em REAL NOT NULL)"
+            )
+            _tabela_criada = PATH
+    return con
+
+
+def _filtro(ids: Optional[Iterable[str]]):
+    if ids is None:
+        return "", ()
+    ids = [str(i) for i in ids]
+    return f" WHERE id IN ({','.join('?' * len(ids))})", tuple(ids)
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def guardar(envio: Envio, erro: str = "") -> bool:
+    """
+    Grava a mensagem que esgotou as tentativas.
+
+    Returns:
+        True se gravou; False se o arquivo não está acessível (a mensagem
+        completa vai para o log, para não se perder)
+    """
+    try:
+        _conexao().execute(
+            "INSERT OR REPLACE INTO mensagens"
+            " (id, chat_id, texto, tentativas, erro, criado_em, falhou_em)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (envio["id"], envio["chat_id"], envio["texto"], envio.get("tentativas", 0),
+             erro, envio.get("criado_em") or time.time(), time.time()),
+        )
+        logger.error(f"[NÃO ENTREGUE] {envio['id']} para {envio['chat_id']} "
+                     f"após {envio.get('tentativas', 0)} tentativas: {erro}")
+        return True
+    except Exception as e:
+        logger.error(f"[NÃO ENTREGUE] Falha ao gravar {envio.get('id')} ({e}); "
+                     f"para {envio.get('chat_id')}: {envio.get('texto')}")
+        return False
+
+
+def listar(limite: int = 100) -> List[Envio]:
+    """Mensagens guardadas, das mais antigas para as mais novas."""
+    linhas = _conexao().execute(
+        "SELECT id, chat_id, texto, tentativas, erro, criado_em, falhou_em"
+        " FROM mensagens ORDER BY falhou_em LIMIT ?", (int(limite),)
+    ).fetchall()
+    chaves = ("id", "chat_id", "texto", "tentativas", "erro", "criado_em", "falhou_em")
+    return [dict(zip(chaves, linha)) for linha in linhas]
+
+
+def quantidade() -> int:
+    """Total de mensagens guardadas."""
+    return _conexao().execute("SELECT COUNT(*) FROM mensagens").fetchone()[0]
+
+
+def reenviar(enfileirar: Callable[[Envio], Any], ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Tira as mensagens do arquivo e as devolve à fila de envio, na ordem em
+    que falharam e com as tentativas zeradas.
+
+    Args:
+        enfileirar: Recebe cada mensagem (ex.: webhooks._enfileirar_envio)
+        ids: Mensagens a reenviar (None = todas)
+
+    Returns:
+        Quantidade reenviada
+    """
+    where, params = _filtro(ids)
+    con = _conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        linhas = con.execute(
+            f"SELECT id, chat_id, texto, criado_em FROM mensagens{where} ORDER BY falhou_em", params
+        ).fetchall()
+        con.execute(f"DELETE FROM mensagens{where}", params)
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+    for id_msg, chat_id, texto, criado_em in linhas:
+        enfileirar({"id": id_msg, "chat_id": chat_id, "texto": texto,
+                    "tentativas": 0, "criado_em": criado_em})
+    if linhas:
+        logger.info(f"[NÃO ENTREGUE] {len(linhas)} mensagens devolvidas à fila de envio")
+    return len(linhas)
+
+
+def descartar(ids: Optional[Iterable[str]] = None) -> int:
+    """Apaga as mensagens (None = todas). Retorna a quantidade apagada."""
+    where, params = _filtro(ids)
+    return _conexao().execute(f"DELETE FROM mensagens{where}", params).rowcount
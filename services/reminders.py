@@ -301,31 +301,14 @@ def _enviar_lembrete_2_horas(ag: Dict[str, Any]) -> bool:
 
 def _atualizar_lembrete_enviado(ag: Dict[str, Any]):
     """Atualiza o campo LembreteEnviado na planilha."""
-    from openpyxl import load_workbook
-    
     try:
         chave = ag.get("Chave", "")
         if not chave:
             return
         
-        wb = load_workbook(es.FILE_PATH)
-        ws = wb[es.SHEET_AG]
-        
-        es._ensure_headers(ws, es.HEADERS_AG)
-        hm = es._get_header_map(ws)
-        
-        c_lembrete = hm.get("LembreteEnviado")
-        
-        if not c_lembrete:
-            return
-        
-        # Buscar linha pela chave
-        row = es._find_row_by_key(ws, chave)
-        
-        if row:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ws.cell(row=row, column=c_lembrete, value=timestamp)
-            wb.save(es.FILE_PATH)
+        # Sob o lock de escrita e com gravação atômica (excel_services)
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        es.atualizar_campos_por_chave(chave, {"LembreteEnviado": timestamp})
     
     except Exception as e:
         logger.error(f"Erro ao atualizar lembrete enviado: {e}")
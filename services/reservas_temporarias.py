@@ -0,0 +1,288 @@
+# services/reservas_temporarias.py
+"""
+Reservas temporárias (holds) de horário, fora da planilha.
+
+A maioria das reservas de 10 minutos expira ou é cancelada sem
+pagamento; gravar cada uma no xlsx (e de novo ao expirar) custava duas
+escritas completas da planilha. Aqui elas vivem apenas no backend de
+estado, com prazo (TTL), e só chegam à planilha quando viram
+"Pendente Pagamento" ou "Confirmado" (ver excel_services.persistir_reserva).
+
+Backends (variável RESERVAS_BACKEND):
+1. "memoria" (padrão): dict no processo. Suficiente com um único
+   processo (flask run / gunicorn -w 1).
+2. "sqlite": arquivo SQLite compartilhado entre os workers do gunicorn
+   (RESERVAS_DB, padrão: reservas_temporarias.sqlite3 ao lado da planilha).
+
+Reservas vencidas são ignoradas nas leituras e removidas pelo timer de
+expiração (remover_vencidas).
+"""
+
+import os
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+BACKEND = os.getenv("RESERVAS_BACKEND", "memoria").strip().lower()
+DB_PATH = os.getenv("RESERVAS_DB", "")
+
+# Validação da nova reserva contra as reservas ativas da mesma data
+Validador = Callable[[List[Dict[str, Any]]], bool]
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def _expira_em(reserva: Dict[str, Any]) -> float:
+    """Timestamp (epoch) de ReservadoAte."""
+    try:
+        return datetime.fromisoformat(str(reserva.get("reservado_ate") or "")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _agora_ts(agora: Optional[datetime]) -> float:
+    return (agora or datetime.now()).timestamp()
+
+
+def _caminho_db() -> str:
+    if DB_PATH:
+        return DB_PATH
+    try:
+        from services import excel_services as exc
+        pasta = os.path.dirname(exc.FILE_PATH)
+    except ImportError:
+        pasta = os.path.join(os.path.dirname(__file__), "..", "data")
+    return os.path.join(pasta, "reservas_temporarias.sqlite3")
+
+
+# =========================================================
+# Backends
+# =========================================================
+
+class _BackendMemoria:
+    """Reservas em um dict do processo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reservas: Dict[str, Dict[str, Any]] = {}
+        self._versao = 0
+
+    def criar(self, reserva: Dict[str, Any], validar: Validador) -> bool:
+        agora = _agora_ts(None)
+        with self._lock:
+            ativas = [
+                r for r in self._reservas.values()
+                if r["data"] == reserva["data"] and r["chave"] != reserva["chave"]
+                and _expira_em(r) > agora
+            ]
+            if not validar(ativas):
+                return False
+            self._reservas[reserva["chave"]] = dict(reserva)
+            self._versao += 1
+            return True
+
+    def ativas(self, data_str: Optional[str], agora: Optional[datetime]) -> List[Dict[str, Any]]:
+        limite = _agora_ts(agora)
+        with self._lock:
+            return [
+                dict(r) for r in self._reservas.values()
+                if (data_str is None or r["data"] == data_str) and _expira_em(r) > limite
+            ]
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            r = self._reservas.get(chave)
+            return dict(r) if r else None
+
+    def remover(self, chave: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            r = self._reservas.pop(chave, None)
+            if r is not None:
+                self._versao += 1
+            return r
+
+    def remover_vencidas(self, agora: Optional[datetime]) -> List[Dict[str, Any]]:
+        limite = _agora_ts(agora)
+        with self._lock:
+            vencidas = [r for r in self._reservas.values() if _expira_em(r) <= limite]
+            for r in vencidas:
+                del self._reservas[r["chave"]]
+            if vencidas:
+                self._versao += 1
+            return vencidas
+
+    def versao(self) -> int:
+        return self._versao
+
+
+class _BackendSQLite:
+    """Reservas em um arquivo SQLite compartilhado entre processos."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conexao() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS reservas ("
+                " chave TEXT PRIMARY KEY, data TEXT NOT NULL,"
+                " expira REAL NOT NULL, dados TEXT NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS idx_reservas_data ON reservas (data)")
+            con.execute("CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY, versao INTEGER NOT NULL)")
+            con.execute("INSERT OR IGNORE INTO meta (id, versao) VALUES (1, 0)")
+
+    def _conexao(self) -> sqlite3.Connection:
+        # Uma conexão por thread; transações explícitas com BEGIN IMMEDIATE
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def _transacao(self, funcao: Callable[[sqlite3.Connection], Any]) -> Any:
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            resultado = funcao(con)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return resultado
+
+    @staticmethod
+    def _incrementar_versao(con: sqlite3.Connection):
+        con.execute("UPDATE meta SET versao = versao + 1 WHERE id = 1")
+
+    def criar(self, reserva: Dict[str, Any], validar: Validador) -> bool:
+        def operacao(con):
+            linhas = con.execute(
+                "SELECT dados FROM reservas WHERE data = ? AND chave != ? AND expira > ?",
+                (reserva["data"], reserva["chave"], _agora_ts(None)),
+            ).fetchall()
+            if not validar([json.loads(d) for (d,) in linhas]):
+                return False
+            con.execute(
+                "INSERT OR REPLACE INTO reservas (chave, data, expira, dados) VALUES (?, ?, ?, ?)",
+                (reserva["chave"], reserva["data"], _expira_em(reserva), json.dumps(reserva)),
+            )
+            self._incrementar_versao(con)
+            return True
+        return self._transacao(operacao)
+
+    def ativas(self, data_str: Optional[str], agora: Optional[datetime]) -> List[Dict[str, Any]]:
+        con = self._conexao()
+        if data_str is None:
+            linhas = con.execute("SELECT dados FROM reservas WHERE expira > ?", (_agora_ts(agora),))
+        else:
+            linhas = con.execute(
+                "SELECT dados FROM reservas WHERE data = ? AND expira > ?", (data_str, _agora_ts(agora))
+            )
+        return [json.loads(d) for (d,) in linhas.fetchall()]
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        linha = self._conexao().execute("SELECT dados FROM reservas WHERE chave = ?", (chave,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def remover(self, chave: str) -> Optional[Dict[str, Any]]:
+        def operacao(con):
+            linha = con.execute("SELECT dados FROM reservas WHERE chave = ?", (chave,)).fetchone()
+            if not linha:
+                return None
+            con.execute("DELETE FROM reservas WHERE chave = ?", (chave,))
+            self._incrementar_versao(con)
+            return json.loads(linha[0])
+        return self._transacao(operacao)
+
+    def remover_vencidas(self, agora: Optional[datetime]) -> List[Dict[str, Any]]:
+        def operacao(con):
+            limite = _agora_ts(agora)
+            linhas = con.execute("SELECT dados FROM reservas WHERE expira <= ?", (limite,)).fetchall()
+            if linhas:
+                con.execute("DELETE FROM reservas WHERE expira <= ?", (limite,))
+                self._incrementar_versao(con)
+            return [json.loads(d) for (d,) in linhas]
+        return self._transacao(operacao)
+
+    def versao(self) -> int:
+        return self._conexao().execute("SELECT versao FROM meta WHERE id = 1").fetchone()[0]
+
+
+_backends: Dict[Any, Any] = {}
+_backends_lock = threading.Lock()
+
+
+def _backend():
+    """Backend configurado (um por tipo/caminho, criado na primeira chamada)."""
+    chave = (BACKEND, _caminho_db() if BACKEND == "sqlite" else None)
+    backend = _backends.get(chave)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(chave)
+            if backend is None:
+                if BACKEND == "sqlite":
+                    backend = _BackendSQLite(chave[1])
+                else:
+                    if BACKEND != "memoria":
+                        logger.warning(f"[RESERVAS] Backend desconhecido '{BACKEND}', usando memória")
+                    backend = _BackendMemoria()
+                _backends[chave] = backend
+    return backend
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def criar(reserva: Dict[str, Any], validar: Validador) -> bool:
+    """
+    Registra a reserva se `validar(ativas)` aprovar, de forma atômica.
+
+    Args:
+        reserva: Dict com chave, data, hora, chat_id, servico_id,
+                 servico_duracao, cliente_nome, cliente_id,
+                 reservado_em e reservado_ate (ISO)
+        validar: Recebe as outras reservas ativas da mesma data e
+                 retorna True se o horário continua livre
+
+    Returns:
+        True se a reserva foi registrada
+    """
+    return _backend().criar(reserva, validar)
+
+
+def ativas(data_str: Optional[str] = None, agora: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Reservas dentro do prazo (de uma data ou de todas)."""
+    return _backend().ativas(data_str, agora)
+
+
+def obter(chave: str) -> Optional[Dict[str, Any]]:
+    """Reserva pela chave, mesmo que o prazo já tenha passado."""
+    return _backend().obter(chave)
+
+
+def remover(chave: str) -> Optional[Dict[str, Any]]:
+    """Remove e retorna a reserva (None se não existir)."""
+    return _backend().remover(chave)
+
+
+def remover_vencidas(agora: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Remove e retorna as reservas com prazo vencido."""
+    return _backend().remover_vencidas(agora)
+
+
+def versao() -> int:
+    """Sobe a cada reserva criada/removida (em qualquer processo, no sqlite)."""
+    return _backend().versao()
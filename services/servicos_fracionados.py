@@ -5,27 +5,24 @@ que permitem agendamentos intercalados durante pausas.
 """
 
 import os
-import json
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Optional
 
+from services import config_registry
+
 # Caminho para configuração
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "servicos_detalhados.json")
 
 
 def carregar_servicos() -> Dict:
-    """Carrega configuração de serviços do JSON."""
-    try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {"servicos": [], "configuracoes": {}}
+    """Carrega configuração de serviços do JSON (visão imutável do config_registry)."""
+    return config_registry.obter(CONFIG_PATH, {"servicos": [], "configuracoes": {}})
 
 
 def listar_servicos() -> List[Dict]:
     """Retorna lista de todos os serviços disponíveis."""
     config = carregar_servicos()
-    return config.get("servicos", [])
+    return list(config.get("servicos", []))
 
 
 def get_servico_por_id(servico_id: str) -> Optional[Dict]:
@@ -248,14 +245,8 @@ def listar_servicos_formatado() -> str:
     Retorna lista de serviços formatada para exibição no chat.
     """
     # Carregar do servicos.json
-    try:
-        import os
-        servicos_path = os.path.join(os.path.dirname(__file__), "..", "config", "servicos.json")
-        with open(servicos_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            servicos = data.get("servicos", [])
-    except Exception:
-        return "Nenhum serviço disponível no momento."
+    data = config_registry.obter("servicos.json", {})
+    servicos = data.get("servicos", [])
     
     if not servicos:
         return "Nenhum serviço disponível no momento."
@@ -0,0 +1,213 @@
+# services/sessoes_waha.py
+"""
+Várias sessões do WAHA (números de WhatsApp) no mesmo atendimento.
+
+Com uma sessão só, o número único limitava o volume de envio (ver
+limite_envio) e, se caísse, o bot parava. Com WAHA_SESSIONS o tráfego se
+divide entre os números:
+
+1. Entrada: o webhook aceita eventos de qualquer sessão configurada
+   (antes, só de WAHA_SESSION) e anota por qual sessão o chat falou, num
+   SQLite compartilhado: spool reprocessado, outros workers e lembretes
+   respondem pelo mesmo número
+2. Saída fixa por chat: a resposta sai pela sessão em que o cliente
+   escreveu; chats sem sessão conhecida (ex.: lembretes) são distribuídos
+   por hash do chat_id, sempre o mesmo número para o mesmo cliente
+3. Saúde por sessão: cada sessão tem o seu disjuntor (waha_transporte) e
+   o seu balde de envio (limite_envio); com o circuito da sessão do chat
+   aberto ou meio-aberto, a mensagem sai pela próxima sessão com o
+   circuito fechado
+
+Configuração (ENV):
+- WAHA_SESSIONS: sessões separadas por vírgula (padrão: WAHA_SESSION)
+- WAHA_SESSOES_MAX_CHATS: chats lembrados na memória do processo (padrão
+  50000; usada se o SQLite falhar)
+- WAHA_SESSOES_DB: SQLite chat -> sessão (padrão: sessoes_chat.sqlite3 ao
+  lado da planilha). Só usado com mais de uma sessão
+"""
+
+import os
+import time
+import zlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services import waha_transporte
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+SESSOES: List[str] = [
+    s.strip() for s in os.getenv("WAHA_SESSIONS", "").split(",") if s.strip()
+] or [waha_transporte.WAHA_SESSION]
+MAX_CHATS = int(os.getenv("WAHA_SESSOES_MAX_CHATS", "50000"))
+DB_PATH = os.getenv("WAHA_SESSOES_DB", "")
+
+_lock = threading.Lock()
+_sessao_do_chat: "OrderedDict[str, str]" = OrderedDict()  # chat_id -> sessão de entrada (LRU)
+_stats = {"fixas": 0, "hash": 0, "desviadas": 0}
+_stats_entrada: Dict[str, int] = {}
+_local = threading.local()
+_stats_db = {"erros_db": 0}
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def _por_hash(chat_id: str) -> int:
+    """Índice da sessão do chat em SESSOES (estável entre processos)."""
+    return zlib.crc32(str(chat_id).encode("utf-8")) % len(SESSOES)
+
+
+def _caminho_db() -> str:
+    if DB_PATH:
+        return DB_PATH
+    try:
+        from services import excel_services as exc
+        pasta = os.path.dirname(exc.FILE_PATH)
+    except ImportError:
+        pasta = os.path.join(os.path.dirname(__file__), "..", "data")
+    return os.path.join(pasta, "sessoes_chat.sqlite3")
+
+
+def _conexao() -> sqlite3.Connection:
+    path = _caminho_db()
+    con = getattr(_local, "con", None)
+    if con is None or getattr(_local, "path", None) != path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        con = sqlite3.connect(path, timeout=10, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS sessoes_chat ("
+            " chat_id TEXT PRIMARY KEY, sessao TEXT NOT NULL, atualizado_em REAL NOT NULL)"
+        )
+        _local.con, _local.path = con, path
+    return con
+
+
+def _gravar_db(chat_id: str, sessao: str):
+    try:
+        _conexao().execute(
+            "INSERT INTO sessoes_chat (chat_id, sessao, atualizado_em) VALUES (?, ?, ?)"
+            " ON CONFLICT(chat_id) DO UPDATE SET sessao = excluded.sessao, atualizado_em = excluded.atualizado_em",
+            (chat_id, sessao, time.time()),
+        )
+    except Exception as e:
+        logger.error(f"[SESSOES] Falha ao gravar a sessão de {chat_id}: {e}")
+        with _lock:
+            _stats_db["erros_db"] += 1
+
+
+def _ler_db(chat_id: str) -> Optional[str]:
+    """Sessão de entrada gravada por qualquer processo (None se não há ou se falhou)."""
+    try:
+        linha = _conexao().execute("SELECT sessao FROM sessoes_chat WHERE chat_id = ?", (chat_id,)).fetchone()
+    except Exception as e:
+        logger.error(f"[SESSOES] Falha ao ler a sessão de {chat_id}: {e}")
+        with _lock:
+            _stats_db["erros_db"] += 1
+        return None
+    return linha[0] if linha else None
+
+
+def _saudavel(sessao: str) -> bool:
+    # Meio-aberto não conta: só a chamada de teste passa, as demais seriam recusadas
+    return waha_transporte.estado_circuito(sessao) == waha_transporte.FECHADO
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def principal() -> str:
+    """Primeira sessão configurada (endpoints sem chat, healthz)."""
+    return SESSOES[0]
+
+
+def aceita(sessao: Optional[str]) -> bool:
+    """Evento sem sessão ou de uma sessão configurada."""
+    return not sessao or str(sessao) in SESSOES
+
+
+def registrar_entrada(chat_id: str, sessao: Optional[str]):
+    """Anota por qual sessão o chat escreveu (a resposta sai por ela)."""
+    if not chat_id or not sessao or str(sessao) not in SESSOES:
+        return
+    sessao = str(sessao)
+    if len(SESSOES) > 1:
+        # Sempre grava (outro worker pode ter mudado a sessão do chat), e
+        # antes do spool: reprocessamento e outros workers a encontram
+        _gravar_db(chat_id, sessao)
+    with _lock:
+        _sessao_do_chat[chat_id] = sessao
+        _sessao_do_chat.move_to_end(chat_id)
+        while len(_sessao_do_chat) > MAX_CHATS:
+            _sessao_do_chat.popitem(last=False)
+        _stats_entrada[sessao] = _stats_entrada.get(sessao, 0) + 1
+
+
+def sessao_do_chat(chat_id: str) -> str:
+    """
+    Sessão pela qual enviar ao chat: a de entrada do chat, senão a do
+    hash; se o circuito dela estiver aberto, a próxima sessão saudável
+    (na ordem de SESSOES). Com todas fora do ar, a preferida.
+    """
+    if len(SESSOES) == 1:
+        return SESSOES[0]
+    fixa = _ler_db(chat_id)
+    if fixa is None:
+        with _lock:
+            fixa = _sessao_do_chat.get(chat_id)
+    if fixa in SESSOES:
+        inicio = SESSOES.index(fixa)
+    else:
+        fixa = None
+        inicio = _por_hash(chat_id)
+
+    for passo in range(len(SESSOES)):
+        sessao = SESSOES[(inicio + passo) % len(SESSOES)]
+        if _saudavel(sessao):
+            with _lock:
+                _stats["desviadas" if passo else ("fixas" if fixa else "hash")] += 1
+            if passo:
+                logger.warning(f"[SESSOES] {SESSOES[inicio]} indisponível; {chat_id} vai por {sessao}")
+            return sessao
+    return SESSOES[inicio]
+
+
+def segundos_ate_tentar() -> float:
+    """Espera até alguma sessão aceitar envios (0 = há sessão disponível)."""
+    return min(waha_transporte.segundos_ate_tentar(s) for s in SESSOES)
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Sessões, estado do circuito de cada uma e como os envios foram roteados."""
+    with _lock:
+        return {
+            "sessoes": {s: waha_transporte.estado_circuito(s) for s in SESSOES},
+            "chats_fixos": len(_sessao_do_chat),
+            "entrada_por_sessao": dict(_stats_entrada),
+            **_stats,
+            **_stats_db,
+        }
+
+
+def resetar():
+    """Esquece a sessão dos chats (memória e SQLite) e zera os contadores."""
+    with _lock:
+        _sessao_do_chat.clear()
+        _stats_entrada.clear()
+        for k in _stats:
+            _stats[k] = 0
+        _stats_db["erros_db"] = 0
+    if len(SESSOES) > 1 or os.path.exists(_caminho_db()):
+        try:
+            _conexao().execute("DELETE FROM sessoes_chat")
+        except Exception as e:
+            logger.error(f"[SESSOES] Falha ao limpar {_caminho_db()}: {e}")
@@ -11,16 +11,19 @@ Gera slots de agendamento baseado em:
 Permite máximo aproveitamento da agenda.
 """
 
-import os
-import json
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services import config_registry
+from services.agenda_dinamica import hhmm_para_minutos
 
 # =========================================================
 # Configuração
 # =========================================================
 GRANULARIDADE_MINUTOS = 10  # Slots de 10 em 10 minutos
 MIN_DURACAO_SERVICO = 10    # Serviço mínimo: 10min
+MINUTOS_DIA = 24 * 60
+RECURSO_PADRAO = "principal"  # Mesmo id de agenda_dinamica.RECURSO_PADRAO
 
 # =========================================================
 # Funções Auxiliares
@@ -39,13 +42,8 @@ def _time_to_str(dt: datetime) -> str:
 
 
 def _carregar_servicos() -> Dict:
-    """Carrega configuração de serviços."""
-    try:
-        servicos_path = os.path.join(os.path.dirname(__file__), "..", "config", "servicos.json")
-        with open(servicos_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {"servicos": []}
+    """Configuração de serviços (servicos.json, via config_registry)."""
+    return config_registry.obter("servicos.json", {"servicos": []})
 
 
 def _obter_duracao_servico(servico_id: str) -> int:
@@ -75,6 +73,58 @@ def _obter_etapas_servico(servico_id: str) -> List[Dict]:
     return []
 
 
+def _bits(inicio: int, fim: int) -> int:
+    """Bitset com os minutos [inicio, fim) ligados."""
+    if fim <= inicio:
+        return 0
+    return ((1 << (fim - inicio)) - 1) << inicio
+
+
+def _mascara_servico(servico_id: str, duracao: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Retorna (mascara, duracao_total) do serviço.
+
+    A máscara é um bitset de minutos relativos ao início do atendimento
+    em que o barbeiro fica ocupado; pausas aproveitáveis ficam desligadas.
+    Serviços ausentes do servicos.json são buscados no catálogo detalhado.
+    """
+    config = _carregar_servicos()
+    for servico in config.get("servicos", []):
+        if servico.get("id") == servico_id:
+            if servico.get("fracionado", False):
+                etapas = [
+                    (e.get("duracao_minutos", 0), not e.get("permite_outro_atendimento", False))
+                    for e in servico.get("etapas", [])
+                ]
+            else:
+                etapas = [(duracao or servico.get("duracao_minutos", 40), True)]
+            break
+    else:
+        etapas = []
+        try:
+            from services import servicos_fracionados as sf
+            detalhado = sf.get_servico_por_id(servico_id)
+        except ImportError:
+            detalhado = None
+        if detalhado and detalhado.get("tipo") == "fracionado":
+            etapas = [
+                (e.get("duracao_minutos", 0), e.get("barbeiro_ocupado", True))
+                for e in detalhado.get("etapas", [])
+            ]
+        elif detalhado:
+            etapas = [(duracao or detalhado.get("duracao_minutos", 40), True)]
+        else:
+            etapas = [(duracao or 40, True)]
+
+    mascara = 0
+    cursor = 0
+    for etapa_duracao, ocupa in etapas:
+        if ocupa:
+            mascara |= _bits(cursor, cursor + etapa_duracao)
+        cursor += etapa_duracao
+    return mascara, cursor
+
+
 # =========================================================
 # Geração de Slots Base
 # =========================================================
@@ -117,6 +167,129 @@ def gerar_slots_base_dia(
 # Análise de Ocupação
 # =========================================================
 
+def _verificador_reserva_vencida():
+    """excel_services.reserva_vencida, ou um verificador nulo sem a planilha."""
+    try:
+        from services import excel_services as exc
+        return exc.reserva_vencida
+    except ImportError:
+        return lambda status, reservado_ate, agora=None: False
+
+
+def _ocupacoes(agendamentos: List[Dict]) -> Iterator[Tuple[str, str, int]]:
+    """(data, recurso_id ou "", bitset) de cada agendamento que ocupa horário."""
+    mascaras: Dict[Tuple[str, int], Tuple[int, int]] = {}
+    reserva_vencida = _verificador_reserva_vencida()
+    agora = datetime.now()
+    
+    for ag in agendamentos:
+        status = str(ag.get("Status") or "").lower()
+        if status in ["cancelado", "expirado"]:
+            continue
+        # Reserva temporária vencida conta como livre (mesmo antes do timer gravar)
+        if reserva_vencida(ag.get("Status"), ag.get("ReservadoAte"), agora):
+            continue
+        
+        data_str = str(ag.get("Data") or "").strip()
+        inicio = hhmm_para_minutos(ag.get("Hora") or "")
+        if not data_str or inicio is None:
+            continue
+        
+        servico_id = ag.get("ServicoID") or "cabelo_sobrancelha"
+        try:
+            duracao = int(ag.get("ServicoDuracao") or 0)
+        except (TypeError, ValueError):
+            duracao = 0
+        
+        chave = (servico_id, duracao)
+        if chave not in mascaras:
+            mascaras[chave] = _mascara_servico(servico_id, duracao or None)
+        mascara, _ = mascaras[chave]
+        
+        yield data_str, str(ag.get("RecursoID") or "").strip(), mascara << inicio
+
+
+def indice_ocupacao(agendamentos: List[Dict]) -> Dict[str, int]:
+    """
+    Monta o índice de ocupação de vários dias em uma única passada.
+    
+    Args:
+        agendamentos: Lista de agendamentos (qualquer data)
+    
+    Returns:
+        Dict data (DD/MM/YYYY) -> bitset dos minutos em que o barbeiro
+        está ocupado. Pausas de serviços fracionados ficam livres.
+        Todos os recursos somados (visão de um único barbeiro).
+    """
+    indice: Dict[str, int] = {}
+    for data_str, _, bits in _ocupacoes(agendamentos):
+        indice[data_str] = indice.get(data_str, 0) | bits
+    return indice
+
+
+def _recursos_dia(data_str: str) -> List[Dict[str, Any]]:
+    """Recursos que atendem na data (um implícito sem agenda)."""
+    try:
+        from services import agenda_dinamica as ag
+    except ImportError:
+        return [{"id": RECURSO_PADRAO, "nome": "Barbeiro", "inicio": None, "fim": None, "pausas": ()}]
+    return ag.obter_recursos_dia(data_str)
+
+
+def _indisponibilidade_recurso(recurso: Dict[str, Any]) -> int:
+    """Bitset dos minutos fora do expediente próprio do recurso (0 se não tiver)."""
+    inicio, fim = recurso.get("inicio"), recurso.get("fim")
+    if inicio is None or fim is None:
+        return 0
+    bits = _bits(0, inicio) | _bits(fim, 2 * MINUTOS_DIA)
+    for p_inicio, p_fim in recurso.get("pausas", ()):
+        bits |= _bits(p_inicio, p_fim)
+    return bits
+
+
+def indice_ocupacao_recursos(agendamentos: List[Dict]) -> Dict[str, Dict[str, int]]:
+    """
+    Índice de ocupação por data e por recurso (cadeira/barbeiro).
+    
+    Agendamentos sem RecursoID (anteriores aos recursos) ou de um recurso
+    que não atende mais na data entram no primeiro recurso livre no
+    horário deles (first-fit), na ordem da configuração.
+    
+    Returns:
+        Dict data -> {recurso_id: bitset}
+    """
+    indice: Dict[str, Dict[str, int]] = {}
+    recursos_por_data: Dict[str, List[Dict[str, Any]]] = {}
+    sem_recurso: List[Tuple[str, int]] = []
+    
+    for data_str, recurso_id, bits in _ocupacoes(agendamentos):
+        if data_str not in recursos_por_data:
+            recursos_por_data[data_str] = _recursos_dia(data_str)
+            indice[data_str] = {r["id"]: 0 for r in recursos_por_data[data_str]}
+        if recurso_id in indice[data_str]:
+            indice[data_str][recurso_id] |= bits
+        else:
+            sem_recurso.append((data_str, bits))
+    
+    for data_str, bits in sem_recurso:
+        ocupacao = indice[data_str]
+        recursos = recursos_por_data[data_str]
+        if not recursos:
+            ocupacao[RECURSO_PADRAO] = ocupacao.get(RECURSO_PADRAO, 0) | bits
+            continue
+        destino = next(
+            (r["id"] for r in recursos
+             if not bits & (ocupacao[r["id"]] | _indisponibilidade_recurso(r))),
+            None
+        ) or next(
+            (r["id"] for r in recursos if not bits & ocupacao[r["id"]]),
+            recursos[0]["id"]
+        )
+        ocupacao[destino] |= bits
+    
+    return indice
+
+
 def calcular_intervalos_ocupados(
     data_str: str,
     agendamentos: List[Dict]
@@ -280,26 +453,332 @@ def obter_proximo_slot_disponivel(
     Returns:
         Próximo horário disponível ou None
     """
-    slots = gerar_slots_disponiveis_para_servico(
-        data_str, 
-        servico_id, 
-        agendamentos_existentes
-    )
+    apos = hhmm_para_minutos(apos_horario)
+    if apos is None:
+        return None
+    
+    ocupacao = indice_ocupacao(agendamentos_existentes).get(data_str, 0)
+    mascara, _ = _mascara_servico(servico_id)
+    
+    for hora_str in gerar_slots_base_dia(data_str):
+        inicio = hhmm_para_minutos(hora_str)
+        if inicio is None or inicio < apos:
+            continue
+        if not (mascara << inicio) & ocupacao:
+            return hora_str
+    
+    return None
+
+
+def _carregar_agendamentos() -> List[Dict]:
+    """Lê todos os agendamentos da planilha uma única vez, mais as reservas temporárias."""
+    try:
+        from services import excel_services as exc
+    except ImportError:
+        return []
+    return list(exc._read_rows()) + exc.linhas_reservas_temporarias()
+
+
+def _obter_janela_dia(data_str: str) -> Optional[Dict]:
+    """Janela de atendimento do dia segundo o padrão semanal da agenda."""
+    try:
+        from services import agenda_dinamica as ag
+    except ImportError:
+        ag = None
+    
+    if ag is not None:
+        return ag.obter_janela_dia(data_str)
     
+    slots = gerar_slots_base_dia(data_str)
+    return {
+        "slots": slots,
+        "inicio": hhmm_para_minutos("08:00"),
+        "fim": hhmm_para_minutos("18:00"),
+        "pausas": [],
+        "fonte": "padrao",
+    }
+
+
+def _dia_fechado(data_str: str) -> bool:
+    """Feriado ou bloqueio, pelo índice do calendário (sem ler planilha)."""
     try:
-        apos_dt = _parse_time(apos_horario)
+        from services import calendario
+    except ImportError:
+        return False
+    return calendario.eh_dia_fechado(data_str)
+
+
+def _primeiro_inicio_viavel(
+    janela: Dict,
+    bloqueios: Sequence[Tuple[str, int]],
+    mascara: int,
+    duracao: int,
+    minimo: int = 0
+) -> Optional[str]:
+    """Primeiro slot da janela em que o serviço inteiro cabe em algum recurso."""
+    fim_expediente = janela.get("fim")
+    
+    for hora_str in janela.get("slots", []):
+        inicio = hhmm_para_minutos(hora_str)
+        if inicio is None or inicio < minimo:
+            continue
+        if _motivo_indisponivel(inicio, bloqueios, mascara, duracao, fim_expediente) is None:
+            return hora_str
+    
+    return None
+
+
+def _bloqueio_janela(janela: Dict, ocupacao: int) -> int:
+    """Ocupação do dia somada às pausas da agenda (almoço etc)."""
+    bloqueio = ocupacao
+    for p_inicio, p_fim in janela.get("pausas", []):
+        bloqueio |= _bits(p_inicio, p_fim)
+    return bloqueio
+
+
+def _bloqueios_recursos(
+    data_str: str,
+    janela: Optional[Dict],
+    ocupacao: Dict[str, int]
+) -> List[Tuple[str, int]]:
+    """
+    (recurso_id, bitset bloqueado) de cada recurso da data: pausas da
+    barbearia + expediente próprio do recurso + agendamentos dele.
+    """
+    base = _bloqueio_janela(janela, 0) if janela else 0
+    return [
+        (r["id"], base | _indisponibilidade_recurso(r) | ocupacao.get(r["id"], 0))
+        for r in _recursos_dia(data_str)
+    ]
+
+
+def _recurso_viavel(
+    inicio: int,
+    bloqueios: Sequence[Tuple[str, int]],
+    mascara: int,
+    preferido: Optional[str] = None
+) -> Optional[str]:
+    """Recurso em que o serviço cabe a partir de `inicio` (preferido primeiro)."""
+    deslocada = mascara << inicio
+    if preferido is not None:
+        for recurso_id, bloqueio in bloqueios:
+            if recurso_id == preferido and not deslocada & bloqueio:
+                return recurso_id
+    for recurso_id, bloqueio in bloqueios:
+        if not deslocada & bloqueio:
+            return recurso_id
+    return None
+
+
+def _motivo_indisponivel(
+    inicio: int,
+    bloqueios: Sequence[Tuple[str, int]],
+    mascara: int,
+    duracao: int,
+    fim_expediente: Optional[int]
+) -> Optional[str]:
+    """None se o serviço cabe a partir de `inicio` em algum recurso, senão o motivo."""
+    if fim_expediente is not None and inicio + duracao > fim_expediente:
+        return "Ultrapassa o expediente"
+    if _recurso_viavel(inicio, bloqueios, mascara) is None:
+        return "Horário ocupado"
+    return None
+
+
+def escolher_recurso(
+    data_str: str,
+    hora_str: str,
+    servico_id: str,
+    agendamentos: List[Dict],
+    preferido: Optional[str] = None
+) -> Optional[str]:
+    """
+    Passo de atribuição da reserva: primeiro recurso livre para o serviço.
+    
+    Considera só a ocupação e o expediente próprio de cada recurso; a
+    janela da barbearia é validada pelo fluxo/grade.
+    
+    Args:
+        data_str: Data DD/MM/YYYY
+        hora_str: Início HH:MM
+        servico_id: ID do serviço
+        agendamentos: Agendamentos que ocupam horário (qualquer data)
+        preferido: Recurso a tentar primeiro (ex.: o da reserva temporária)
+    
+    Returns:
+        ID do recurso ou None se nenhum comporta o serviço
+    """
+    inicio = hhmm_para_minutos(hora_str)
+    if inicio is None:
+        return None
+    ocupacao = indice_ocupacao_recursos(agendamentos).get(data_str, {})
+    mascara, _ = _mascara_servico(servico_id)
+    return _recurso_viavel(inicio, _bloqueios_recursos(data_str, None, ocupacao), mascara, preferido)
+
+
+def proximo_horario_livre(
+    servico_id: str,
+    a_partir_de: Optional[datetime] = None,
+    limite_dias: int = 14,
+    agendamentos: Optional[List[Dict]] = None
+) -> Optional[Dict[str, str]]:
+    """
+    Busca o primeiro horário livre para um serviço, avançando dia a dia.
+    
+    Usa o padrão semanal da agenda (bloqueios, slots personalizados,
+    almoço) e o índice de ocupação por recurso montado com uma única
+    leitura dos agendamentos; para no primeiro encaixe viável.
+    
+    Args:
+        servico_id: ID do serviço
+        a_partir_de: Momento inicial da busca (padrão: agora)
+        limite_dias: Quantos dias à frente verificar
+        agendamentos: Lista de agendamentos (lida da planilha se omitida)
+    
+    Returns:
+        {"data": "DD/MM/YYYY", "hora": "HH:MM"} ou None se nada couber
+    """
+    if a_partir_de is None:
+        a_partir_de = datetime.now()
+    if agendamentos is None:
+        agendamentos = _carregar_agendamentos()
+    
+    indice = indice_ocupacao_recursos(agendamentos)
+    mascara, duracao = _mascara_servico(servico_id)
+    
+    for offset in range(max(limite_dias, 0)):
+        dia = a_partir_de.date() + timedelta(days=offset)
+        data_str = dia.strftime("%d/%m/%Y")
         
-        for slot in slots:
-            if slot["disponivel"]:
-                slot_dt = _parse_time(slot["hora"])
-                if slot_dt >= apos_dt:
-                    return slot["hora"]
-    except Exception:
-        pass
+        if _dia_fechado(data_str):
+            continue
+        
+        janela = _obter_janela_dia(data_str)
+        if not janela:
+            continue
+        
+        minimo = a_partir_de.hour * 60 + a_partir_de.minute if offset == 0 else 0
+        bloqueios = _bloqueios_recursos(data_str, janela, indice.get(data_str, {}))
+        hora_str = _primeiro_inicio_viavel(janela, bloqueios, mascara, duracao, minimo)
+        if hora_str:
+            return {"data": data_str, "hora": hora_str}
     
     return None
 
 
+def _calcular_grade(
+    data_str: str,
+    servico_id: str,
+    agendamentos: Optional[List[Dict]]
+) -> Tuple[Tuple[str, bool, str], ...]:
+    """Grade (hora, disponivel, motivo) do dia segundo a agenda."""
+    if _dia_fechado(data_str):
+        return ()
+    
+    janela = _obter_janela_dia(data_str)
+    if not janela:
+        return ()
+    
+    if agendamentos is None:
+        try:
+            from services import excel_services as exc
+            agendamentos = exc.obter_agendamentos_do_dia(data_str)
+        except ImportError:
+            agendamentos = []
+    
+    ocupacao = indice_ocupacao_recursos(agendamentos).get(data_str, {})
+    bloqueios = _bloqueios_recursos(data_str, janela, ocupacao)
+    mascara, duracao = _mascara_servico(servico_id)
+    
+    grade = []
+    for hora_str in janela.get("slots", []):
+        inicio = hhmm_para_minutos(hora_str)
+        if inicio is None:
+            continue
+        motivo = _motivo_indisponivel(inicio, bloqueios, mascara, duracao, janela.get("fim"))
+        grade.append((hora_str, motivo is None, motivo or ""))
+    return tuple(grade)
+
+
+def grade_disponibilidade(
+    data_str: str,
+    servico_id: str,
+    agendamentos: Optional[List[Dict]] = None
+) -> List[Dict]:
+    """
+    Grade de horários do dia para um serviço, com cache LRU.
+    
+    Usa os slots da agenda dinâmica (padrão semanal, exceções e almoço)
+    e o índice de ocupação. A grade fica em cache até um agendamento da
+    data mudar de estado ou a agenda/feriados/catálogo mudarem.
+    
+    Args:
+        data_str: Data no formato DD/MM/YYYY
+        servico_id: ID do serviço
+        agendamentos: Agendamentos do dia (se informado, não usa cache)
+    
+    Returns:
+        Lista de dicts: [{"hora": "08:00", "disponivel": True, "motivo": ""}]
+    """
+    if agendamentos is not None:
+        grade = _calcular_grade(data_str, servico_id, agendamentos)
+    else:
+        try:
+            from services import cache_disponibilidade as cache
+        except ImportError:
+            cache = None
+        
+        if cache is None:
+            grade = _calcular_grade(data_str, servico_id, None)
+        else:
+            grade = cache.obter(
+                data_str, servico_id,
+                lambda: _calcular_grade(data_str, servico_id, None)
+            )
+    
+    return [
+        {"hora": hora, "disponivel": disponivel, "motivo": motivo}
+        for hora, disponivel, motivo in grade
+    ]
+
+
+def pre_calcular_grades(servico_id: str, datas: List[str]) -> int:
+    """
+    Preenche o cache com as grades do serviço para várias datas.
+    
+    Lê a planilha uma única vez para todas as datas (em vez de uma leitura
+    por dia, como faria grade_disponibilidade). Feito para rodar em
+    segundo plano logo após o cliente escolher o serviço.
+    
+    Args:
+        servico_id: ID do serviço escolhido
+        datas: Datas DD/MM/YYYY a calcular
+    
+    Returns:
+        Quantidade de datas processadas
+    """
+    try:
+        from services import cache_disponibilidade as cache
+    except ImportError:
+        return 0
+    
+    # Marca antes da leitura: se algo mudar no meio, o cache não guarda
+    desde = cache.marca()
+    por_data: Dict[str, List[Dict]] = {data_str: [] for data_str in datas}
+    for ag in _carregar_agendamentos():
+        data_ag = str(ag.get("Data", "")).strip()
+        if data_ag in por_data:
+            por_data[data_ag].append(ag)
+    
+    for data_str, agendamentos in por_data.items():
+        cache.obter(
+            data_str, servico_id,
+            lambda d=data_str, a=agendamentos: _calcular_grade(d, servico_id, a),
+            desde=desde,
+        )
+    return len(por_data)
+
+
 def calcular_total_slots_disponiveis(
     data_str: str,
     servico_id: str,
@@ -1,6 +1,7 @@
-import requests
 import os
 
+from services import waha_transporte
+
 
 class Waha:
 
@@ -8,6 +9,7 @@ class Waha:
         self.__api_url = api_url or base_url or url or os.getenv("WAHA_API_URL", "http://waha:3000")
         self.base_url = self.__api_url
         self.__api_key = os.getenv("WAHA_API_KEY", "")
+        self.session = os.getenv("WAHA_SESSION", "default") or "default"
 
     def _get_headers(self):
         headers = {
@@ -17,47 +19,46 @@ class Waha:
             headers['X-Api-Key'] = self.__api_key
         return headers
 
-    def send_message(self, chat_id, message):
-        url = f'{self.__api_url}/api/sendText'
+    def _post(self, path, payload):
+        response = waha_transporte.post(
+            path,
+            json=payload,
+            headers=self._get_headers(),
+            base_url=self.__api_url,
+            sessao_waha=payload['session'],
+        )
+        # Não-2xx sobe como erro: quem chama não pode contar como enviado
+        response.raise_for_status()
+        return response
+
+    def send_message(self, chat_id, message, session=None):
         payload = {
-            'session': 'default',
+            'session': session or self.session,
             'chatId': chat_id,
             'text': message,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=self._get_headers(),
-        )
+        self._post('/api/sendText', payload)
 
-    def get_history_messages(self, chat_id, limit):
-        url = f'{self.__api_url}/api/default/chats/{chat_id}/messages?limit={limit}&downloadMedia=false'
-        response = requests.get(
-            url=url,
+    def get_history_messages(self, chat_id, limit, session=None):
+        session = session or self.session
+        response = waha_transporte.get(
+            f'/api/{session}/chats/{chat_id}/messages?limit={limit}&downloadMedia=false',
             headers=self._get_headers(),
+            base_url=self.__api_url,
+            sessao_waha=session,
         )
         return response.json()
 
-    def start_typing(self, chat_id):
-        url = f'{self.__api_url}/api/startTyping'
+    def start_typing(self, chat_id, session=None):
         payload = {
-            'session': 'default',
+            'session': session or self.session,
             'chatId': chat_id,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=self._get_headers(),
-        )
+        self._post('/api/startTyping', payload)
 
-    def stop_typing(self, chat_id):
-        url = f'{self.__api_url}/api/stopTyping'
+    def stop_typing(self, chat_id, session=None):
         payload = {
-            'session': 'default',
+            'session': session or self.session,
             'chatId': chat_id,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=self._get_headers(),
-        )
\ No newline at end of file
+        self._post('/api/stopTyping', payload)
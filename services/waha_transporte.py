@@ -0,0 +1,362 @@
+# services/waha_transporte.py
+"""
+Transporte HTTP único para todas as chamadas ao WAHA.
+
+Antes cada mensagem e cada indicador de "digitando" fazia um
+requests.post solto, abrindo uma conexão TCP nova por chamada. Aqui há
+uma requests.Session por processo, com pool de conexões (HTTPAdapter)
+e keep-alive, compartilhada por:
+
+1. webhooks._send_http_waha / _typing_http
+2. services/waha.py (Waha)
+3. src/zapwaha/services/waha.py (WahaClient)
+
+Configuração (ENV):
+- WAHA_API_URL / WAHA_API_KEY / WAHA_SESSION
+- WAHA_POOL_SIZE: conexões mantidas por processo (padrão 8; deve cobrir
+  as threads que enviam: webhook, lembretes, timers)
+- WAHA_CONNECT_TIMEOUT / WAHA_READ_TIMEOUT: timeouts padrão em segundos
+- WAHA_CB_FALHAS / WAHA_CB_ABERTO_S: disjuntor (ver abaixo)
+
+Disjuntor (circuit breaker), um por sessão do WAHA: após WAHA_CB_FALHAS
+falhas seguidas (erro de rede, timeout ou 5xx) o circuito da sessão abre
+e as chamadas dela falham na hora com CircuitoAberto, sem ocupar
+threads. Passados WAHA_CB_ABERTO_S, uma única chamada de teste
+(meio-aberto) decide se fecha ou reabre. Chamadas sem `sessao` usam o
+disjuntor de WAHA_SESSION.
+
+Prazo: `with prazo(s):` limita o tempo total das chamadas feitas dentro
+do bloco na thread atual (os timeouts de cada chamada são reduzidos ao
+que resta; blocos aninhados respeitam o menor prazo).
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("ZapWaha")
+
+# =========================================================
+# Configuração
+# =========================================================
+WAHA_API_URL = os.getenv("WAHA_API_URL", "http://waha:3000").rstrip("/")
+WAHA_API_KEY = os.getenv("WAHA_API_KEY", "")
+WAHA_SESSION = (os.getenv("WAHA_SESSION", "default") or "default").strip()
+
+POOL_SIZE = int(os.getenv("WAHA_POOL_SIZE", "8"))
+TIMEOUT_CONEXAO = float(os.getenv("WAHA_CONNECT_TIMEOUT", "3"))
+TIMEOUT_LEITURA = float(os.getenv("WAHA_READ_TIMEOUT", "10"))
+CB_FALHAS = int(os.getenv("WAHA_CB_FALHAS", "5"))
+CB_ABERTO_S = float(os.getenv("WAHA_CB_ABERTO_S", "30"))
+ESPERA_TESTE_S = 0.5  # Intervalo sugerido enquanto a chamada de teste está em andamento
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+
+Timeout = Union[float, Tuple[float, float]]
+
+_lock = threading.Lock()
+_sessao: Optional[requests.Session] = None
+_sessao_pid: Optional[int] = None
+_stats = {"requisicoes": 0, "erros": 0, "tempo_total_ms": 0.0, "rejeitadas_circuito": 0, "aberturas": 0}
+
+_prazo_local = threading.local()
+
+
+class CircuitoAberto(requests.ConnectionError):
+    """WAHA considerado fora do ar: chamada recusada sem tentar a rede."""
+
+
+class PrazoEsgotado(requests.Timeout):
+    """O prazo do bloco `with prazo(...)` acabou antes da chamada."""
+
+
+# =========================================================
+# Helpers
+# =========================================================
+
+def _criar_sessao() -> requests.Session:
+    sessao = requests.Session()
+    # Só repete falhas de conexão: a requisição não chegou ao WAHA,
+    # então não há risco de mensagem duplicada
+    retry = Retry(total=1, connect=1, read=0, status=0, redirect=0)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(POOL_SIZE, 1),
+        max_retries=retry,
+    )
+    sessao.mount("http://", adapter)
+    sessao.mount("https://", adapter)
+    sessao.headers.update({"Content-Type": "application/json"})
+    return sessao
+
+
+def sessao() -> requests.Session:
+    """Session compartilhada do processo (recriada após fork do gunicorn)."""
+    global _sessao, _sessao_pid
+    pid = os.getpid()
+    if _sessao is None or _sessao_pid != pid:
+        with _lock:
+            if _sessao is None or _sessao_pid != pid:
+                _sessao = _criar_sessao()
+                _sessao_pid = pid
+    return _sessao
+
+
+def headers_padrao(api_key: Optional[str] = None) -> Dict[str, str]:
+    """Headers de autenticação do WAHA (X-Api-Key, se configurada)."""
+    chave = WAHA_API_KEY if api_key is None else api_key
+    return {"X-Api-Key": chave} if chave else {}
+
+
+def url(caminho: str, base_url: Optional[str] = None) -> str:
+    """URL absoluta: caminhos relativos usam WAHA_API_URL (ou base_url)."""
+    if caminho.startswith(("http://", "https://")):
+        return caminho
+    return f"{(base_url or WAHA_API_URL).rstrip('/')}/{caminho.lstrip('/')}"
+
+
+# =========================================================
+# Disjuntor
+# =========================================================
+
+class _Disjuntor:
+    """Estado do circuito de uma sessão."""
+
+    def __init__(self, sessao: str):
+        self.sessao = sessao
+        self.estado = FECHADO
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.teste_em_andamento = False
+
+    def permitir(self):
+        """Libera a chamada ou levanta CircuitoAberto."""
+        with _cb_lock:
+            if self.estado == FECHADO:
+                return
+            if self.estado == ABERTO and time.monotonic() >= self.aberto_ate:
+                self.estado = MEIO_ABERTO
+            if self.estado == MEIO_ABERTO and not self.teste_em_andamento:
+                self.teste_em_andamento = True
+                return
+            _stats["rejeitadas_circuito"] += 1
+        raise CircuitoAberto(f"WAHA indisponível (circuito {self.estado}, sessão {self.sessao})")
+
+    def registrar(self, sucesso: bool):
+        with _cb_lock:
+            teste = self.estado == MEIO_ABERTO
+            self.teste_em_andamento = False
+            if sucesso:
+                if self.estado != FECHADO:
+                    logger.info(f"[WAHA] Circuito da sessão {self.sessao} fechado: WAHA respondeu")
+                self.estado = FECHADO
+                self.falhas = 0
+                return
+            self.falhas += 1
+            if teste or self.falhas >= CB_FALHAS:
+                if self.estado != ABERTO:
+                    _stats["aberturas"] += 1
+                    logger.warning(f"[WAHA] Circuito da sessão {self.sessao} aberto por "
+                                   f"{CB_ABERTO_S:.0f}s após {self.falhas} falhas")
+                self.estado = ABERTO
+                self.aberto_ate = time.monotonic() + CB_ABERTO_S
+
+    def liberar_teste(self):
+        with _cb_lock:
+            self.teste_em_andamento = False
+
+    def estado_atual(self) -> str:
+        if self.estado == ABERTO and time.monotonic() >= self.aberto_ate:
+            return MEIO_ABERTO
+        return self.estado
+
+    def segundos_ate_tentar(self) -> float:
+        if self.estado == FECHADO:
+            return 0.0
+        restante = self.aberto_ate - time.monotonic()
+        if self.estado == ABERTO and restante > 0:
+            return restante
+        return ESPERA_TESTE_S if self.teste_em_andamento else 0.0
+
+
+_cb_lock = threading.Lock()
+_disjuntores: Dict[str, _Disjuntor] = {}
+
+
+def _disjuntor(sessao: Optional[str] = None) -> _Disjuntor:
+    sessao = sessao or WAHA_SESSION
+    disjuntor = _disjuntores.get(sessao)
+    if disjuntor is None:
+        with _cb_lock:
+            disjuntor = _disjuntores.setdefault(sessao, _Disjuntor(sessao))
+    return disjuntor
+
+
+def estado_circuito(sessao: Optional[str] = None) -> str:
+    """"fechado", "aberto" ou "meio_aberto" (da sessão; padrão WAHA_SESSION)."""
+    disjuntor = _disjuntor(sessao)
+    with _cb_lock:
+        return disjuntor.estado_atual()
+
+
+def segundos_ate_tentar(sessao: Optional[str] = None) -> float:
+    """
+    Quanto esperar antes de chamar o WAHA pela sessão (0 = pode chamar agora).
+    Usado pela fila de envio para estacionar mensagens com o circuito aberto.
+    """
+    disjuntor = _disjuntor(sessao)
+    with _cb_lock:
+        return disjuntor.segundos_ate_tentar()
+
+
+def resetar_circuito():
+    """Fecha os circuitos de todas as sessões e zera as falhas."""
+    with _cb_lock:
+        _disjuntores.clear()
+
+
+# =========================================================
+# Prazo
+# =========================================================
+
+@contextmanager
+def prazo(segundos: float) -> Iterator[None]:
+    """Limita o tempo total das chamadas ao WAHA feitas dentro do bloco."""
+    anterior = getattr(_prazo_local, "limite", None)
+    limite = time.monotonic() + segundos
+    if anterior is not None:
+        limite = min(limite, anterior)
+    _prazo_local.limite = limite
+    try:
+        yield
+    finally:
+        _prazo_local.limite = anterior
+
+
+def _timeout_no_prazo(timeout: Optional[Timeout]) -> Timeout:
+    """Timeout da chamada reduzido ao que resta do prazo da thread."""
+    if timeout is None:
+        timeout = (TIMEOUT_CONEXAO, TIMEOUT_LEITURA)
+    limite = getattr(_prazo_local, "limite", None)
+    if limite is None:
+        return timeout
+    restante = limite - time.monotonic()
+    if restante <= 0:
+        raise PrazoEsgotado("prazo esgotado antes da chamada ao WAHA")
+    if isinstance(timeout, tuple):
+        return (min(timeout[0], restante), min(timeout[1], restante))
+    return min(timeout, restante)
+
+
+# =========================================================
+# API Principal
+# =========================================================
+
+def requisitar(
+    metodo: str,
+    caminho: str,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[Timeout] = None,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    sessao_waha: Optional[str] = None,
+) -> requests.Response:
+    """
+    Faz a requisição pela Session compartilhada.
+
+    Args:
+        metodo: "GET" / "POST"
+        caminho: "/api/sendText" ou URL absoluta
+        json: Corpo JSON
+        headers: Headers extras (somados aos de autenticação)
+        timeout: Segundos ou (conexão, leitura); padrão
+                 (TIMEOUT_CONEXAO, TIMEOUT_LEITURA)
+        base_url: Sobrescreve WAHA_API_URL
+        api_key: Sobrescreve WAHA_API_KEY
+        sessao_waha: Sessão do WAHA cujo disjuntor vale para a chamada
+                     (padrão WAHA_SESSION)
+
+    Raises:
+        CircuitoAberto: WAHA fora do ar (sem tentar a rede)
+        PrazoEsgotado: prazo do bloco `with prazo(...)` acabou
+        requests.RequestException em falha de rede/timeout
+    """
+    timeout = _timeout_no_prazo(timeout)
+    disjuntor = _disjuntor(sessao_waha)
+    disjuntor.permitir()
+    inicio = time.perf_counter()
+    try:
+        resposta = sessao().request(
+            metodo,
+            url(caminho, base_url),
+            json=json,
+            headers={**headers_padrao(api_key), **(headers or {})},
+            timeout=timeout,
+        )
+    except requests.RequestException:
+        disjuntor.registrar(False)
+        with _lock:
+            _stats["erros"] += 1
+        raise
+    except BaseException:
+        disjuntor.liberar_teste()  # erro local: não diz nada sobre o WAHA
+        raise
+    else:
+        # 4xx = WAHA no ar (recusou o formato); só 5xx conta como falha
+        disjuntor.registrar(resposta.status_code < 500)
+        return resposta
+    finally:
+        with _lock:
+            _stats["requisicoes"] += 1
+            _stats["tempo_total_ms"] += (time.perf_counter() - inicio) * 1000
+
+
+def post(caminho: str, json: Any = None, **kwargs) -> requests.Response:
+    """POST pela Session compartilhada (ver requisitar)."""
+    return requisitar("POST", caminho, json=json, **kwargs)
+
+
+def get(caminho: str, **kwargs) -> requests.Response:
+    """GET pela Session compartilhada (ver requisitar)."""
+    return requisitar("GET", caminho, **kwargs)
+
+
+def fechar():
+    """Fecha as conexões do pool (a próxima chamada cria outra Session)."""
+    global _sessao
+    with _lock:
+        if _sessao is not None:
+            _sessao.close()
+            _sessao = None
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Requisições, erros e latência média (ms) do processo."""
+    with _cb_lock:
+        circuitos = {s: d.estado_atual() for s, d in _disjuntores.items()}
+    with _lock:
+        n = _stats["requisicoes"]
+        return {
+            **_stats,
+            "circuito": estado_circuito(),
+            "circuitos": circuitos,
+            "pool_size": POOL_SIZE,
+            "latencia_media_ms": round(_stats["tempo_total_ms"] / n, 2) if n else 0.0,
+        }
+
+
+def resetar_estatisticas():
+    """Zera os contadores."""
+    with _lock:
+        for k in _stats:
+            _stats[k] = 0
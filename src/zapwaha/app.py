@@ -24,23 +24,24 @@ app.register_blueprint(agenda_bp)  # <— NOVO: /admin/agenda/*
 
 def _cleanup_job():
     """
-    Job em background que limpa slots expirados a cada 1 minuto.
+    Job em background que expira reservas temporárias.
+    Dorme até a reserva mais próxima vencer (heap em excel_services) e
+    libera apenas as que venceram, sem varrer a planilha a cada minuto.
     """
-    logger.info("[CLEANUP] Iniciando job de limpeza de slots expirados")
+    logger.info("[CLEANUP] Iniciando job de expiração de reservas")
     
     while True:
         try:
-            time.sleep(60)  # Executar a cada 1 minuto
-            
             # Importar excel_services
-            try:
-                from services import excel_services as excel
-                if hasattr(excel, "liberar_slots_expirados"):
-                    liberados = excel.liberar_slots_expirados()
-                    if liberados > 0:
-                        logger.info(f"[CLEANUP] {liberados} slots expirados liberados")
-            except Exception as e:
-                logger.error(f"[CLEANUP] Erro ao liberar slots: {e}")
+            from services import excel_services as excel
+            if not hasattr(excel, "aguardar_proxima_expiracao"):
+                time.sleep(60)
+                continue
+            
+            excel.aguardar_proxima_expiracao()
+            liberados = excel.liberar_slots_expirados()
+            if liberados > 0:
+                logger.info(f"[CLEANUP] {liberados} slots expirados liberados")
                 
         except Exception as e:
             logger.error(f"[CLEANUP] Erro no job de limpeza: {e}")
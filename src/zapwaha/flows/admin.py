@@ -34,14 +34,12 @@ def _load_admins() -> set[str]:
 
     # 2) Arquivo opcional: /app/config/admins.json com {"admins":[ "...", "..." ]}
     try:
-        cfg_path = "/app/config/admins.json"
-        if os.path.exists(cfg_path):
-            with open(cfg_path, "r", encoding="utf-8") as fh:
-                data = json.load(fh) or {}
-            for raw in data.get("admins", []):
-                norm = _normalize_chat_id(raw)
-                if norm:
-                    ids.append(norm)
+        from services import config_registry
+        data = config_registry.obter("/app/config/admins.json", {})
+        for raw in data.get("admins", []):
+            norm = _normalize_chat_id(raw)
+            if norm:
+                ids.append(norm)
     except Exception as e:
         logger.warning(f"[ADMIN] Falha lendo admins.json: {e}")
 
@@ -224,6 +222,12 @@ try:
 except ImportError:
     ag = None
 
+# Calendário (feriados + bloqueios)
+try:
+    from services import calendario
+except ImportError:
+    calendario = None
+
 def _send_admin_menu(send, chat_id: str):
     """Envia menu principal do admin com visual melhorado."""
     top = "╔═══════════════════════════════╗"
@@ -622,6 +626,11 @@ def _handle_agenda_option(send, chat_id: str, t: str):
                 data_str = data_obj.strftime("%d/%m/%Y")
                 dia_semana = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"][data_obj.weekday()]
                 
+                fechamento = calendario.obter_fechamento(data_obj) if calendario else None
+                if fechamento and fechamento["tipo"] == calendario.TIPO_FERIADO:
+                    linhas.append(f"║  {dia_semana} {data_str} — 🎉 {fechamento['motivo']}")
+                    continue
+                
                 config = ag.obter_configuracao_dia(data_str)
                 
                 if config.get("bloqueado"):
@@ -97,6 +97,18 @@ try:
 except Exception:
     slots_dinamicos = None
 
+# Calendário (feriados + bloqueios)
+try:
+    from services import calendario
+except Exception:
+    calendario = None
+
+# Cache de disponibilidade (pré-cálculo em segundo plano)
+try:
+    from services import cache_disponibilidade
+except Exception:
+    cache_disponibilidade = None
+
 # Módulo admin (roteamento correto)
 try:
     from zapwaha.flows import admin as admin_module
@@ -143,6 +155,11 @@ except Exception:
 # =============================================================================
 
 VALOR_SERVICO_PADRAO = 50.00
+ANTECEDENCIA_MINIMA_HORAS = 2   # Antecedência mínima para agendar
+DIAS_BUSCA_PROXIMO_HORARIO = 14 # Janela de busca do "próximo horário livre"
+# Junta as mensagens de um turno (route_message) por chat: menos chamadas ao WAHA
+AGRUPAR_MENSAGENS = os.getenv("AGRUPAR_MENSAGENS", "0").strip().lower() in ("1", "true", "sim", "yes")
+LIMITE_MENSAGEM_AGRUPADA = 4000  # Caracteres por mensagem juntada (legível no WhatsApp)
 # DEFAULT_SLOTS removido - agora usa agenda dinâmica
 
 # Helper para obter slots do dia (usa slots dinâmicos)
@@ -162,20 +179,13 @@ def _obter_slots_dia(data_str: str, servico_id: str = None) -> list[str]:
         # Fallback final para slots fixos
         return ["08:00","09:00","10:00","11:00","13:00","14:00","15:00","16:00","17:00"]
     
-    # Usar slots dinâmicos baseados no serviço
+    # Usar slots dinâmicos baseados no serviço (grade em cache)
     try:
         if not excel:
             return []
         
-        # Obter agendamentos do dia
-        agendamentos = excel.obter_agendamentos_do_dia(data_str)
-        
-        # Gerar slots disponíveis para o serviço específico
-        slots_disponiveis = slots_dinamicos.gerar_slots_disponiveis_para_servico(
-            data_str, servico_id, agendamentos
-        )
-        
-        return slots_disponiveis
+        grade = slots_dinamicos.grade_disponibilidade(data_str, servico_id)
+        return [slot["hora"] for slot in grade]
     except Exception as e:
         logger.error(f"Erro ao gerar slots dinâmicos: {e}")
         # Fallback em caso de erro
@@ -192,13 +202,11 @@ def _admin_ids() -> set[str]:
     if raw:
         ids.update(x.strip() for x in raw.split(",") if x.strip())
     try:
-        import json, pathlib
-        p = pathlib.Path("/app/config/admins.json")
-        if p.exists():
-            data = json.loads(p.read_text(encoding="utf-8"))
-            for x in data.get("admins", []):
-                if isinstance(x, str) and x.strip():
-                    ids.add(x.strip())
+        from services import config_registry
+        data = config_registry.obter("/app/config/admins.json", {})
+        for x in data.get("admins", []):
+            if isinstance(x, str) and x.strip():
+                ids.add(x.strip())
     except Exception:
         pass
     return ids
@@ -210,6 +218,7 @@ def _admin_ids() -> set[str]:
 _re_date_full = re.compile(r"\b(\d{1,2})[\/\-\.](\d{1,2})[\/\-\.](\d{2,4})\b")
 _re_date_dm   = re.compile(r"\b(\d{1,2})[\/\-\.](\d{1,2})\b(?!\s*\d)")
 _re_time      = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+_re_proximo   = re.compile(r"\bpr[oó]xim[oa]\b", re.IGNORECASE)
 
 def _safe_date(d:int,m:int,y:int) -> date|None:
     try:
@@ -268,7 +277,8 @@ def _gerar_datas_disponiveis(dias: int = 14) -> list[tuple[str, str]]:
     Retorna lista de tuplas (data_formatada, data_display)
     Ex: [("05/12/2025", "Qui 05/12"), ("06/12/2025", "Sex 06/12"), ...]
     
-    Pula domingos por padrão.
+    Pula feriados, bloqueios e dias sem expediente (índice do calendário);
+    sem o calendário, pula apenas domingos.
     Começa sempre de HOJE, atualizando automaticamente conforme os dias passam.
     """
     agora = datetime.now()
@@ -284,26 +294,52 @@ def _gerar_datas_disponiveis(dias: int = 14) -> list[tuple[str, str]]:
         4: "Sex", 5: "Sáb", 6: "Dom"
     }
     
-    dias_gerados = 0
-    offset = 0
-    
-    while dias_gerados < dias:
-        data_atual = hoje + timedelta(days=offset)
-        offset += 1
-        
-        # Pular domingos (weekday 6)
-        if data_atual.weekday() == 6:
-            continue
-            
+    candidatas = None
+    if calendario:
+        try:
+            candidatas = calendario.proximos_dias_de_atendimento(hoje, dias)
+        except Exception as e:
+            logger.warning(f"Erro ao consultar calendário: {e}")
+    
+    if candidatas is None:
+        # Fallback: pular apenas domingos (weekday 6)
+        candidatas = []
+        offset = 0
+        while len(candidatas) < dias:
+            data_atual = hoje + timedelta(days=offset)
+            offset += 1
+            if data_atual.weekday() != 6:
+                candidatas.append(data_atual)
+    
+    for data_atual in candidatas:
         data_str = data_atual.strftime("%d/%m/%Y")
         dia_semana = dias_semana[data_atual.weekday()]
         data_display = f"{dia_semana} {data_atual.strftime('%d/%m')}"
         
         datas.append((data_str, data_display))
-        dias_gerados += 1
     
     return datas
 
+def _pre_calcular_disponibilidade(chat_id: str, servico_id: str):
+    """
+    Dispara em segundo plano o cálculo das grades do serviço para os
+    próximos DIAS_BUSCA_PROXIMO_HORARIO dias de atendimento.
+    
+    As telas de data/horário leem do cache de disponibilidade; se o
+    cliente chegar antes do fim, grade_disponibilidade espera o cálculo
+    em andamento em vez de repeti-lo. Nunca bloqueia o webhook.
+    """
+    if not (cache_disponibilidade and slots_dinamicos and servico_id):
+        return
+    try:
+        datas = [d for d, _ in _gerar_datas_disponiveis(dias=DIAS_BUSCA_PROXIMO_HORARIO)]
+        cache_disponibilidade.pre_calcular(
+            chat_id,
+            lambda: slots_dinamicos.pre_calcular_grades(servico_id, datas)
+        )
+    except Exception as e:
+        logger.warning(f"Erro ao agendar pré-cálculo de disponibilidade: {e}")
+
 def _formatar_lista_datas(datas: list[tuple[str, str]]) -> str:
     """Formata lista de datas para exibição ao usuário."""
     top = "╔════════════════════════╗"
@@ -364,6 +400,7 @@ S_DATA = "AG_DATA"
 S_DATA_CONF = "AG_DATA_CONF"
 S_MOSTRAR_HORAS = "AG_MOSTRAR_HORAS"
 S_ESCOLHER_HORA = "AG_ESCOLHER_HORA"
+S_PROXIMO_CONF = "AG_PROXIMO_CONF"  # Confirmar o próximo horário livre sugerido
 
 # Remarcação
 S_REMARCAR_CONFIRMAR = "AG_REMARCAR_CONFIRMAR"
@@ -596,20 +633,30 @@ def _pre_reservar(send, chat_id: str, data_str: str, hora_str: str) -> bool:
         # Horário indisponível ou expirado
         logger.info(f"[FLOW] Horário indisponível: {ve}")
         
-        # Tentar sugerir próximo horário disponível
-        if slots_dinamicos and excel:
+        # Tentar sugerir próximo horário disponível (pode cair em outro dia)
+        if slots_dinamicos:
             try:
-                agendamentos = excel.obter_agendamentos_do_dia(data_str)
-                proximo = slots_dinamicos.obter_proximo_slot_disponivel(
-                    data_str, hora_str, servico_id, agendamentos
+                a_partir_de = datetime.strptime(f"{data_str} {hora_str}", "%d/%m/%Y %H:%M") + timedelta(minutes=1)
+                proximo = slots_dinamicos.proximo_horario_livre(
+                    servico_id,
+                    a_partir_de=a_partir_de,
+                    limite_dias=DIAS_BUSCA_PROXIMO_HORARIO,
                 )
                 
                 if proximo:
+                    quando = proximo["hora"] if proximo["data"] == data_str else f"{proximo['data']} às {proximo['hora']}"
                     send(chat_id, 
                         f"😕 O horário *{hora_str}* não está mais disponível.\n\n"
-                        f"💡 Que tal às *{proximo}*?\n\n"
-                        f"Digite *sim* para confirmar ou escolha outro horário.")
-                    state_manager.update_data(chat_id, horario_sugerido=proximo)
+                        f"💡 Que tal *{quando}*?\n\n"
+                        f"Digite *sim* para confirmar ou informe outro horário (HH:MM) para {data_str}.")
+                    state_manager.update_data(
+                        chat_id,
+                        horario_sugerido=proximo["hora"],
+                        proximo_data=proximo["data"],
+                        proximo_hora=proximo["hora"],
+                        data_pedida=data_str,
+                    )
+                    state_manager.set_state(chat_id, S_PROXIMO_CONF)
                     return False
                 else:
                     send(chat_id, 
@@ -686,11 +733,73 @@ def _clear_flow_fields(chat_id: str):
     if keep:
         state_manager.update_data(chat_id, **keep)
 
+# =============================================================================
+# Caixa de saída por turno
+# =============================================================================
+
+class _CaixaDeSaida:
+    """
+    `send` de um turno: guarda as mensagens por chat e entrega no fim,
+    juntando as consecutivas (até LIMITE_MENSAGEM_AGRUPADA caracteres).
+    Depois de descarregada, repassa direto (ex.: send guardado por timer).
+    """
+
+    def __init__(self, send):
+        self._send = send
+        self._pendentes: dict[str, list[str]] = {}
+        self._aberta = True
+
+    def __call__(self, chat_id: str, message: str):
+        if not self._aberta:
+            return self._send(chat_id, message)
+        self._pendentes.setdefault(chat_id, []).append(str(message))
+
+    def separado(self, chat_id: str, message: str):
+        """Mensagem que precisa ir sozinha (ex.: código PIX copia e cola)."""
+        self._descarregar_chat(chat_id)
+        self._send(chat_id, message)
+
+    def _descarregar_chat(self, chat_id: str):
+        atual = ""
+        for texto in self._pendentes.pop(chat_id, []):
+            if atual and len(atual) + 2 + len(texto) > LIMITE_MENSAGEM_AGRUPADA:
+                self._send(chat_id, atual)
+                atual = ""
+            atual = f"{atual}\n\n{texto}" if atual else texto
+        if atual:
+            self._send(chat_id, atual)
+
+    def descarregar(self):
+        self._aberta = False
+        for cid in list(self._pendentes):
+            self._descarregar_chat(cid)
+
+
+def _send_separado(send, chat_id: str, message: str):
+    """Envia sem juntar com as vizinhas (quando route_message agrupa)."""
+    getattr(send, "separado", send)(chat_id, message)
+
 # =============================================================================
 # Roteador principal
 # =============================================================================
 
-def route_message(send, chat_id: str, text: str):
+def route_message(send, chat_id: str, text: str, agrupar: bool | None = None):
+    """
+    Processa uma mensagem recebida.
+
+    Com agrupar (padrão: AGRUPAR_MENSAGENS), as mensagens do turno para
+    o mesmo chat saem juntas no fim, numa chamada só.
+    """
+    if not (AGRUPAR_MENSAGENS if agrupar is None else agrupar):
+        return _rotear(send, chat_id, text)
+    caixa = _CaixaDeSaida(send)
+    try:
+        return _rotear(caixa, chat_id, text)
+    finally:
+        caixa.descarregar()
+
+
+def _rotear(send, chat_id: str, text: str):
     t = (text or "").strip()
 
     # Varre expirados globalmente a cada mensagem recebida
@@ -731,6 +840,7 @@ def route_message(send, chat_id: str, text: str):
     if st == S_DATA_CONF:         return _handle_data_conf(send, chat_id, t)
     if st == S_MOSTRAR_HORAS:     return _handle_escolha_hora_index(send, chat_id, t)
     if st == S_ESCOLHER_HORA:     return _handle_hora_livre(send, chat_id, t)
+    if st == S_PROXIMO_CONF:      return _handle_proximo_conf(send, chat_id, t)
 
     if st == S_REMARCAR_CONFIRMAR:     return _handle_remarcar_confirmar(send, chat_id, t)
     if st == S_REMARCAR_ESCOLHER_DATA: return _handle_remarcar_escolher_data(send, chat_id, t)
@@ -909,6 +1019,7 @@ def _handle_escolher_servico(send, chat_id, t):
     if not sf:
         # Fallback sem sistema de serviços
         state_manager.update_data(chat_id, servico_escolhido="corte_simples")
+        _pre_calcular_disponibilidade(chat_id, "corte_simples")
         datas = _gerar_datas_disponiveis(dias=7)
         texto_datas = _formatar_lista_datas(datas)
         state_manager.update_data(chat_id, datas_disponiveis=datas)
@@ -973,6 +1084,7 @@ def _handle_escolher_servico(send, chat_id, t):
     
     # Salvar serviço escolhido no estado
     state_manager.update_data(chat_id, servico_escolhido=servico_id)
+    _pre_calcular_disponibilidade(chat_id, servico_id)
     
     # Mostrar confirmação e pedir data
     datas = _gerar_datas_disponiveis(dias=7)
@@ -981,7 +1093,7 @@ def _handle_escolher_servico(send, chat_id, t):
     state_manager.set_state(chat_id, S_ESCOLHER_DATA)
     
     msg = f"{servico_emoji} *{servico_nome}* selecionado!\n\n{texto_datas}"
-    send(chat_id, msg + _nav_footer(["Digite *menu* para voltar"]))
+    send(chat_id, msg + _nav_footer(["Digite *próximo* para o primeiro horário livre", "Digite *menu* para voltar"]))
 
 def _handle_ag_submenu(send, chat_id, t):
     t = (t or "").strip()
@@ -1234,6 +1346,9 @@ def _handle_ag_submenu(send, chat_id, t):
 
 def _handle_escolher_data(send, chat_id, t):
     """Processa escolha de data pelo número da lista para AGENDAMENTO."""
+    if _re_proximo.search(t):
+        return _sugerir_proximo_horario(send, chat_id)
+    
     if not t.isdigit():
         return send(chat_id, "Por favor, envie o *número* da data desejada (ex: 3).")
     
@@ -1254,6 +1369,64 @@ def _handle_escolher_data(send, chat_id, t):
     # Agora buscar horários disponíveis para essa data (para agendamento)
     return _mostrar_horarios_disponiveis(send, chat_id, data_str, data_display)
 
+def _sugerir_proximo_horario(send, chat_id):
+    """Responde com o primeiro horário livre (qualquer dia) para o serviço escolhido."""
+    dados = state_manager.get_data(chat_id)
+    servico_id = dados.get("servico_escolhido", "corte_simples")
+    
+    proximo = None
+    if slots_dinamicos and hasattr(slots_dinamicos, "proximo_horario_livre"):
+        try:
+            proximo = slots_dinamicos.proximo_horario_livre(
+                servico_id,
+                a_partir_de=datetime.now() + timedelta(hours=ANTECEDENCIA_MINIMA_HORAS),
+                limite_dias=DIAS_BUSCA_PROXIMO_HORARIO,
+            )
+        except Exception as e:
+            logger.error(f"Erro ao buscar próximo horário livre: {e}")
+    
+    if not proximo:
+        return send(chat_id,
+            f"😕 Não encontrei horários livres nos próximos {DIAS_BUSCA_PROXIMO_HORARIO} dias.\n\n"
+            "Por favor, escolha uma data da lista."
+            + _nav_footer(["Digite *menu* para voltar"]))
+    
+    state_manager.update_data(chat_id, proximo_data=proximo["data"], proximo_hora=proximo["hora"],
+                              data_pedida=proximo["data"])
+    state_manager.set_state(chat_id, S_PROXIMO_CONF)
+    
+    return send(chat_id,
+        f"💡 Próximo horário livre: *{proximo['data']} às {proximo['hora']}*.\n\n"
+        "Deseja reservar?"
+        + _yes_no_footer("o *horário*"))
+
+def _handle_proximo_conf(send, chat_id, t):
+    """Confirmação do próximo horário livre sugerido (ou outro HH:MM na data pedida)."""
+    t = (t or "").strip().lower()
+    dt = state_manager.get_data(chat_id)
+    data_str = dt.get("proximo_data")
+    hora_str = dt.get("proximo_hora")
+    
+    if t == "sim" and data_str and hora_str:
+        return _try_reserva_or_ask_time(send, chat_id, data_str, hora_str)
+    
+    m = _re_time.fullmatch(t)
+    data_pedida = dt.get("data_pedida") or data_str
+    if m and data_pedida:
+        hora, minuto = int(m.group(1)), int(m.group(2))
+        if hora > 23 or minuto > 59:
+            return send(chat_id, "Horário inválido. Informe no formato HH:MM (ex: 14:00).")
+        state_manager.update_data(chat_id, data=data_pedida)
+        return _try_reserva_or_ask_time(send, chat_id, data_pedida, f"{hora:02d}:{minuto:02d}")
+    
+    if t in ("não", "nao") or not (data_str and hora_str):
+        datas = dt.get("datas_disponiveis") or _gerar_datas_disponiveis(dias=7)
+        state_manager.update_data(chat_id, datas_disponiveis=datas)
+        state_manager.set_state(chat_id, S_ESCOLHER_DATA)
+        return send(chat_id, _formatar_lista_datas(datas) + _nav_footer(["Digite *menu* para voltar"]))
+    
+    return send(chat_id, "Responda *sim* para reservar, outro *horário* (HH:MM) ou *não* para escolher outra data.")
+
 def _handle_consultar_data(send, chat_id, t):
     """Processa escolha de data pelo número da lista para CONSULTA (apenas visualização)."""
     if not t.isdigit():
@@ -1322,28 +1495,36 @@ def _mostrar_horarios_disponiveis(send, chat_id, data_str: str, data_display: st
     dados = state_manager.get_data(chat_id)
     servico_id = dados.get("servico_escolhido", "corte_simples")
     
-    # Obter slots dinâmicos do dia para o serviço específico
-    slots_do_dia = _obter_slots_dia(data_str, servico_id)
-    
     # Verificar status de cada horário
     horarios_status = []
     horarios_livres = []
     
-    # Liberar slots expirados antes de verificar disponibilidade
-    if excel and hasattr(excel, "liberar_slots_expirados"):
+    # Reservas vencidas já contam como livres na leitura; a gravação do
+    # status "Expirado" fica com o timer de expiração (app._cleanup_job)
+    
+    # Grade do dia para o serviço (cache invalidado a cada mudança na data)
+    grade = None
+    if slots_dinamicos and excel:
         try:
-            excel.liberar_slots_expirados()
+            grade = [
+                (slot["hora"], slot["disponivel"])
+                for slot in slots_dinamicos.grade_disponibilidade(data_str, servico_id)
+            ]
         except Exception as e:
-            logger.warning(f"Erro ao liberar slots expirados: {e}")
+            logger.error(f"Erro ao gerar grade de disponibilidade: {e}")
     
-    for h in slots_do_dia:
-        disponivel = True
-        if excel and hasattr(excel, "verificar_disponibilidade"):
-            try:
-                disponivel = excel.verificar_disponibilidade(data_str, h, servico_id)
-            except Exception:
-                disponivel = True
-        
+    if grade is None:
+        grade = []
+        for h in _obter_slots_dia(data_str):
+            disponivel = True
+            if excel and hasattr(excel, "verificar_disponibilidade"):
+                try:
+                    disponivel = excel.verificar_disponibilidade(data_str, h, servico_id)
+                except Exception:
+                    disponivel = True
+            grade.append((h, disponivel))
+    
+    for h, disponivel in grade:
         status = "✅ Livre" if disponivel else "❌ Ocupado"
         horarios_status.append((h, status, disponivel))
         if disponivel:
@@ -1547,7 +1728,7 @@ def _try_reserva_or_ask_time(send, chat_id, data_str: str, hora_str: str):
     # VALIDAÇÃO 3: Verificar se horário está muito próximo (<2h)
     if excel and hasattr(excel, "horario_muito_proximo"):
         try:
-            if excel.horario_muito_proximo(data_str, hora_str, horas_minimas=2):
+            if excel.horario_muito_proximo(data_str, hora_str, horas_minimas=ANTECEDENCIA_MINIMA_HORAS):
                 send(chat_id,
                      f"⏰ *Horário muito próximo*\n\n"
                      f"Para garantir a qualidade do atendimento, "
@@ -1652,7 +1833,7 @@ def _try_reserva_or_ask_time(send, chat_id, data_str: str, hora_str: str):
                     }
                 )
                 
-                send(chat_id, mensagem_pix)
+                _send_separado(send, chat_id, mensagem_pix)
                 
                 # Aguardando pagamento
                 send(chat_id, "⏳ *Aguardando confirmação do pagamento...*\n\nAssim que o pagamento for confirmado, você receberá uma notificação automática!")
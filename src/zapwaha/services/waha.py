@@ -1,8 +1,9 @@
 ﻿# src/zapwaha/services/waha.py
 import os
-import requests
 from typing import Optional
 
+from services import waha_transporte
+
 
 class WahaClient:
     """Cliente para interagir com a API do WAHA"""
@@ -20,39 +21,48 @@ class WahaClient:
             headers['X-Api-Key'] = self.api_key
         return headers
     
-    def send_text(self, chat_id: str, text: str) -> dict:
-        url = f'{self.base_url}/api/sendText'
+    def _post(self, path: str, payload: dict):
+        response = waha_transporte.post(
+            path,
+            json=payload,
+            headers=self._get_headers(),
+            base_url=self.base_url,
+            api_key=self.api_key,
+            sessao_waha=payload['session'],
+        )
+        # Não-2xx sobe como erro: quem chama não pode contar como enviado
+        response.raise_for_status()
+        return response
+    
+    def send_text(self, chat_id: str, text: str, session: Optional[str] = None) -> dict:
         payload = {
-            'session': self.session,
+            'session': session or self.session,
             'chatId': chat_id,
             'text': text,
         }
-        response = requests.post(url, json=payload, headers=self._get_headers())
+        response = self._post('/api/sendText', payload)
         return response.json()
     
-    def send_buttons(self, chat_id: str, text: str, buttons: list) -> dict:
-        url = f'{self.base_url}/api/sendButtons'
+    def send_buttons(self, chat_id: str, text: str, buttons: list, session: Optional[str] = None) -> dict:
         payload = {
-            'session': self.session,
+            'session': session or self.session,
             'chatId': chat_id,
             'text': text,
             'buttons': buttons,
         }
-        response = requests.post(url, json=payload, headers=self._get_headers())
+        response = self._post('/api/sendButtons', payload)
         return response.json()
     
-    def start_typing(self, chat_id: str):
-        url = f'{self.base_url}/api/startTyping'
+    def start_typing(self, chat_id: str, session: Optional[str] = None):
         payload = {
-            'session': self.session,
+            'session': session or self.session,
             'chatId': chat_id,
         }
-        requests.post(url, json=payload, headers=self._get_headers())
+        self._post('/api/startTyping', payload)
     
-    def stop_typing(self, chat_id: str):
-        url = f'{self.base_url}/api/stopTyping'
+    def stop_typing(self, chat_id: str, session: Optional[str] = None):
         payload = {
-            'session': self.session,
+            'session': session or self.session,
             'chatId': chat_id,
         }
-        requests.post(url, json=payload, headers=self._get_headers())
+        self._post('/api/stopTyping', payload)
@@ -17,6 +17,11 @@ try:
 except ImportError:
     ag = None
 
+try:
+    from services import cache_disponibilidade
+except ImportError:
+    cache_disponibilidade = None
+
 # Blueprint
 agenda_bp = Blueprint('agenda', __name__, url_prefix='/admin/agenda')
 
@@ -423,6 +428,45 @@ def limpar_bloqueios_antigos():
         "dias_atras": dias_atras
     })
 
+# =============================================================================
+# Rota de Cache de Disponibilidade
+# =============================================================================
+
+@agenda_bp.route('/cache', methods=['GET'])
+@require_admin_token
+def estatisticas_cache():
+    """
+    GET /admin/agenda/cache?token=<TOKEN>
+    
+    Contadores de acerto/erro do cache de grades de disponibilidade.
+    """
+    if not cache_disponibilidade:
+        return jsonify({"error": "Módulo cache_disponibilidade não disponível"}), 500
+    
+    return jsonify({
+        "success": True,
+        "cache": cache_disponibilidade.estatisticas()
+    })
+
+
+@agenda_bp.route('/cache', methods=['DELETE'])
+@require_admin_token
+def limpar_cache():
+    """
+    DELETE /admin/agenda/cache
+    
+    Descarta todas as grades em cache (ex.: após editar feriados.json).
+    """
+    if not cache_disponibilidade:
+        return jsonify({"error": "Módulo cache_disponibilidade não disponível"}), 500
+    
+    cache_disponibilidade.invalidar_tudo()
+    
+    return jsonify({
+        "success": True,
+        "message": "Cache de disponibilidade limpo"
+    })
+
 # =============================================================================
 # Rota de Health Check
 # =============================================================================
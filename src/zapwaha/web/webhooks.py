@@ -3,13 +3,24 @@ from __future__ import annotations
 import os
 import json
 import logging
-import requests
-from collections import deque
-from typing import Iterable, Optional, Any, Dict
+import threading
+import time
+import uuid
+from typing import Iterable, Optional, Any, Dict, Set
 
+import requests
 from flask import Blueprint, request, jsonify
+from urllib3.exceptions import NewConnectionError
 from zapwaha.flows.agendamento import route_message
 
+from services import dedup_eventos
+from services import fila_entrada
+from services import fila_envio
+from services import limite_envio
+from services import nao_entregues
+from services import sessoes_waha
+from services import waha_transporte
+
 # Client opcional (não dependemos dele para enviar)
 try:
     from services.waha import Waha  # opcional
@@ -31,14 +42,19 @@ WAHA_SESSION = (os.getenv("WAHA_SESSION", "default") or "default").strip()
 WAHA_API_KEY = os.getenv("WAHA_API_KEY")  # se setada, enviamos em X-Api-Key
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # para endpoints de debug
 
+# Prazos (s): cada chamada ao WAHA usa o que resta do prazo do seu bloco
+PRAZO_ENVIO_S = float(os.getenv("WAHA_PRAZO_ENVIO_S", "15"))          # uma mensagem, todas as tentativas
+PRAZO_DIGITANDO_S = float(os.getenv("WAHA_PRAZO_DIGITANDO_S", "4"))   # indicador "digitando"
+PRAZO_MENSAGEM_S = float(os.getenv("WEBHOOK_PRAZO_S", "30"))          # processar uma mensagem recebida
+PRAZO_LIMITE_SINCRONO_S = float(os.getenv("WAHA_PRAZO_LIMITE_SINCRONO_S", "60"))  # ficha do limite sem fila de envio
+# "digitando" só aparece se a resposta demorar mais que isto (0 = sempre, na hora)
+DIGITANDO_APOS_S = float(os.getenv("DIGITANDO_APOS_S", "1.5"))
+
 web_bp = Blueprint("web", __name__)
 logger = logging.getLogger("ZapWaha")
 if not logger.handlers:
     logger.setLevel(logging.INFO)
 
-# Deduplicação: agora guardamos **somente event_ids reais**
-_RECENT_EVENT_IDS: deque[str] = deque(maxlen=2000)
-
 # Flag para controlar inicialização única dos lembretes
 _LEMBRETES_INICIADOS = False
 
@@ -49,6 +65,8 @@ def _asdict(x: Any) -> Dict[str, Any]:
     return x if isinstance(x, dict) else {}
 
 def _log_payload(data: Any, note: str = ""):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return  # evita serializar o payload inteiro à toa
     try:
         txt = json.dumps(data, ensure_ascii=False)[:1200]
         prefix = f"[WEBHOOK]{' ' + note if note else ''}"
@@ -96,16 +114,13 @@ waha_service = build_waha()
 # --------------------------------------------------------------------------------------
 # Envio de mensagens (HTTP direto + client opcional)
 # --------------------------------------------------------------------------------------
-def _send_http_waha(chat_id: str, message: str) -> bool:
+def _variacoes_waha(chat_id: str, message: str, session: Optional[str] = None) -> list:
+    """Formatos de envio aceitos pelas diferentes versões do WAHA (url, body, headers)."""
     base = WAHA_API_URL
-    session = WAHA_SESSION
-
-    headers_base = {}
-    if WAHA_API_KEY:
-        headers_base["X-Api-Key"] = WAHA_API_KEY
+    session = session or WAHA_SESSION
 
     url = f"{base}/api/sendText"
-    variations = [
+    return [
         (url, {"session": session, "chatId": chat_id, "text": message}, None),
         (url, {"session": session, "chatId": chat_id, "message": message}, None),
 
@@ -124,42 +139,186 @@ def _send_http_waha(chat_id: str, message: str) -> bool:
         (f"{base}/api/messages/send", {"session": session, "chatId": chat_id, "text": message}, None),
     ]
 
-    for u, b, extra_headers in variations:
-        try:
-            headers = {**headers_base, **(extra_headers or {})}
-            r = requests.post(u, json=b, headers=headers, timeout=10)
-            if 200 <= r.status_code < 300:
-                logger.info(f"[WAHA HTTP] OK via {u}")
-                return True
-            logger.warning(f"[WAHA HTTP] {u} -> {r.status_code} {r.text[:200]}")
-        except Exception as e:
-            logger.warning(f"[WAHA HTTP] erro em {u}: {e}")
+# Variante que funcionou (índice em _variacoes_waha), descoberta no
+# primeiro envio com sucesso. Só é redescoberta após falhas seguidas.
+MAX_FALHAS_VARIANTE = int(os.getenv("WAHA_MAX_FALHAS_VARIANTE", "3"))
+_variante_waha: Optional[int] = None
+_falhas_variante = 0
+_variante_lock = threading.Lock()
+
+class TalvezEntregue(Exception):
+    """
+    A requisição chegou ao WAHA mas a resposta não voltou (timeout de
+    leitura, conexão caída no meio). A mensagem pode ter saído: tentar de
+    novo arriscaria enviá-la duas vezes (PIX, confirmações).
+    """
+
+def _talvez_entregue(e: Exception) -> bool:
+    """True se o erro aconteceu depois de a requisição sair para o WAHA."""
+    if isinstance(e, (waha_transporte.CircuitoAberto, waha_transporte.PrazoEsgotado, requests.ConnectTimeout)):
+        return False  # recusado antes de tentar, ou sem conexão: nada foi enviado
+    if isinstance(e, requests.ReadTimeout):
+        return True
+    if isinstance(e, requests.ConnectionError):
+        causa = e.args[0] if e.args else None
+        return not isinstance(getattr(causa, "reason", causa), NewConnectionError)
     return False
 
-def _send(chat_id: str, message: str):
-    if _send_http_waha(chat_id, message):
-        return
+def _post_variacao(u: str, b: dict, extra_headers: Optional[dict], sessao: Optional[str] = None) -> Optional[bool]:
+    """
+    True = 2xx; False = WAHA recusou o formato; None = erro de rede antes
+    do envio. Levanta TalvezEntregue se o WAHA recebeu e não respondeu.
+    """
+    try:
+        r = waha_transporte.post(u, json=b, headers=extra_headers, api_key=WAHA_API_KEY or "", sessao_waha=sessao)
+    except Exception as e:
+        logger.warning(f"[WAHA HTTP] erro em {u}: {e}")
+        if _talvez_entregue(e):
+            raise TalvezEntregue(str(e)) from e
+        return None
+    if 200 <= r.status_code < 300:
+        return True
+    logger.warning(f"[WAHA HTTP] {u} -> {r.status_code} {r.text[:200]}")
+    return False
+
+def _descobrir_variante(chat_id: str, message: str, sessao: Optional[str] = None) -> bool:
+    """Tenta os formatos em ordem e guarda o primeiro que aceitar a mensagem."""
+    global _variante_waha, _falhas_variante
+    for idx, (u, b, extra_headers) in enumerate(_variacoes_waha(chat_id, message, sessao)):
+        resultado = _post_variacao(u, b, extra_headers, sessao)
+        if resultado:
+            with _variante_lock:
+                _variante_waha = idx
+                _falhas_variante = 0
+            logger.info(f"[WAHA HTTP] variante {idx} descoberta: {u}")
+            return True
+        if resultado is None:
+            # WAHA fora do ar: as outras variantes falhariam do mesmo jeito
+            return False
+    return False
+
+def _send_http_waha(chat_id: str, message: str, sessao: Optional[str] = None) -> bool:
+    """
+    Envia o texto com a variante já descoberta (uma única requisição).
+    Sem variante conhecida, descobre uma; após MAX_FALHAS_VARIANTE recusas
+    seguidas (resposta não-2xx), a variante é esquecida e redescoberta no
+    próximo envio. Erros de rede não contam: quem trata é o disjuntor.
+    """
+    global _variante_waha, _falhas_variante
+    idx = _variante_waha
+    if idx is None:
+        return _descobrir_variante(chat_id, message, sessao)
+
+    u, b, extra_headers = _variacoes_waha(chat_id, message, sessao)[idx]
+    resultado = _post_variacao(u, b, extra_headers, sessao)
+    if resultado:
+        if _falhas_variante:
+            with _variante_lock:
+                _falhas_variante = 0
+        return True
+    if resultado is None:
+        # Rede/timeout/circuito aberto: problema do WAHA, não do formato
+        return False
+
+    with _variante_lock:
+        _falhas_variante += 1
+        if _falhas_variante >= MAX_FALHAS_VARIANTE and _variante_waha == idx:
+            logger.warning(f"[WAHA HTTP] variante {idx} falhou {_falhas_variante}x seguidas; será redescoberta")
+            _variante_waha = None
+            _falhas_variante = 0
+    return False
+
+def _entregar(chat_id: str, message: str, sessao: Optional[str] = None) -> bool:
+    """
+    HTTP direto e, se falhar, o client; tudo dentro de PRAZO_ENVIO_S. True
+    se enviado. TalvezEntregue (de qualquer dos dois) sobe sem acionar o
+    client: a mensagem pode já ter saído.
+    """
+    with waha_transporte.prazo(PRAZO_ENVIO_S):
+        if _send_http_waha(chat_id, message, sessao):
+            return True
 
-    if waha_service:
+        if not waha_service or waha_transporte.estado_circuito(sessao) != waha_transporte.FECHADO:
+            return False
         try:
             if hasattr(waha_service, "send_message"):
                 try:
-                    waha_service.send_message(chat_id=chat_id, message=message)
-                    return
+                    waha_service.send_message(chat_id=chat_id, message=message, session=sessao)
+                    return True
                 except TypeError:
                     waha_service.send_message(chat_id, message)
-                    return
+                    return True
             if hasattr(waha_service, "send_text"):
                 try:
-                    waha_service.send_text(chat_id=chat_id, text=message)
-                    return
+                    waha_service.send_text(chat_id=chat_id, text=message, session=sessao)
+                    return True
                 except TypeError:
                     waha_service.send_text(chat_id, message)
-                    return
+                    return True
         except Exception as e:
             logger.error(f"Falha ao enviar via WAHA (client): {e}")
+            if _talvez_entregue(e):
+                raise TalvezEntregue(str(e)) from e
+    return False
 
-    print(f"[SEND-FALLBACK to {chat_id}] {message}")
+def _novo_envio(chat_id: str, message: str, faixa: str = limite_envio.INTERATIVO) -> Dict[str, Any]:
+    """Mensagem de saída com id próprio (identifica a mensagem entre tentativas e em nao_entregues)."""
+    return {"id": uuid.uuid4().hex, "chat_id": chat_id, "texto": message,
+            "tentativas": 0, "criado_em": time.time(), "faixa": faixa}
+
+def _registrar_falha(envio: Dict[str, Any], sessao: Optional[str] = None):
+    """
+    Conta a falha: circuito da sessão aberto estaciona sem contar
+    tentativa, até alguma sessão aceitar envios (a próxima tentativa sai
+    por outra sessão, se houver); senão
+    tenta de novo com backoff e, esgotadas as tentativas, guarda em
+    nao_entregues.
+    """
+    if fila_envio.WORKERS <= 0:
+        # Despachante desligado: não há fila para tentar de novo
+        envio["tentativas"] += 1
+        nao_entregues.guardar(envio, "falha no envio (fila de envio desligada)")
+        return
+    if waha_transporte.estado_circuito(sessao) != waha_transporte.FECHADO:
+        # Sem espera o item voltaria na hora e giraria em falso numa thread
+        raise fila_envio.Adiar(sessoes_waha.segundos_ate_tentar())
+    envio["tentativas"] += 1
+    if envio["tentativas"] < fila_envio.MAX_TENTATIVAS:
+        raise fila_envio.Adiar(fila_envio.backoff(envio["tentativas"]))
+    nao_entregues.guardar(envio, "WAHA recusou ou não respondeu")
+
+def _send_na_fila(envio: Dict[str, Any]):
+    """
+    Envio feito pela fila, pela sessão do chat (sessoes_waha): espera
+    ficha do limite da sessão (sem ocupar thread) e trata a falha (ver
+    _registrar_falha). Sem fila (FILA_ENVIO_WORKERS=0) a espera é feita
+    aqui mesmo, até PRAZO_LIMITE_SINCRONO_S; passado o prazo, a mensagem
+    vai para nao_entregues.
+    """
+    sessao = sessoes_waha.sessao_do_chat(envio["chat_id"])
+    envio.setdefault("limite_desde", time.monotonic())
+    while True:
+        espera = limite_envio.reservar(envio.get("faixa", limite_envio.INTERATIVO), sessao, envio["limite_desde"])
+        if espera <= 0:
+            break
+        if fila_envio.WORKERS > 0:
+            raise fila_envio.Adiar(espera)
+        # Despachante desligado: Adiar descartaria a mensagem
+        if time.monotonic() - envio["limite_desde"] + espera > PRAZO_LIMITE_SINCRONO_S:
+            envio.pop("limite_desde", None)
+            nao_entregues.guardar(envio, "limite de envio do WAHA (fila de envio desligada)")
+            return
+        time.sleep(espera)
+    envio.pop("limite_desde", None)
+    try:
+        entregue = _entregar(envio["chat_id"], envio["texto"], sessao)
+    except TalvezEntregue as e:
+        # Sem nova tentativa automática: fica para o admin conferir e decidir
+        envio["tentativas"] += 1
+        nao_entregues.guardar(envio, f"sem resposta do WAHA, pode ter sido entregue: {e}")
+        return
+    if not entregue:
+        _registrar_falha(envio, sessao)
 
 
 # --------------------------------------------------------------------------------------
@@ -177,7 +336,7 @@ def _inicializar_lembretes_se_necessario():
     
     try:
         # Inicializar com a função de envio
-        reminders.inicializar_lembretes(_send)
+        reminders.inicializar_lembretes(_enviar_em_massa)
         _LEMBRETES_INICIADOS = True
         logger.info("✅ Sistema de lembretes automáticos iniciado")
     except Exception as e:
@@ -187,42 +346,93 @@ def _inicializar_lembretes_se_necessario():
 # --------------------------------------------------------------------------------------
 # typing (best-effort)
 # --------------------------------------------------------------------------------------
-def _typing_http(chat_id: str, on: bool):
+def _typing_http(chat_id: str, on: bool, sessao: Optional[str] = None) -> bool:
+    sessao = sessao or WAHA_SESSION
     try:
         endpoint = "/api/startTyping" if on else "/api/stopTyping"
-        headers = {}
-        if WAHA_API_KEY:
-            headers["X-Api-Key"] = WAHA_API_KEY
-        headers["X-Session"] = WAHA_SESSION
-        r = requests.post(
+        r = waha_transporte.post(
             f"{WAHA_API_URL}{endpoint}",
-            json={"session": WAHA_SESSION, "chatId": chat_id},
-            headers=headers,
-            timeout=4,
+            json={"session": sessao, "chatId": chat_id},
+            headers={"X-Session": sessao},
+            api_key=WAHA_API_KEY or "",
+            timeout=(waha_transporte.TIMEOUT_CONEXAO, 4),
+            sessao_waha=sessao,
         )
         if not (200 <= r.status_code < 300):
             logger.debug(f"[WAHA HTTP] typing {endpoint} -> {r.status_code} {r.text[:120]}")
+            return False
+        return True
     except Exception:
-        pass
+        return False
 
 def _typing(chat_id: str, on: bool):
-    _typing_http(chat_id, on)
-    if not waha_service:
-        return
+    sessao = sessoes_waha.sessao_do_chat(chat_id)
+    with waha_transporte.prazo(PRAZO_DIGITANDO_S):
+        if _typing_http(chat_id, on, sessao):
+            return
+        if not waha_service or waha_transporte.estado_circuito(sessao) != waha_transporte.FECHADO:
+            return
+        _typing_client(chat_id, on, sessao)
+
+def _typing_client(chat_id: str, on: bool, sessao: Optional[str] = None):
     try:
         if on and hasattr(waha_service, "start_typing"):
             try:
-                waha_service.start_typing(chat_id=chat_id)
+                waha_service.start_typing(chat_id=chat_id, session=sessao)
             except TypeError:
                 waha_service.start_typing(chat_id)
         if (not on) and hasattr(waha_service, "stop_typing"):
             try:
-                waha_service.stop_typing(chat_id=chat_id)
+                waha_service.stop_typing(chat_id=chat_id, session=sessao)
             except TypeError:
                 waha_service.stop_typing(chat_id)
     except Exception:
         pass
 
+# --------------------------------------------------------------------------------------
+# Envio assíncrono (fila por chat: o webhook responde sem esperar o WAHA)
+# --------------------------------------------------------------------------------------
+def _enviar(chat_id: str, message: str):
+    _enfileirar_envio(_novo_envio(chat_id, message))
+
+def _enviar_em_massa(chat_id: str, message: str):
+    """Lembretes e envios em lote: faixa de menor prioridade do limite de envio."""
+    _enfileirar_envio(_novo_envio(chat_id, message, limite_envio.MASSA))
+
+def _enfileirar_envio(envio: Dict[str, Any]):
+    fila_envio.enfileirar(envio["chat_id"], _send_na_fila, envio)
+
+def _digitando(chat_id: str, on: bool):
+    fila_envio.enfileirar(chat_id, _typing, chat_id, on)
+
+# "digitando" por chat: um start por vez; a própria mensagem enviada já o
+# encerra no WhatsApp, então o stop só vai quando nada foi enviado depois
+_digitando_lock = threading.Lock()
+_digitando_ativo: Set[str] = set()
+_digitando_stats = {"iniciados": 0, "parados": 0, "evitados": 0}
+
+def _iniciar_digitando(chat_id: str):
+    with _digitando_lock:
+        if chat_id in _digitando_ativo:
+            return
+        _digitando_ativo.add(chat_id)
+        _digitando_stats["iniciados"] += 1
+    _digitando(chat_id, True)
+
+def _parar_digitando(chat_id: str):
+    with _digitando_lock:
+        if chat_id not in _digitando_ativo:
+            return
+        _digitando_ativo.discard(chat_id)
+        _digitando_stats["parados"] += 1
+    _digitando(chat_id, False)
+
+def _responder(chat_id: str, message: str):
+    """_enviar para o fluxo: a resposta encerra o "digitando" do chat."""
+    with _digitando_lock:
+        _digitando_ativo.discard(chat_id)
+    _enviar(chat_id, message)
+
 # --------------------------------------------------------------------------------------
 # Parsing helpers
 # --------------------------------------------------------------------------------------
@@ -236,137 +446,140 @@ def _normalize_chat(chat_id: Optional[str]) -> Optional[str]:
         chat_id = f"{chat_id}@c.us"
     return chat_id
 
-def _extract_event_id(payload: Any) -> Optional[str]:
-    p = _asdict(payload)
+_VAZIO: Dict[str, Any] = {}
 
-    # Preferir IDs de mensagem (mais específicos)
-    msg = p.get("message") or _asdict(p.get("data")).get("message")
-    if isinstance(msg, dict):
-        mid = msg.get("id") or _asdict(msg.get("key")).get("id") or msg.get("messageId")
-        if mid:
-            return f"msg:{mid}"
+class InboundMessage:
+    """Campos de uma unidade do webhook, extraídos numa única passada."""
+    __slots__ = ("chat_id", "text", "event_id", "event_type", "session", "formato")
 
-    # IDs de event, se existirem
-    ev = p.get("event")
-    if isinstance(ev, dict):
-        eid = ev.get("id") or ev.get("eventId")
-        if eid:
-            return f"evt:{eid}"
-    for parent in ("payload", "data"):
-        inner = _asdict(p.get(parent)).get("event")
-        if isinstance(inner, dict):
-            eid = inner.get("id") or inner.get("eventId")
-            if eid:
-                return f"evt:{eid}"
-
-    # NÃO usar id top-level genérico
-    return None
+    def __init__(self, chat_id: Optional[str], text: str, event_id: Optional[str],
+                 event_type: str, session: Optional[str], formato: str):
+        self.chat_id = chat_id
+        self.text = text
+        self.event_id = event_id
+        self.event_type = event_type
+        self.session = session
+        self.formato = formato  # "payload" (WAHA payload.*), "data" (data.*/data.message) ou "flat"
 
-def _extract_chat_id(payload: Any) -> Optional[str]:
-    p = _asdict(payload)
-
-    cid = (
-        _asdict(p.get("payload")).get("from")
-        or _asdict(p.get("data")).get("from")
-        or p.get("from")
-        or p.get("sender")
-        or p.get("chatId")
-        or p.get("phone")
-        or _asdict(p.get("data")).get("chatId")
-        or _asdict(p.get("data")).get("phone")
-        or _asdict(p.get("data")).get("to")
-    )
-
-    if not cid:
-        msg = p.get("message") or _asdict(p.get("data")).get("message")
-        if isinstance(msg, dict):
-            cid = (
-                msg.get("from")
-                or msg.get("chatId")
-                or _asdict(msg.get("key")).get("remoteJid")
-                or msg.get("remoteJid")
-                or msg.get("to")
-            )
-
-    return _normalize_chat(cid)
+    def session_matches(self) -> bool:
+        return sessoes_waha.aceita(self.session)
 
-def _extract_text(payload: Any) -> str:
-    p = _asdict(payload)
-
-    candidates = [
-        _asdict(p.get("payload")).get("body"),
-        _asdict(p.get("payload")).get("text"),
-        _asdict(p.get("payload")).get("caption"),
-        _asdict(_asdict(p.get("data")).get("msg")).get("text"),
-        _asdict(p.get("data")).get("text"),
-        _asdict(p.get("data")).get("body"),
-        _asdict(p.get("data")).get("caption"),
-    ]
+def _bloco(p: Dict[str, Any], chave: str) -> Dict[str, Any]:
+    v = p.get(chave)
+    return v if isinstance(v, dict) else _VAZIO
 
-    msg = p.get("message") or _asdict(p.get("data")).get("message")
-    if isinstance(msg, dict):
-        candidates.extend([
-            _asdict(msg).get("text"),
-            _asdict(msg).get("caption"),
-            _asdict(msg).get("conversation"),
-        ])
-        text_obj = _asdict(msg.get("text"))
-        if text_obj:
-            candidates.append(text_obj.get("text"))
-
-    candidates.extend([
-        p.get("body"),
-        p.get("caption"),
-        p.get("text"),
-    ])
-
-    for v in candidates:
+def _primeiro_texto(*valores: Any) -> str:
+    for v in valores:
         s = _as_text(v)
         if s.strip():
             return s
     return ""
 
-def _event_type(payload: Any) -> str:
-    p = _asdict(payload)
-    ev = p.get("event")
+def _tipo_evento(ev: Any) -> Optional[str]:
     if isinstance(ev, dict):
         return _as_text(ev.get("type") or ev.get("eventType")).lower()
     if isinstance(ev, str):
         return ev.lower()
-    for parent in ("payload", "data"):
-        inner = _asdict(p.get(parent)).get("event")
-        if isinstance(inner, dict):
-            return _as_text(inner.get("type") or inner.get("eventType")).lower()
-        if isinstance(inner, str):
-            return inner.lower()
-    return _as_text(p.get("type")).lower()
+    return None
+
+def _id_evento(ev: Any) -> Optional[str]:
+    if isinstance(ev, dict):
+        eid = ev.get("id") or ev.get("eventId")
+        if eid:
+            return f"evt:{eid}"
+    return None
+
+def _parse_unit(unit: Any) -> InboundMessage:
+    """
+    Detecta o formato do envelope uma vez e extrai chat_id, texto, id e
+    tipo do evento e sessão, na mesma ordem de prioridade de sempre.
+    """
+    p = unit if isinstance(unit, dict) else _VAZIO
+    pl = _bloco(p, "payload")
+    dt = _bloco(p, "data")
+    msg = p.get("message") or dt.get("message")
+    if not isinstance(msg, dict):
+        msg = None
+    formato = "payload" if pl else ("data" if dt else "flat")
+
+    # chat_id
+    if formato == "payload" and pl.get("from"):
+        cid = pl["from"]  # caminho rápido: envelope padrão do WAHA
+    else:
+        cid = (
+            pl.get("from") or dt.get("from")
+            or p.get("from") or p.get("sender") or p.get("chatId") or p.get("phone")
+            or dt.get("chatId") or dt.get("phone") or dt.get("to")
+        )
+    if not cid and msg is not None:
+        cid = (
+            msg.get("from") or msg.get("chatId") or _bloco(msg, "key").get("remoteJid")
+            or msg.get("remoteJid") or msg.get("to")
+        )
+
+    # texto
+    text = _primeiro_texto(pl.get("body"), pl.get("text"), pl.get("caption")) if pl else ""
+    if not text and dt:
+        text = _primeiro_texto(
+            _bloco(dt, "msg").get("text"), dt.get("text"), dt.get("body"), dt.get("caption")
+        )
+    if not text and msg is not None:
+        text = _primeiro_texto(
+            msg.get("text"), msg.get("caption"), msg.get("conversation"), _bloco(msg, "text").get("text")
+        )
+    if not text:
+        text = _primeiro_texto(p.get("body"), p.get("caption"), p.get("text"))
+
+    # id do evento: ids de mensagem primeiro; nunca o id top-level genérico
+    event_id = None
+    if msg is not None:
+        mid = msg.get("id") or _bloco(msg, "key").get("id") or msg.get("messageId")
+        if mid:
+            event_id = f"msg:{mid}"
+    if event_id is None:
+        event_id = _id_evento(p.get("event")) or _id_evento(pl.get("event")) or _id_evento(dt.get("event"))
+
+    # tipo do evento
+    event_type = _tipo_evento(p.get("event"))
+    if event_type is None:
+        event_type = _tipo_evento(pl.get("event"))
+    if event_type is None:
+        event_type = _tipo_evento(dt.get("event"))
+    if event_type is None:
+        event_type = _as_text(p.get("type")).lower()
+
+    session = p.get("session") or pl.get("session") or dt.get("session")
+    return InboundMessage(_normalize_chat(cid), text, event_id, event_type, session, formato)
+
+# Atalhos de um campo só (caminhos de erro e compatibilidade)
+def _extract_event_id(payload: Any) -> Optional[str]:
+    return _parse_unit(payload).event_id
+
+def _extract_chat_id(payload: Any) -> Optional[str]:
+    return _parse_unit(payload).chat_id
+
+def _extract_text(payload: Any) -> str:
+    return _parse_unit(payload).text
+
+def _event_type(payload: Any) -> str:
+    return _parse_unit(payload).event_type
 
 def _session_matches(payload: Any) -> bool:
-    p = _asdict(payload)
-    sess = (
-        p.get("session")
-        or _asdict(p.get("payload")).get("session")
-        or _asdict(p.get("data")).get("session")
-    )
-    return not sess or str(sess) == WAHA_SESSION
+    return _parse_unit(payload).session_matches()
 
 # --------------------------------------------------------------------------------------
 # Dedup: **somente por event_id real** (se não tiver, não deduplica)
 # --------------------------------------------------------------------------------------
 def _seen_event(event_id: Optional[str]) -> bool:
-    if not event_id:
-        return False
-    if event_id in _RECENT_EVENT_IDS:
-        return True
-    _RECENT_EVENT_IDS.append(event_id)
-    return False
+    # Só event_ids reais; TTL e backend compartilhado em dedup_eventos
+    return dedup_eventos.ja_visto(event_id)
 
 # --------------------------------------------------------------------------------------
 # Rotas principais
 # --------------------------------------------------------------------------------------
 @web_bp.get("/healthz")
 def healthz():
-    return jsonify({"ok": True, "session": WAHA_SESSION}), 200
+    return jsonify({"ok": True, "session": sessoes_waha.principal(), "sessions": sessoes_waha.SESSOES}), 200
 
 @web_bp.post("/chatbot/webhook/")
 def chatbot_webhook():
@@ -383,66 +596,120 @@ def chatbot_webhook():
         payload = payload or {}
         _log_payload(payload)
 
-        processed = 0
-        ignored = 0
-        deduped = 0
+        # Resultado por unidade (na ordem do envelope) e mensagens aceitas
+        results: list[Dict[str, Any]] = []
+        aceitas: list[tuple[str, str]] = []
+        aceitas_idx: list[int] = []
 
         for unit in _iter_units(payload):
+            result: Dict[str, Any] = {"status": "ignored", "chat_id": None, "event_id": None}
+            results.append(result)
+            marcado: Optional[str] = None  # event_id marcado no dedup por esta unidade
             try:
                 if not isinstance(unit, dict):
-                    ignored += 1
                     continue
 
-                if not _session_matches(unit):
-                    ignored += 1
+                msg = _parse_unit(unit)
+                result["chat_id"], result["event_id"] = msg.chat_id, msg.event_id
+                if not msg.session_matches():
                     continue
 
-                chat_id = _extract_chat_id(unit)
-                text = _extract_text(unit).strip()
+                chat_id = msg.chat_id
+                text = msg.text.strip()
                 if not chat_id or not text:
-                    et = _event_type(unit)
-                    if et in {"message_ack", "message-status", "ack", "status", "delivery", "read"}:
-                        ignored += 1
-                        continue
-                    ignored += 1
+                    # acks/status ("message_ack", "read"...) e eventos sem texto
                     continue
 
-                evt_id = _extract_event_id(unit)
+                evt_id = msg.event_id
                 if _seen_event(evt_id):
-                    deduped += 1
+                    result["status"] = "deduped"
+                    continue
+                marcado = evt_id
+                if not fila_entrada.permitir(chat_id):
+                    # enxurrada do chat: descarta antes do spool e do fluxo
+                    result["status"] = "limited"
                     continue
 
-                logger.debug(f"[WEBHOOK] in chat_id={chat_id} evt_id={evt_id} text={text[:60]!r}")
-
-                _typing(chat_id, True)
-                route_message(_send, chat_id, text)
-                _typing(chat_id, False)
-                processed += 1
+                logger.debug("[WEBHOOK] in chat_id=%s evt_id=%s text=%r", chat_id, evt_id, text[:60])
+                sessoes_waha.registrar_entrada(chat_id, msg.session)
+                aceitas.append((chat_id, text))
+                aceitas_idx.append(len(results) - 1)
 
             except Exception as inner_e:
                 logger.exception(f"[WEBHOOK] erro ao processar unidade: {inner_e}")
+                result["status"] = "error"
+                # Não aceita: o reenvio do WAHA não pode cair como duplicado
+                dedup_eventos.esquecer(marcado)
                 try:
                     cid = _extract_chat_id(unit) if isinstance(unit, dict) else None
                     if cid:
-                        _typing(cid, False)
-                        _send(cid, "Desculpe, ocorreu um erro interno. Digite 'menu' para recomeçar.")
+                        _responder(cid, "Desculpe, ocorreu um erro interno. Digite 'menu' para recomeçar.")
                 except Exception:
                     pass
 
-        logger.info(f"[WEBHOOK] processed={processed} ignored={ignored} deduped={deduped}")
-        return jsonify({"status": "success", "processed": processed, "ignored": ignored, "deduped": deduped}), 200
+        # Processamento fora da requisição: o WAHA recebe o 200 na hora.
+        # Um lote só (uma transação no spool); em ordem por chat e chats
+        # diferentes em paralelo
+        if aceitas:
+            try:
+                fila_entrada.enfileirar_lote(aceitas)
+                status_aceitas = "queued"  # só enfileirada: o fluxo roda depois, fora da requisição
+            except Exception as e:
+                logger.exception(f"[WEBHOOK] erro ao enfileirar {len(aceitas)} mensagens: {e}")
+                status_aceitas = "error"
+                for i in aceitas_idx:
+                    dedup_eventos.esquecer(results[i]["event_id"])
+            for i in aceitas_idx:
+                results[i]["status"] = status_aceitas
+
+        contagem = {k: sum(r["status"] == k for r in results)
+                    for k in ("queued", "ignored", "deduped", "limited", "error")}
+        logger.info("[WEBHOOK] queued=%d ignored=%d deduped=%d limited=%d errors=%d chats=%d",
+                    contagem["queued"], contagem["ignored"], contagem["deduped"], contagem["limited"],
+                    contagem["error"], len({c for c, _ in aceitas}))
+        return jsonify({"status": "success", "queued": contagem["queued"], "ignored": contagem["ignored"],
+                        "deduped": contagem["deduped"], "limited": contagem["limited"],
+                        "errors": contagem["error"], "results": results}), 200
 
     except Exception as e:
         logger.exception(f"Erro no webhook: {e}")
         try:
             chat_id_on_error = _extract_chat_id(request.get_json(silent=True) or {})
             if chat_id_on_error:
-                _typing(chat_id_on_error, False)
-                _send(chat_id_on_error, "Desculpe, ocorreu um erro interno. Digite 'menu' para recomeçar.")
+                _responder(chat_id_on_error, "Desculpe, ocorreu um erro interno. Digite 'menu' para recomeçar.")
         except Exception:
             pass
         return jsonify({"status": "error", "message": "Erro interno (handled)."}), 200
 
+def _processar_mensagem(chat_id: str, text: str):
+    """
+    Roda o fluxo para uma mensagem recebida (threads da fila de entrada).
+    O "digitando" só é enviado se o fluxo passar de DIGITANDO_APOS_S.
+    """
+    inicio = time.monotonic()
+    timer = None
+    if DIGITANDO_APOS_S > 0:
+        timer = threading.Timer(DIGITANDO_APOS_S, _iniciar_digitando, args=(chat_id,))
+        timer.daemon = True
+        timer.start()
+    else:
+        _iniciar_digitando(chat_id)
+    try:
+        with waha_transporte.prazo(PRAZO_MENSAGEM_S):
+            route_message(_responder, chat_id, text)
+    except Exception as e:
+        logger.exception(f"[WEBHOOK] erro ao processar mensagem de {chat_id}: {e}")
+        _responder(chat_id, "Desculpe, ocorreu um erro interno. Digite 'menu' para recomeçar.")
+    finally:
+        if timer is not None:
+            timer.cancel()
+            if time.monotonic() - inicio < DIGITANDO_APOS_S:
+                with _digitando_lock:
+                    _digitando_stats["evitados"] += 1
+        _parar_digitando(chat_id)
+
+fila_entrada.iniciar(_processar_mensagem)
+
 @web_bp.post("/test/incoming")
 def test_incoming():
     payload = request.get_json(silent=True) or {}
@@ -451,9 +718,8 @@ def test_incoming():
 
     chat_id = _normalize_chat(chat_id)
 
-    _typing(chat_id, True)
-    route_message(_send, chat_id, text.strip())
-    _typing(chat_id, False)
+    # Mesma caixa de entrada do webhook: nunca roda em paralelo com ele para o mesmo chat
+    fila_entrada.enfileirar(chat_id, text.strip())
 
     return jsonify({"ok": True, "echo": {"chat_id": chat_id, "text": text}}), 200
 
@@ -514,6 +780,51 @@ def _require_admin():
         return jsonify({"error": "forbidden"}), 403
     return None  # ok
 
+@web_bp.get("/debug/fila-envio")
+def debug_fila_envio():
+    """Profundidade da fila de saída e latências de envio."""
+    guard = _require_admin()
+    if guard:
+        return guard
+    return jsonify({"ok": True, "fila_envio": fila_envio.estatisticas(),
+                    "fila_entrada": fila_entrada.estatisticas(),
+                    "waha": waha_transporte.estatisticas(),
+                    "limite": limite_envio.estatisticas(),
+                    "sessoes": sessoes_waha.estatisticas(),
+                    "dedup": dedup_eventos.estatisticas(),
+                    "digitando": dict(_digitando_stats)}), 200
+
+@web_bp.get("/debug/nao-entregues")
+def debug_nao_entregues():
+    """Mensagens que esgotaram as tentativas de envio. ?limit=100"""
+    guard = _require_admin()
+    if guard:
+        return guard
+    try:
+        limit = int(request.args.get("limit", 100))
+    except Exception:
+        return jsonify({"ok": False, "error": "limit inválido"}), 400
+    return jsonify({"ok": True, "total": nao_entregues.quantidade(),
+                    "mensagens": nao_entregues.listar(limit)}), 200
+
+@web_bp.post("/debug/nao-entregues/reenviar")
+def debug_nao_entregues_reenviar():
+    """Body JSON opcional: {"ids": [...]} (sem ids = todas). Devolve à fila de envio."""
+    guard = _require_admin()
+    if guard:
+        return guard
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    return jsonify({"ok": True, "reenviadas": nao_entregues.reenviar(_enfileirar_envio, ids)}), 200
+
+@web_bp.post("/debug/nao-entregues/descartar")
+def debug_nao_entregues_descartar():
+    """Body JSON opcional: {"ids": [...]} (sem ids = todas)."""
+    guard = _require_admin()
+    if guard:
+        return guard
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    return jsonify({"ok": True, "descartadas": nao_entregues.descartar(ids)}), 200
+
 @web_bp.get("/debug/clients/lookup")
 def debug_clients_lookup():
     """?chatId=...  ou  ?cpf=..."""
@@ -680,17 +991,7 @@ def mercadopago_webhook():
                                 
                                 # Atualizar status do pagamento no Excel
                                 try:
-                                    wb, ws = excel._open_ws()
-                                    hm = excel._get_header_map(ws)
-                                    c_chave = hm.get("Chave")
-                                    c_pag_status = hm.get("PagamentoStatus")
-                                    
-                                    if c_chave and c_pag_status:
-                                        for r in range(2, ws.max_row + 1):
-                                            if str(ws.cell(row=r, column=c_chave).value or "").strip() == chave:
-                                                ws.cell(row=r, column=c_pag_status, value="approved")
-                                                wb.save(excel.FILE_PATH)
-                                                break
+                                    excel.atualizar_campos_por_chave(chave, {"PagamentoStatus": "approved"})
                                 except Exception as e:
                                     logger.error(f"[MERCADOPAGO WEBHOOK] Erro ao atualizar PagamentoStatus: {e}")
                                 
@@ -712,7 +1013,7 @@ Nos vemos em breve! 🎉
 💡 Para ver detalhes, digite *menu*"""
                                     
                                     try:
-                                        send(chat_id, mensagem)
+                                        _enviar(chat_id, mensagem)
                                     except Exception as e:
                                         logger.error(f"[MERCADOPAGO WEBHOOK] Erro ao enviar confirmação: {e}")
                             
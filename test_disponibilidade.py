@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""
+Teste do Motor de Disponibilidade
+Valida a busca do próximo horário livre entre vários dias.
+"""
+
+import sys
+import os
+import json
+import tempfile
+import time
+import threading
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'services'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from datetime import date, datetime
+
+from services import agenda_dinamica as ag
+from services import excel_services as excel
+from services import slots_dinamicos
+from services import cache_disponibilidade as cache
+from services import config_registry
+from services import calendario
+from services import reservas_temporarias
+
+# Agenda fixa para o teste (não depende do config/ do projeto)
+_TMP_DIR = tempfile.mkdtemp(prefix="teste_disponibilidade_")
+_AGENDA = {
+    "horario_funcionamento": {
+        dia: {"ativo": True, "inicio": "08:00", "fim": "15:00",
+              "intervalos": [{"inicio": "12:00", "fim": "13:00", "tipo": "almoco"}]}
+        for dia in ["segunda", "terca", "quarta", "quinta", "sexta"]
+    },
+    "configuracoes_gerais": {"duracao_slot_minutos": 60},
+    "bloqueios_pontuais": [{"data": "16/09/2026", "motivo": "Teste"}],
+    "slots_personalizados": {},
+}
+_AGENDA["horario_funcionamento"]["sabado"] = {"ativo": True, "inicio": "08:00", "fim": "14:00", "intervalos": []}
+_AGENDA["horario_funcionamento"]["domingo"] = {"ativo": False, "inicio": "08:00", "fim": "18:00", "intervalos": []}
+
+
+def preparar_ambiente(agenda=None):
+    """Aponta agenda e feriados para arquivos temporários."""
+    ag.CONFIG_PATH = os.path.join(_TMP_DIR, "agenda_config.json")
+    with open(ag.CONFIG_PATH, "w", encoding="utf-8") as f:
+        json.dump(agenda or _AGENDA, f)
+    ag.carregar_config(force_reload=True)
+
+    excel.FERIADOS_JSON = os.path.join(_TMP_DIR, "feriados.json")
+    with open(excel.FERIADOS_JSON, "w", encoding="utf-8") as f:
+        json.dump({"feriados": ["07/09/2026"]}, f)
+
+    excel.FILE_PATH = os.path.join(_TMP_DIR, "agendamentos.xlsx")
+    if os.path.exists(excel.FILE_PATH):
+        os.remove(excel.FILE_PATH)
+    excel._ensure_file_and_sheet()
+    reservas_temporarias.remover_vencidas(datetime(9999, 1, 1))
+    cache.invalidar_tudo()
+    cache.resetar_estatisticas()
+
+
+def _ag(data, hora, servico, status="Confirmado"):
+    return {"Data": data, "Hora": hora, "ServicoID": servico, "Status": status}
+
+
+def testar_proximo_horario_dia_livre():
+    """Sem agendamentos, o primeiro slot do dia é o próximo horário."""
+    preparar_ambiente()
+    r = slots_dinamicos.proximo_horario_livre(
+        "barba", a_partir_de=datetime(2026, 9, 14, 7, 0), agendamentos=[]
+    )
+    print(f"📅 Resultado: {r}")
+    return r == {"data": "14/09/2026", "hora": "08:00"}
+
+
+def testar_proximo_horario_pula_ocupados():
+    """Horários ocupados e cancelados são tratados corretamente."""
+    preparar_ambiente()
+    agendamentos = [
+        _ag("14/09/2026", "08:00", "cabelo_sobrancelha"),
+        _ag("14/09/2026", "09:00", "barba", status="Cancelado"),
+    ]
+    r = slots_dinamicos.proximo_horario_livre(
+        "barba", a_partir_de=datetime(2026, 9, 14, 7, 0), agendamentos=agendamentos
+    )
+    print(f"📅 Resultado: {r}")
+    return r == {"data": "14/09/2026", "hora": "09:00"}
+
+
+def testar_proximo_horario_aproveita_pausa():
+    """A pausa de um serviço fracionado fica disponível para outro cliente."""
+    preparar_ambiente()
+    # Platinado às 08:00: ocupado 08:00-08:20 e 09:20-10:00
+    agendamentos = [_ag("14/09/2026", "08:00", "platinado")]
+    r = slots_dinamicos.proximo_horario_livre(
+        "barba", a_partir_de=datetime(2026, 9, 14, 8, 30), agendamentos=agendamentos
+    )
+    print(f"📅 Resultado: {r}")
+    return r == {"data": "14/09/2026", "hora": "09:00"}
+
+
+def testar_proximo_horario_atravessa_dias():
+    """Feriado, bloqueio, domingo e fim de expediente avançam para o próximo dia."""
+    preparar_ambiente()
+    casos = [
+        (datetime(2026, 9, 7, 7, 0), {"data": "08/09/2026", "hora": "08:00"}),    # feriado
+        (datetime(2026, 9, 15, 14, 30), {"data": "17/09/2026", "hora": "08:00"}), # fim do dia + bloqueio
+        (datetime(2026, 9, 12, 15, 0), {"data": "14/09/2026", "hora": "08:00"}),  # sábado -> domingo fechado
+    ]
+    ok = True
+    for inicio, esperado in casos:
+        r = slots_dinamicos.proximo_horario_livre("barba", a_partir_de=inicio, agendamentos=[])
+        print(f"📅 {inicio:%d/%m %H:%M} -> {r}")
+        ok = ok and r == esperado
+    return ok
+
+
+def testar_proximo_horario_respeita_limite():
+    """Sem encaixe dentro do limite de dias, retorna None."""
+    preparar_ambiente()
+    r = slots_dinamicos.proximo_horario_livre(
+        "barba", a_partir_de=datetime(2026, 9, 13, 7, 0), limite_dias=1, agendamentos=[]
+    )
+    print(f"📅 Resultado: {r}")
+    return r is None
+
+
+def testar_cache_grade_invalidacao():
+    """Grade em cache é reaproveitada e invalidada ao reservar na data."""
+    preparar_ambiente()
+    data = "15/09/2026"
+
+    g1 = slots_dinamicos.grade_disponibilidade(data, "barba")
+    g2 = slots_dinamicos.grade_disponibilidade(data, "barba")
+    stats = cache.estatisticas()
+    print(f"📊 Após 2 consultas: hits={stats['hits']} misses={stats['misses']}")
+    if g1 != g2 or stats["hits"] != 1 or stats["misses"] != 1:
+        return False
+
+    # Outra data não é afetada pela reserva
+    slots_dinamicos.grade_disponibilidade("17/09/2026", "barba")
+
+    r = excel.reservar_slot_temporario(data, "08:00", "5511999999999@c.us", "barba", 30)
+    g3 = slots_dinamicos.grade_disponibilidade(data, "barba")
+    livre_0800 = next(s["disponivel"] for s in g3 if s["hora"] == "08:00")
+    print(f"📅 Reserva: {r['sucesso']} | 08:00 livre após reserva: {livre_0800}")
+
+    slots_dinamicos.grade_disponibilidade("17/09/2026", "barba")
+    stats = cache.estatisticas()
+    print(f"📊 Final: hits={stats['hits']} misses={stats['misses']}")
+    return r["sucesso"] and not livre_0800 and stats["hits"] == 2 and stats["misses"] == 3
+
+
+def testar_cache_invalida_ao_salvar_agenda():
+    """Salvar a agenda descarta as grades em cache."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    antes = [s["hora"] for s in slots_dinamicos.grade_disponibilidade(data, "barba")]
+
+    config = json.loads(json.dumps(_AGENDA))
+    config["horario_funcionamento"]["terca"]["inicio"] = "10:00"
+    ag.salvar_config(config)
+
+    depois = [s["hora"] for s in slots_dinamicos.grade_disponibilidade(data, "barba")]
+    print(f"📅 Primeiro slot: {antes[:1]} -> {depois[:1]}")
+    return antes[:1] == ["08:00"] and depois[:1] == ["10:00"]
+
+
+def testar_agenda_recarrega_ao_mudar_arquivo():
+    """Edição do agenda_config.json por outro processo aparece sem esperar TTL."""
+    preparar_ambiente()
+    data = "17/09/2026"
+    antes = ag.gerar_slots_dia(data, incluir_ocupados=True)
+    bloqueado_antes = ag.eh_dia_bloqueado(data)
+
+    # Simula outro worker gravando o arquivo diretamente
+    config = json.loads(json.dumps(_AGENDA))
+    config["bloqueios_pontuais"].append(data)
+    config["slots_personalizados"]["18/09/2026"] = ["09:30", "10:30"]
+    with open(ag.CONFIG_PATH, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    depois = ag.gerar_slots_dia(data, incluir_ocupados=True)
+    personalizados = ag.gerar_slots_dia("18/09/2026", incluir_ocupados=True)
+    print(f"📅 {data}: {len(antes)} slots -> {len(depois)} | 18/09: {personalizados}")
+    return (
+        antes[:1] == ["08:00"] and "12:00" not in antes and not bloqueado_antes
+        and depois == [] and ag.eh_dia_bloqueado(data)
+        and personalizados == ["09:30", "10:30"]
+    )
+
+
+def testar_config_registry_le_uma_vez():
+    """Config é lida do disco uma vez e relida só quando o arquivo muda."""
+    preparar_ambiente()
+    versao = config_registry.versao(excel.FERIADOS_JSON)
+    leituras = config_registry.estatisticas()["leituras"]
+
+    for _ in range(50):
+        excel.eh_feriado("07/09/2026")
+    sem_releitura = config_registry.estatisticas()["leituras"] == leituras
+
+    with open(excel.FERIADOS_JSON, "w", encoding="utf-8") as f:
+        json.dump({"feriados": ["07/09/2026", "12/10/2026"]}, f)
+    novo_feriado = excel.eh_feriado("12/10/2026")
+    nova_versao = config_registry.versao(excel.FERIADOS_JSON)
+
+    try:
+        config_registry.obter(excel.FERIADOS_JSON)["feriados"] = []
+        imutavel = False
+    except TypeError:
+        imutavel = True
+
+    print(f"📊 Sem releitura: {sem_releitura} | versão {versao} -> {nova_versao} | imutável: {imutavel}")
+    return sem_releitura and novo_feriado and nova_versao > versao and imutavel
+
+
+def testar_calendario_indice_unificado():
+    """Feriados do arquivo, nacionais e bloqueios saem de um único índice."""
+    preparar_ambiente()
+    casos = {
+        "07/09/2026": "feriado",    # feriados.json
+        "03/04/2026": "feriado",    # Sexta-feira Santa (nacional, móvel)
+        "16/09/2026": "bloqueio",   # bloqueios_pontuais
+        "15/09/2026": None,
+    }
+    ok = True
+    for data_str, esperado in casos.items():
+        fechamento = calendario.obter_fechamento(data_str)
+        tipo = fechamento["tipo"] if fechamento else None
+        print(f"📅 {data_str}: {fechamento}")
+        ok = ok and tipo == esperado
+
+    # Seletor de datas: pula feriado (07/09), bloqueio (16/09) e domingo (13/09)
+    dias = calendario.proximos_dias_de_atendimento(date(2026, 9, 5), 4)
+    print(f"📅 Próximos dias: {[d.strftime('%d/%m') for d in dias]}")
+    ok = ok and dias == [date(2026, 9, 5), date(2026, 9, 8), date(2026, 9, 9), date(2026, 9, 10)]
+
+    dias = calendario.proximos_dias_de_atendimento(date(2026, 9, 12), 3)
+    ok = ok and dias == [date(2026, 9, 12), date(2026, 9, 14), date(2026, 9, 15)]
+    return ok
+
+
+def testar_expiracao_por_heap():
+    """Reserva vencida fica livre na leitura e o timer expira só ela, sem gravar a planilha."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    excel.reservar_slot_temporario(data, "10:00", "5511000000001@c.us", "barba", 30)
+    r = excel.reservar_slot_temporario(
+        data, "08:00", "5511000000002@c.us", "barba", 30, duracao_reserva_min=0.02
+    )
+
+    mtime = os.stat(excel.FILE_PATH).st_mtime_ns
+    sem_gravacao = excel.liberar_slots_expirados() == 0
+    ocupado_antes = not excel.verificar_disponibilidade(data, "08:00")
+
+    inicio = time.monotonic()
+    excel.aguardar_proxima_expiracao(espera_maxima=5)
+    esperou = time.monotonic() - inicio
+    livre_sem_remover = excel.verificar_disponibilidade(data, "08:00")
+
+    liberados = excel.liberar_slots_expirados()
+    restantes = [reserva["chave"] for reserva in reservas_temporarias.ativas()]
+    intocada = os.stat(excel.FILE_PATH).st_mtime_ns == mtime and not list(excel._read_rows())
+    print(f"⏱️ Esperou {esperou:.2f}s | liberados={liberados} | ativas={restantes} | planilha intocada={intocada}")
+    return (
+        r["sucesso"] and sem_gravacao and ocupado_antes and livre_sem_remover
+        and esperou < 3 and liberados == 1 and intocada
+        and restantes == ["15/09/2026|10:00|5511000000001@c.us"]
+        and reservas_temporarias.obter(r["chave"]) is None
+    )
+
+
+def testar_reservas_datas_diferentes_em_paralelo():
+    """Lock por data: datas diferentes reservam em paralelo, mesma data só uma vez."""
+    preparar_ambiente()
+    datas = ["14/09/2026", "15/09/2026", "17/09/2026", "18/09/2026"]
+    resultados = []
+
+    def reservar(data, n):
+        r = excel.reservar_slot_temporario(data, "09:00", f"55110000000{n:02d}@c.us", "barba", 30)
+        resultados.append((data, r["sucesso"]))
+
+    threads = [
+        threading.Thread(target=reservar, args=(data, i * 2 + k))
+        for i, data in enumerate(datas) for k in range(2)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    reservas = reservas_temporarias.ativas()
+    sucessos = sorted(d for d, ok in resultados if ok)
+    print(f"🔒 Sucessos: {sucessos} | reservas ativas: {len(reservas)}")
+    return sucessos == sorted(datas) and sorted(r["data"] for r in reservas) == sorted(datas)
+
+
+def testar_reserva_valida_versao_no_commit():
+    """Gravação entre a verificação e o commit é detectada e o agendamento recusado."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    abrir_original = excel._open_ws
+    chamadas = []
+
+    def abrir_e_outro_worker_grava():
+        wb, ws = abrir_original()
+        chamadas.append(1)
+        if len(chamadas) == 2:
+            # Simula outro processo gravando o mesmo horário logo após a verificação
+            outro_wb, outro_ws = abrir_original()
+            excel._make_row(outro_ws, "externo", data, "09:00", "5511999999999@c.us", None, None,
+                            None, None, "Confirmado", None, servico_id="barba")
+            outro_wb.save(excel.FILE_PATH)
+            wb, ws = abrir_original()
+        return wb, ws
+
+    excel._open_ws = abrir_e_outro_worker_grava
+    try:
+        excel.adicionar_agendamento(data, "09:00", "5511000000001@c.us", servico_id="barba")
+        recusado = False
+    except ValueError:
+        recusado = True
+    finally:
+        excel._open_ws = abrir_original
+
+    status = [row["Status"] for row in excel._read_rows() if row["Data"] == data]
+    print(f"🔒 Recusado: {recusado} | linhas: {status}")
+    return recusado and status == ["Confirmado"]
+
+
+def testar_reserva_so_grava_ao_confirmar():
+    """Reserva fica só em memória; pagamento/confirmação gravam na planilha."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    r1 = excel.reservar_slot_temporario(data, "08:00", "5511000000001@c.us", "barba", 30)
+    r2 = excel.reservar_slot_temporario(data, "10:00", "5511000000002@c.us", "barba", 30)
+    conflito = excel.reservar_slot_temporario(data, "08:00", "5511000000003@c.us", "barba", 30)
+    grade = {s["hora"]: s["disponivel"] for s in slots_dinamicos.grade_disponibilidade(data, "barba")}
+    nada_gravado = not list(excel._read_rows())
+
+    pago = excel.atualizar_pagamento_id(r1["chave"], "pg-1", "pending")
+    confirmado = excel.confirmar_reserva(r2["chave"])
+    ainda_ocupado = not excel.verificar_disponibilidade(data, "08:00")
+    linhas = {row["Chave"]: (row["Status"], row["PagamentoID"]) for row in excel._read_rows()}
+    aprovado = excel.confirmar_reserva(r1["chave"])
+    status_final = {row["Chave"]: row["Status"] for row in excel._read_rows()}
+
+    print(f"💾 Antes: gravado={not nada_gravado} grade08={grade['08:00']} | depois: {linhas}")
+    return (
+        r1["sucesso"] and r2["sucesso"] and not conflito["sucesso"] and nada_gravado
+        and not grade["08:00"] and not grade["10:00"]
+        and pago and confirmado and ainda_ocupado and aprovado
+        and linhas == {r1["chave"]: ("Pendente Pagamento", "pg-1"), r2["chave"]: ("Confirmado", None)}
+        and status_final == {r1["chave"]: "Confirmado", r2["chave"]: "Confirmado"}
+        and not reservas_temporarias.ativas()
+    )
+
+
+def testar_reservas_compartilhadas_sqlite():
+    """Backend sqlite: reserva feita por um processo é vista pelo outro."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    reservas_temporarias.BACKEND = "sqlite"
+    reservas_temporarias.DB_PATH = os.path.join(_TMP_DIR, "reservas.sqlite3")
+    try:
+        r = excel.reservar_slot_temporario(data, "08:00", "5511000000001@c.us", "barba", 30)
+        codigo = (
+            "import sys; sys.path.insert(0, '.');"
+            "from services import excel_services as excel, reservas_temporarias as rt;"
+            f"excel.FILE_PATH = {excel.FILE_PATH!r};"
+            f"rt.BACKEND = 'sqlite'; rt.DB_PATH = {reservas_temporarias.DB_PATH!r};"
+            f"r = excel.reservar_slot_temporario('{data}', '08:00', '5511000000002@c.us', 'barba', 30);"
+            "print(r['sucesso'])"
+        )
+        saida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True,
+        ).stdout.strip()
+        cancelado = excel.cancelar_reserva(r["chave"])
+        livre = excel.verificar_disponibilidade(data, "08:00")
+    finally:
+        reservas_temporarias.BACKEND = "memoria"
+        reservas_temporarias.DB_PATH = ""
+    print(f"🗄️ Reserva: {r['sucesso']} | outro processo conseguiu: {saida} | liberado: {livre}")
+    return r["sucesso"] and saida == "False" and cancelado and livre
+
+
+def testar_reserva_sqlite_ve_linha_gravada_por_outro():
+    """Backend sqlite: reserva que outro worker grava na planilha no meio da nova não some."""
+    preparar_ambiente()
+    data = "15/09/2026"
+    reservas_temporarias.BACKEND = "sqlite"
+    reservas_temporarias.DB_PATH = os.path.join(_TMP_DIR, "reservas_corrida.sqlite3")
+    criar_original = reservas_temporarias.criar
+    try:
+        r1 = excel.reservar_slot_temporario(data, "08:00", "5511000000001@c.us", "barba", 30)
+        codigo = (
+            "import sys; sys.path.insert(0, '.');"
+            "from services import excel_services as excel, reservas_temporarias as rt;"
+            f"excel.FILE_PATH = {excel.FILE_PATH!r};"
+            f"rt.BACKEND = 'sqlite'; rt.DB_PATH = {reservas_temporarias.DB_PATH!r};"
+            f"print(excel.persistir_reserva({r1['chave']!r}, 'Confirmado'))"
+        )
+
+        def criar_apos_outro_worker(reserva, validar):
+            # Entre a leitura da planilha e a transação, o outro worker grava a reserva
+            subprocess.run([sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(__file__)),
+                           capture_output=True, text=True)
+            return criar_original(reserva, validar)
+
+        reservas_temporarias.criar = criar_apos_outro_worker
+        r2 = excel.reservar_slot_temporario(data, "08:00", "5511000000002@c.us", "barba", 30)
+    finally:
+        reservas_temporarias.criar = criar_original
+        reservas_temporarias.BACKEND = "memoria"
+        reservas_temporarias.DB_PATH = ""
+    gravadas = [r for r in excel._read_rows() if r.get("Data") == data and r.get("Hora") == "08:00"]
+    print(f"🏁 Primeira: {r1['sucesso']} | gravada: {len(gravadas)} | segunda conseguiu: {r2['sucesso']}")
+    return r1["sucesso"] and len(gravadas) == 1 and not r2["sucesso"]
+
+
+def testar_recursos_capacidade():
+    """Dois barbeiros: atribuição ao recurso livre e expediente próprio de cada um."""
+    agenda = json.loads(json.dumps(_AGENDA))
+    agenda["recursos"] = [
+        {"id": "joao", "nome": "João"},
+        {"id": "pedro", "nome": "Pedro", "horario_funcionamento": {
+            "sabado": {"ativo": False},
+            "terca": {"ativo": True, "inicio": "08:00", "fim": "11:00", "intervalos": []},
+        }},
+    ]
+    preparar_ambiente(agenda)
+    terca, quarta, sabado = "15/09/2026", "17/09/2026", "19/09/2026"  # 16/09 está bloqueado
+
+    r1 = excel.reservar_slot_temporario(quarta, "09:00", "5511000000001@c.us", "barba", 30)
+    livre_com_um = next(s["disponivel"] for s in slots_dinamicos.grade_disponibilidade(quarta, "barba") if s["hora"] == "09:00")
+    r2 = excel.reservar_slot_temporario(quarta, "09:00", "5511000000002@c.us", "barba", 30)
+    r3 = excel.reservar_slot_temporario(quarta, "09:00", "5511000000003@c.us", "barba", 30)
+    livre_com_dois = next(s["disponivel"] for s in slots_dinamicos.grade_disponibilidade(quarta, "barba") if s["hora"] == "09:00")
+
+    # Sábado só o João atende; terça o Pedro sai às 11:00
+    s1 = excel.reservar_slot_temporario(sabado, "09:00", "5511000000004@c.us", "barba", 30)
+    s2 = excel.reservar_slot_temporario(sabado, "09:00", "5511000000005@c.us", "barba", 30)
+    excel.reservar_slot_temporario(terca, "13:00", "5511000000006@c.us", "barba", 30)
+    proximo = slots_dinamicos.proximo_horario_livre(
+        "barba", a_partir_de=datetime(2026, 9, 15, 13, 0),
+        agendamentos=excel.linhas_reservas_temporarias(),
+    )
+
+    # Confirmação mantém o barbeiro da reserva; linha antiga sem RecursoID ocupa o primeiro livre
+    excel.confirmar_reserva(r2["chave"])
+    recurso_gravado = {row["Chave"]: row["RecursoID"] for row in excel._read_rows()}
+    legado = [{"Data": "18/09/2026", "Hora": "10:00", "ServicoID": "barba", "Status": "Confirmado"}]
+    indice = slots_dinamicos.indice_ocupacao_recursos(legado)["18/09/2026"]
+
+    print(f"💈 Quarta: {r1['recurso']}, {r2['recurso']}, {r3['sucesso']} | 09:00 livre c/1={livre_com_um} c/2={livre_com_dois}")
+    print(f"💈 Sábado: {s1['recurso']}, {s2['sucesso']} | próximo terça 13h: {proximo} | gravado: {recurso_gravado}")
+    return (
+        (r1["recurso"], r2["recurso"]) == ("joao", "pedro") and not r3["sucesso"]
+        and livre_com_um and not livre_com_dois
+        and s1["recurso"] == "joao" and not s2["sucesso"]
+        and proximo == {"data": terca, "hora": "14:00"}
+        and recurso_gravado == {r2["chave"]: "pedro"}
+        and indice["joao"] and not indice["pedro"]
+        and [r["id"] for r in ag.listar_recursos()] == ["joao", "pedro"]
+    )
+
+
+def testar_pre_calculo_grades():
+    """Pré-cálculo em segundo plano preenche o cache com uma leitura da planilha."""
+    preparar_ambiente()
+    excel.adicionar_agendamento("15/09/2026", "09:00", "5511000000001@c.us", servico_id="barba")
+    datas = ["14/09/2026", "15/09/2026", "17/09/2026", "18/09/2026"]
+
+    leituras = []
+    ler_original = excel._read_rows
+
+    def ler_contando():
+        leituras.append(1)
+        return ler_original()
+
+    excel._read_rows = ler_contando
+    try:
+        cache.resetar_estatisticas()
+        futuro = cache.pre_calcular(
+            "5511000000002@c.us",
+            lambda: slots_dinamicos.pre_calcular_grades("barba", datas)
+        )
+        futuro.result(timeout=10)
+        grades = [slots_dinamicos.grade_disponibilidade(d, "barba") for d in datas]
+    finally:
+        excel._read_rows = ler_original
+
+    stats = cache.estatisticas()
+    ocupado = next(s["disponivel"] for s in grades[1] if s["hora"] == "09:00")
+    esperado = [
+        slots_dinamicos.grade_disponibilidade(d, "barba", slots_dinamicos._carregar_agendamentos())
+        for d in datas
+    ]
+    print(f"📊 leituras={len(leituras)} hits={stats['hits']} misses={stats['misses']} | 09:00 livre: {ocupado}")
+    if len(leituras) != 1 or stats["hits"] != len(datas) or grades != esperado or ocupado:
+        return False
+
+    # Invalidação entre a leitura e o cálculo: resultado não fica em cache
+    desde = cache.marca()
+    cache.invalidar_data("21/09/2026")
+    cache.obter("21/09/2026", "barba", lambda: "velho", desde=desde)
+    atual = cache.obter("21/09/2026", "barba", lambda: "novo")
+    print(f"🗑️ Descartes: {cache.estatisticas()['descartes']} | valor: {atual}")
+    return atual == "novo"
+
+
+def testar_atualizacao_externa_sob_lock():
+    """Lembrete e pagamento gravam sob o lock de escrita, sem perder agendamentos concorrentes."""
+    from services import reminders
+    preparar_ambiente()
+    chave = excel.adicionar_agendamento("14/09/2026", "08:00", "5511000000001@c.us", status="Confirmado")
+    horas = ["08:00", "09:00", "10:00", "11:00", "13:00", "14:00"]
+
+    def inserir(hora):
+        excel.adicionar_agendamento("15/09/2026", hora, f"55110000001{hora[:2]}@c.us", status="Confirmado")
+
+    threads = [threading.Thread(target=inserir, args=(h,)) for h in horas]
+    threads += [threading.Thread(target=reminders._atualizar_lembrete_enviado, args=({"Chave": chave},))
+                for _ in horas]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+
+    antes = cache.estatisticas()["invalidacoes_data"]
+    pago = excel.atualizar_campos_por_chave(chave, {"PagamentoStatus": "approved"})
+    invalidou = cache.estatisticas()["invalidacoes_data"] > antes
+
+    linhas = excel._read_rows()
+    gravadas = sorted(r["Hora"] for r in linhas if r.get("Data") == "15/09/2026")
+    original = next(r for r in linhas if r.get("Chave") == chave)
+    print(f"🔐 Gravadas: {gravadas} | lembrete: {bool(original.get('LembreteEnviado'))} "
+          f"| pagamento: {original.get('PagamentoStatus')} | cache invalidado: {invalidou}")
+    return (gravadas == horas and bool(original.get("LembreteEnviado"))
+            and pago and original.get("PagamentoStatus") == "approved" and invalidou)
+
+
+def testar_pre_calculo_substitui_pendente():
+    """Novo pré-cálculo da conversa cancela o que ainda está na fila, sem travar."""
+    liberar = threading.Event()
+    ocupados = [cache.pre_calcular(f"ocupado-{i}", liberar.wait) for i in range(cache.PRE_CALCULO_WORKERS)]
+    cache.resetar_estatisticas()
+    resultado = {}
+
+    def substituir():
+        primeiro = cache.pre_calcular("5511000000003@c.us", lambda: "primeiro")
+        resultado["segundo"] = cache.pre_calcular("5511000000003@c.us", lambda: "segundo")
+        resultado["primeiro"] = primeiro
+
+    t = threading.Thread(target=substituir, daemon=True)
+    t.start()
+    t.join(5)
+    liberar.set()
+    if t.is_alive():
+        print("🔒 pre_calcular travou ao substituir o pré-cálculo na fila")
+        return False
+    for f in ocupados:
+        f.result(timeout=10)
+
+    segundo = resultado["segundo"].result(timeout=10)
+    stats = cache.estatisticas()
+    print(f"🔁 Primeiro cancelado: {resultado['primeiro'].cancelled()} | segundo: {segundo} "
+          f"| substituídos: {stats['pre_calculos_substituidos']}")
+    return (resultado["primeiro"].cancelled() and segundo == "segundo"
+            and stats["pre_calculos_substituidos"] == 1)
+
+
+def testar_outro_horario_na_sugestao():
+    """Sugestão do próximo horário: aceita outro HH:MM na data pedida."""
+    from zapwaha.flows import agendamento
+    chat_id = "5511000000004@c.us"
+    tentativas, enviadas = [], []
+    tentar_original = agendamento._try_reserva_or_ask_time
+    agendamento._try_reserva_or_ask_time = lambda send, c, d, h: tentativas.append((d, h))
+    try:
+        agendamento.state_manager.update_data(chat_id, proximo_data="16/09/2026", proximo_hora="08:00",
+                                              data_pedida="15/09/2026")
+        agendamento.state_manager.set_state(chat_id, agendamento.S_PROXIMO_CONF)
+        send = lambda c, m: enviadas.append(m)
+        agendamento._handle_proximo_conf(send, chat_id, "9:30")
+        agendamento._handle_proximo_conf(send, chat_id, "25:00")
+        agendamento._handle_proximo_conf(send, chat_id, "sim")
+    finally:
+        agendamento._try_reserva_or_ask_time = tentar_original
+    print(f"🕘 Tentativas: {tentativas} | respostas: {len(enviadas)}")
+    return (tentativas == [("15/09/2026", "09:30"), ("16/09/2026", "08:00")]
+            and len(enviadas) == 1 and "HH:MM" in enviadas[0])
+
+
+def testar_hhmm_compartilhado():
+    """HH:MM -> minutos: um só helper para agenda e slots."""
+    casos = {"08:00": 480, " 13:30 ": 810, "9:05": 545, "abc": None, "": None}
+    ok = all(ag.hhmm_para_minutos(h) == m for h, m in casos.items())
+    print(f"⏱️ {casos} | mesmo helper: {slots_dinamicos.hhmm_para_minutos is ag.hhmm_para_minutos}")
+    return ok and slots_dinamicos.hhmm_para_minutos is ag.hhmm_para_minutos
+
+
+def main():
+    print("\n" + "🧪" * 30)
+    print("  TESTE DO MOTOR DE DISPONIBILIDADE  ")
+    print("🧪" * 30 + "\n")
+
+    testes = [
+        testar_proximo_horario_dia_livre,
+        testar_proximo_horario_pula_ocupados,
+        testar_proximo_horario_aproveita_pausa,
+        testar_proximo_horario_atravessa_dias,
+        testar_proximo_horario_respeita_limite,
+        testar_cache_grade_invalidacao,
+        testar_cache_invalida_ao_salvar_agenda,
+        testar_agenda_recarrega_ao_mudar_arquivo,
+        testar_config_registry_le_uma_vez,
+        testar_calendario_indice_unificado,
+        testar_expiracao_por_heap,
+        testar_reservas_datas_diferentes_em_paralelo,
+        testar_reserva_valida_versao_no_commit,
+        testar_reserva_so_grava_ao_confirmar,
+        testar_reservas_compartilhadas_sqlite,
+        testar_reserva_sqlite_ve_linha_gravada_por_outro,
+        testar_recursos_capacidade,
+        testar_pre_calculo_grades,
+        testar_pre_calculo_substitui_pendente,
+        testar_atualizacao_externa_sob_lock,
+        testar_outro_horario_na_sugestao,
+        testar_hhmm_compartilhado,
+    ]
+
+    testes_passados = 0
+    for teste in testes:
+        print("=" * 60)
+        print(f"🧪 {teste.__doc__}")
+        if teste():
+            print("✅ PASSOU\n")
+            testes_passados += 1
+        else:
+            print("❌ FALHOU\n")
+
+    print("=" * 60)
+    print(f"Testes passados: {testes_passados}/{len(testes)}")
+    return 0 if testes_passados == len(testes) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
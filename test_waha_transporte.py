@@ -0,0 +1,1030 @@
+#!/usr/bin/env python3
+"""
+Teste do Transporte WAHA
+Valida o reaproveitamento de conexões (keep-alive) contra um WAHA falso
+local e mede a latência por mensagem com e sem a Session compartilhada.
+"""
+
+import sys
+import os
+import json
+import time
+import threading
+import tempfile
+import zlib
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Planilhas temporárias: importar o webhook carrega o fluxo de agendamento
+_TMP_DIR = tempfile.mkdtemp(prefix="teste_waha_")
+os.environ.setdefault("AGENDAMENTOS_XLSX", os.path.join(_TMP_DIR, "agendamentos.xlsx"))
+os.environ.setdefault("CLIENTES_XLSX", os.path.join(_TMP_DIR, "clientes.xlsx"))
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from services import dedup_eventos
+from services import fila_entrada
+from services import fila_envio
+from services import limite_envio
+from services import nao_entregues
+from services import sessoes_waha
+from services import waha_transporte
+from services.waha import Waha
+from zapwaha.services.waha import WahaClient
+from zapwaha.web import webhooks
+
+N_MENSAGENS = 200
+
+
+class _WahaFalso(BaseHTTPRequestHandler):
+    """Responde como o WAHA e conta conexões TCP e mensagens recebidas."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # como o WAHA (Node); evita atraso de ACK no keep-alive
+    conexoes = 0
+    recebidas = []
+    aceitar = None  # caminho aceito (None = todos), simula versões do WAHA
+    atraso = 0.0    # segundos por requisição, simula WAHA lento
+    status = None   # força o status de todas as respostas (ex.: 500)
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with _WahaFalso.lock:
+            _WahaFalso.conexoes += 1
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+        time.sleep(_WahaFalso.atraso)
+        with _WahaFalso.lock:
+            _WahaFalso.recebidas.append((self.path, corpo, self.headers.get("X-Api-Key")))
+        if _WahaFalso.status:
+            resposta = b'{"error": "falha"}'
+            self.send_response(_WahaFalso.status)
+        elif _WahaFalso.aceitar and self.path != _WahaFalso.aceitar:
+            resposta = b'{"error": "not found"}'
+            self.send_response(404)
+        else:
+            resposta = b'{"id": "ok"}'
+            self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(resposta)))
+        self.end_headers()
+        try:
+            self.wfile.write(resposta)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cliente desistiu (timeout/prazo)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_waha_falso() -> str:
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _WahaFalso)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def zerar_contadores():
+    _WahaFalso.conexoes = 0
+    _WahaFalso.recebidas = []
+    _WahaFalso.aceitar = None
+    _WahaFalso.atraso = 0.0
+    _WahaFalso.status = None
+    webhooks._variante_waha = None
+    webhooks._falhas_variante = 0
+    waha_transporte.fechar()
+    waha_transporte.resetar_estatisticas()
+    waha_transporte.resetar_circuito()
+    limite_envio.resetar()
+
+
+BASE = iniciar_waha_falso()
+
+
+def testar_envio_reaproveita_conexao():
+    """Mensagens e 'digitando' do webhook usam uma única conexão."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    ok = all(webhooks._send_http_waha("5511000000001@c.us", f"msg {i}") for i in range(20))
+    webhooks._typing_http("5511000000001@c.us", True)
+    webhooks._typing_http("5511000000001@c.us", False)
+
+    caminhos = [p for p, _, _ in _WahaFalso.recebidas]
+    print(f"📨 Enviadas: {ok} | recebidas: {len(caminhos)} | conexões TCP: {_WahaFalso.conexoes}")
+    return ok and len(caminhos) == 22 and caminhos[-1] == "/api/stopTyping" and _WahaFalso.conexoes == 1
+
+
+def testar_clientes_usam_transporte():
+    """Waha e WahaClient enviam pela mesma Session, com a chave de API."""
+    zerar_contadores()
+    Waha(api_url=BASE).send_message("5511000000001@c.us", "via Waha")
+    cliente = WahaClient(base_url=BASE, api_key="segredo")
+    resposta = cliente.send_text("5511000000001@c.us", "via WahaClient")
+    cliente.start_typing("5511000000001@c.us")
+
+    chaves = [k for _, _, k in _WahaFalso.recebidas]
+    stats = waha_transporte.estatisticas()
+    print(f"📨 Recebidas: {len(chaves)} | chaves: {chaves} | conexões: {_WahaFalso.conexoes} | stats: {stats['requisicoes']}")
+    return (resposta == {"id": "ok"} and chaves[1:] == ["segredo", "segredo"]
+            and _WahaFalso.conexoes == 1 and stats["requisicoes"] == 3)
+
+
+def testar_variante_descoberta_uma_vez():
+    """Formato do WAHA é descoberto no 1º envio; os demais fazem uma só requisição."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/api/sessions/default/messages/text"
+
+    primeiro = webhooks._send_http_waha("5511000000001@c.us", "primeiro")
+    tentativas_descoberta = len(_WahaFalso.recebidas)
+    seguintes = all(webhooks._send_http_waha("5511000000001@c.us", f"msg {i}") for i in range(5))
+    por_envio = (len(_WahaFalso.recebidas) - tentativas_descoberta) / 5
+
+    # WAHA atualizado: após falhas seguidas a variante é redescoberta
+    _WahaFalso.aceitar = "/api/sendText"
+    falhas = [webhooks._send_http_waha("5511000000001@c.us", "x") for _ in range(webhooks.MAX_FALHAS_VARIANTE)]
+    esquecida = webhooks._variante_waha is None
+    redescoberta = webhooks._send_http_waha("5511000000001@c.us", "de novo")
+
+    print(f"🔎 Descoberta: {primeiro} em {tentativas_descoberta} tentativas | por envio depois: {por_envio}")
+    print(f"🔁 Falhas: {falhas} | esquecida: {esquecida} | redescoberta: {redescoberta} -> {webhooks._variante_waha}")
+    return (primeiro and tentativas_descoberta == 11 and seguintes and por_envio == 1
+            and not any(falhas) and esquecida and redescoberta and webhooks._variante_waha == 0)
+
+
+def _porta_livre() -> str:
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def testar_waha_fora_do_ar():
+    """WAHA fora do ar: a descoberta desiste na primeira falha de conexão."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = _porta_livre()
+    try:
+        inicio = time.perf_counter()
+        ok = webhooks._send_http_waha("5511000000001@c.us", "sem WAHA")
+        duracao = time.perf_counter() - inicio
+    finally:
+        webhooks.WAHA_API_URL = BASE
+    stats = waha_transporte.estatisticas()
+    print(f"🚫 Enviado: {ok} | requisições: {stats['requisicoes']} | {duracao:.2f}s")
+    return not ok and stats["requisicoes"] == 1
+
+
+def _abrir_circuito(aberto_s: float, sessao=None):
+    """Abre o disjuntor (da sessão) com falhas de conexão reais."""
+    waha_transporte.CB_FALHAS = 3
+    waha_transporte.CB_ABERTO_S = aberto_s
+    morto = _porta_livre()
+    for _ in range(3):
+        try:
+            waha_transporte.post(f"{morto}/api/sendText", json={}, sessao_waha=sessao)
+        except requests.RequestException:
+            pass
+
+
+def testar_disjuntor():
+    """Disjuntor: abre após falhas seguidas, recusa na hora e fecha no teste meio-aberto."""
+    zerar_contadores()
+    falhas_original, aberto_original = waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S
+    try:
+        _abrir_circuito(0.5)
+        estado_aberto = waha_transporte.estado_circuito()
+        inicio = time.perf_counter()
+        try:
+            waha_transporte.post(f"{BASE}/api/sendText", json={})
+            recusada = False
+        except waha_transporte.CircuitoAberto:
+            recusada = True
+        recusa_ms = (time.perf_counter() - inicio) * 1000
+        recebidas_aberto = len(_WahaFalso.recebidas)
+
+        time.sleep(0.6)
+        estado_teste = waha_transporte.estado_circuito()
+        resposta = waha_transporte.post(f"{BASE}/api/sendText", json={})
+        estado_final = waha_transporte.estado_circuito()
+    finally:
+        waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S = falhas_original, aberto_original
+        waha_transporte.resetar_circuito()
+
+    stats = waha_transporte.estatisticas()
+    print(f"🔌 {estado_aberto} -> recusa em {recusa_ms:.1f} ms -> {estado_teste} -> {estado_final} "
+          f"| aberturas: {stats['aberturas']}")
+    return (estado_aberto == "aberto" and recusada and recusa_ms < 50 and recebidas_aberto == 0
+            and estado_teste == "meio_aberto" and resposta.status_code == 201
+            and estado_final == "fechado" and stats["aberturas"] == 1)
+
+
+def testar_fila_estaciona_com_circuito_aberto():
+    """Circuito aberto: envios ficam na fila e saem em ordem quando o WAHA volta."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/api/sendText"
+    falhas_original, aberto_original = waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S
+    fila_envio.resetar_estatisticas()
+    try:
+        _abrir_circuito(1.0)
+        for i in range(5):
+            webhooks._enviar("5511000000041@c.us", f"parada {i}")
+        time.sleep(0.3)
+        durante = len(_WahaFalso.recebidas)
+        pendentes = fila_envio.estatisticas()["profundidade"]
+        fila_envio.aguardar_vazia(10)
+    finally:
+        waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S = falhas_original, aberto_original
+        waha_transporte.resetar_circuito()
+
+    textos = [c.get("text") for p, c, _ in _WahaFalso.recebidas if p == "/api/sendText"]
+    print(f"🅿️ Durante: {durante} enviadas, {pendentes} na fila | depois: {textos}")
+    return durante == 0 and pendentes == 5 and textos == [f"parada {i}" for i in range(5)]
+
+
+def testar_varias_sessoes():
+    """Várias sessões: entrada por sessão, resposta fixa no chat, hash e desvio da sessão fora do ar."""
+    from flask import Flask
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/api/sendText"
+    sessoes_original = sessoes_waha.SESSOES
+    falhas_original, aberto_original = waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S
+    route_original = webhooks.route_message
+    webhooks.route_message = lambda send, chat_id, texto: send(chat_id, f"re: {texto}")
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    chat_a, chat_b = "5511000000051@c.us", "5511000000053@c.us"  # B: hash -> s2
+    try:
+        sessoes_waha.SESSOES = ["s1", "s2"]
+        sessoes_waha.DB_PATH = os.path.join(_TMP_DIR, "sessoes_chat.sqlite3")
+        sessoes_waha.resetar()
+        cliente = app.test_client()
+        evento = {"session": "s2", "message": {"id": "sess-1", "from": chat_a, "text": "oi"}}
+        cliente.post("/chatbot/webhook/", json=evento)
+        estranha = cliente.post("/chatbot/webhook/", json={
+            "session": "outra", "message": {"id": "sess-2", "from": chat_a, "text": "x"}}).get_json()
+        fila_entrada.aguardar_vazia(10)
+        webhooks._enviar_em_massa(chat_b, "lembrete")
+        # Outro processo (ou spool reprocessado): sem a memória deste, vale o SQLite
+        with sessoes_waha._lock:
+            sessoes_waha._sessao_do_chat.clear()
+        webhooks._enviar_em_massa(chat_a, "lembrete A")
+        fila_envio.aguardar_vazia(10)
+
+        _abrir_circuito(30, sessao="s2")
+        webhooks._enviar(chat_a, "desvio")
+        fila_envio.aguardar_vazia(10)
+        stats = sessoes_waha.estatisticas()
+    finally:
+        webhooks.route_message = route_original
+        sessoes_waha.resetar()
+        sessoes_waha.SESSOES = sessoes_original
+        sessoes_waha.DB_PATH = ""
+        waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S = falhas_original, aberto_original
+        waha_transporte.resetar_circuito()
+
+    por_texto = {c.get("text"): c.get("session") for p, c, _ in _WahaFalso.recebidas if p == "/api/sendText"}
+    esperada_b = ["s1", "s2"][zlib.crc32(chat_b.encode()) % 2]
+    print(f"🔀 {por_texto} | sessão estranha: {estranha['ignored']} ignorada | {stats['sessoes']}")
+    return (por_texto == {"re: oi": "s2", "lembrete": esperada_b, "lembrete A": "s2", "desvio": "s1"}
+            and estranha["ignored"] == 1 and stats["desviadas"] == 1 and stats["sessoes"]["s2"] == "aberto")
+
+
+def testar_sessao_meio_aberta():
+    """Sessão meio-aberta não recebe envios; circuito aberto estaciona até o teste, sem girar."""
+    zerar_contadores()
+    sessoes_original = sessoes_waha.SESSOES
+    falhas_original, aberto_original = waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S
+    chat = "5511000000052@c.us"  # hash -> s1
+    try:
+        sessoes_waha.SESSOES = ["s1", "s2"]
+        sessoes_waha.DB_PATH = os.path.join(_TMP_DIR, "sessoes_chat.sqlite3")
+        sessoes_waha.resetar()
+        _abrir_circuito(0.05, sessao="s1")
+        time.sleep(0.1)
+        waha_transporte._disjuntor("s1").permitir()  # chamada de teste em andamento
+        meio_aberto = waha_transporte.estado_circuito("s1")
+        escolhida = sessoes_waha.sessao_do_chat(chat)
+
+        waha_transporte.resetar_circuito()
+        _abrir_circuito(30, sessao="s1")
+        _abrir_circuito(30, sessao="s2")
+        envio = webhooks._novo_envio(chat, "parado")
+        try:
+            webhooks._registrar_falha(envio, "s1")
+            espera = None
+        except fila_envio.Adiar as adiar:
+            espera = adiar.segundos
+    finally:
+        sessoes_waha.resetar()
+        sessoes_waha.SESSOES = sessoes_original
+        sessoes_waha.DB_PATH = ""
+        waha_transporte.CB_FALHAS, waha_transporte.CB_ABERTO_S = falhas_original, aberto_original
+        waha_transporte.resetar_circuito()
+
+    print(f"🩺 s1 {meio_aberto} -> envio por {escolhida} | circuitos abertos: adiado {espera}s "
+          f"(tentativas: {envio['tentativas']})")
+    return (meio_aberto == "meio_aberto" and escolhida == "s2"
+            and espera is not None and espera > 25 and envio["tentativas"] == 0)
+
+
+def testar_prazo_limita_envio():
+    """Prazo: um WAHA lento não segura a thread além do prazo do envio."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/nao/existe"  # recusa todas as variantes
+    _WahaFalso.atraso = 1.0
+    try:
+        inicio = time.perf_counter()
+        try:
+            with waha_transporte.prazo(2.5):
+                ok = webhooks._send_http_waha("5511000000001@c.us", "lento")
+        except webhooks.TalvezEntregue:
+            ok = False  # a última variante estourou o prazo já no WAHA
+        duracao = time.perf_counter() - inicio
+    finally:
+        time.sleep(_WahaFalso.atraso)  # deixa a requisição abandonada terminar no servidor
+        _WahaFalso.atraso = 0.0
+        waha_transporte.resetar_circuito()
+    print(f"⏳ Enviado: {ok} | {len(_WahaFalso.recebidas)} tentativas em {duracao:.2f}s (sem prazo: ~12s)")
+    return not ok and duracao < 3.0
+
+
+def testar_timeout_de_leitura_nao_duplica():
+    """WAHA recebe e não responde: sem nova tentativa nem client; vai para nao_entregues."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/api/sendText"
+    nao_entregues.descartar()
+    chamadas_client = []
+
+    class _ClientFalso:
+        def send_message(self, **kwargs):
+            chamadas_client.append(kwargs)
+
+    service_original, prazo_original = webhooks.waha_service, webhooks.PRAZO_ENVIO_S
+    webhooks.waha_service = _ClientFalso()
+    try:
+        webhooks._send_http_waha("5511000000071@c.us", "descoberta")
+        _WahaFalso.atraso = 0.8
+        webhooks.PRAZO_ENVIO_S = 0.3
+        webhooks._enviar("5511000000071@c.us", "PIX lento")
+        fila_envio.aguardar_vazia(10)
+        time.sleep(_WahaFalso.atraso + 0.2)  # deixa a requisição abandonada chegar ao servidor
+        guardadas = [m for m in nao_entregues.listar() if m["texto"] == "PIX lento"]
+    finally:
+        _WahaFalso.atraso = 0.0
+        webhooks.waha_service, webhooks.PRAZO_ENVIO_S = service_original, prazo_original
+        waha_transporte.resetar_circuito()
+        nao_entregues.descartar()
+
+    recebidas = sum(c.get("text") == "PIX lento" for p, c, _ in _WahaFalso.recebidas)
+    print(f"⌛ Recebidas pelo WAHA: {recebidas} | client: {len(chamadas_client)} | "
+          f"guardada: {[(m['tentativas'], m['erro'][:40]) for m in guardadas]}")
+    return (recebidas == 1 and not chamadas_client and len(guardadas) == 1
+            and "pode ter sido entregue" in guardadas[0]["erro"])
+
+
+def testar_recusa_5xx_vai_para_nao_entregues():
+    """WAHA responde 5xx: o client não conta como enviado; novas tentativas e nao_entregues."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    _WahaFalso.aceitar = "/api/sendText"
+    nao_entregues.descartar()
+    service_original = webhooks.waha_service
+    tentativas_original, backoff_original = fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S
+    falhas_original = waha_transporte.CB_FALHAS
+    webhooks.waha_service = Waha(api_url=BASE)
+    fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S = 3, 0.1
+    waha_transporte.CB_FALHAS = 100  # só o reenvio da fila em jogo, sem abrir o circuito
+    try:
+        webhooks._send_http_waha("5511000000072@c.us", "descoberta")
+        _WahaFalso.status = 500
+        fila_envio.resetar_estatisticas()
+        webhooks._enviar("5511000000072@c.us", "recusada")
+        fila_envio.aguardar_vazia(10)
+        stats = fila_envio.estatisticas()
+        guardadas = [m for m in nao_entregues.listar() if m["texto"] == "recusada"]
+    finally:
+        _WahaFalso.status = None
+        webhooks.waha_service = service_original
+        fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S = tentativas_original, backoff_original
+        waha_transporte.CB_FALHAS = falhas_original
+        waha_transporte.resetar_circuito()
+        nao_entregues.descartar()
+
+    recebidas = sum(c.get("text") == "recusada" for p, c, _ in _WahaFalso.recebidas)
+    print(f"🚫 POSTs: {recebidas} | adiadas: {stats['adiadas']} | "
+          f"guardada: {[(m['tentativas'], m['erro'][:30]) for m in guardadas]}")
+    return (recebidas == 6 and stats["adiadas"] == 2 and len(guardadas) == 1
+            and guardadas[0]["tentativas"] == 3)
+
+
+def testar_reenvio_e_nao_entregues():
+    """Falha de envio: backoff sem travar outros chats, depois nao_entregues e reenvio pelo admin."""
+    from flask import Flask
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    webhooks.waha_service = None
+    webhooks.ADMIN_TOKEN = "admin-teste"
+    nao_entregues.descartar()
+    tentativas_original, backoff_original = fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S
+    fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S = 3, 0.2
+    fila_envio.resetar_estatisticas()
+
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    cliente = app.test_client()
+    admin = {"X-Admin-Token": "admin-teste"}
+    try:
+        # Variante descoberta; depois o WAHA passa a recusar tudo (4xx: circuito segue fechado)
+        webhooks._send_http_waha("5511000000061@c.us", "descoberta")
+        _WahaFalso.aceitar = "/nao/existe"
+        webhooks._enviar("5511000000061@c.us", "PIX 1")
+        webhooks._enviar("5511000000061@c.us", "PIX 2")
+        time.sleep(0.05)
+        # Outro chat anda enquanto o primeiro está em backoff
+        _WahaFalso.aceitar = "/api/sendText"
+        inicio = time.perf_counter()
+        webhooks._enviar("5511000000062@c.us", "outro chat")
+        while not any(c.get("text") == "outro chat" for p, c, _ in _WahaFalso.recebidas):
+            time.sleep(0.01)
+        outro_chat_s = time.perf_counter() - inicio
+        _WahaFalso.aceitar = "/nao/existe"
+        fila_envio.aguardar_vazia(15)
+
+        lista = cliente.get("/debug/nao-entregues", headers=admin).get_json()
+        guardadas = [(m["texto"], m["tentativas"]) for m in lista["mensagens"]]
+
+        _WahaFalso.aceitar = None
+        _WahaFalso.recebidas = []
+        reenvio = cliente.post("/debug/nao-entregues/reenviar", json={}, headers=admin).get_json()
+        fila_envio.aguardar_vazia(10)
+        entregues = [c.get("text") for p, c, _ in _WahaFalso.recebidas]
+        restantes = nao_entregues.quantidade()
+    finally:
+        fila_envio.MAX_TENTATIVAS, fila_envio.BACKOFF_S = tentativas_original, backoff_original
+        webhooks.ADMIN_TOKEN = None
+
+    stats = fila_envio.estatisticas()
+    print(f"📮 Outro chat em {outro_chat_s * 1000:.0f}ms | guardadas: {guardadas} | "
+          f"reenviadas: {reenvio['reenviadas']} -> {entregues} | restantes: {restantes} | adiadas: {stats['adiadas']}")
+    return (outro_chat_s < 0.2 and guardadas == [("PIX 1", 3), ("PIX 2", 3)]
+            and reenvio["reenviadas"] == 2 and entregues == ["PIX 1", "PIX 2"] and restantes == 0)
+
+
+def testar_limite_prioriza_interativo():
+    """Limite por sessão: rajada de lembretes respeita a taxa e as respostas passam na frente."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    webhooks.waha_service = None
+    _WahaFalso.aceitar = "/api/sendText"
+    webhooks._send_http_waha("5511000000070@c.us", "descoberta")
+    _WahaFalso.recebidas = []
+    original = (limite_envio.TAXA_MSG_S, limite_envio.RAJADA,
+                limite_envio.RESERVA_INTERATIVO, limite_envio.TAXA_MASSA_MSG_S)
+    limite_envio.TAXA_MSG_S, limite_envio.RAJADA = 10, 4
+    limite_envio.RESERVA_INTERATIVO, limite_envio.TAXA_MASSA_MSG_S = 2, 10
+    limite_envio.resetar()
+    try:
+        inicio = time.perf_counter()
+        for i in range(12):
+            webhooks._enviar_em_massa(f"55110000007{i:02d}@c.us", f"lembrete {i}")
+        time.sleep(0.05)
+        for i in range(4):
+            webhooks._enviar("5511000000069@c.us", f"resposta {i}")
+        fila_envio.aguardar_vazia(15)
+        duracao = time.perf_counter() - inicio
+    finally:
+        (limite_envio.TAXA_MSG_S, limite_envio.RAJADA,
+         limite_envio.RESERVA_INTERATIVO, limite_envio.TAXA_MASSA_MSG_S) = original
+        stats = limite_envio.estatisticas()["faixas"]
+        limite_envio.resetar()
+
+    textos = [c.get("text") for p, c, _ in _WahaFalso.recebidas]
+    respostas = [t for t in textos if t.startswith("resposta")]
+    ultima_resposta = max(i for i, t in enumerate(textos) if t.startswith("resposta"))
+    print(f"🚦 {len(textos)} msgs em {duracao:.2f}s | última resposta na posição {ultima_resposta} | "
+          f"espera média: interativo {stats['interativo']['espera_media_ms']:.0f}ms, "
+          f"massa {stats['massa']['espera_media_ms']:.0f}ms")
+    return (len(textos) == 16 and respostas == [f"resposta {i}" for i in range(4)]
+            and ultima_resposta < 10 and duracao >= 1.0
+            and stats["massa"]["espera_media_ms"] > stats["interativo"]["espera_media_ms"])
+
+
+def testar_limite_sem_fila_nao_descarta():
+    """Sem fila de envio (workers=0): o limite espera na hora e, passado o prazo, guarda em nao_entregues."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    webhooks.waha_service = None
+    _WahaFalso.aceitar = "/api/sendText"
+    webhooks._send_http_waha("5511000000073@c.us", "descoberta")
+    _WahaFalso.recebidas = []
+    nao_entregues.descartar()
+    original = (limite_envio.TAXA_MSG_S, limite_envio.RAJADA, fila_envio.WORKERS,
+                fila_envio._saida.workers, webhooks.PRAZO_LIMITE_SINCRONO_S)
+    limite_envio.TAXA_MSG_S, limite_envio.RAJADA = 10, 1
+    fila_envio.WORKERS = fila_envio._saida.workers = 0
+    limite_envio.resetar()
+    try:
+        inicio = time.perf_counter()
+        for i in range(3):
+            webhooks._enviar("5511000000073@c.us", f"sem fila {i}")
+        duracao = time.perf_counter() - inicio
+        webhooks.PRAZO_LIMITE_SINCRONO_S = 0.01
+        webhooks._enviar("5511000000073@c.us", "sem fila 3")
+        webhooks._enviar("5511000000073@c.us", "sem fila 4")
+        guardadas = [m["texto"] for m in nao_entregues.listar()]
+    finally:
+        (limite_envio.TAXA_MSG_S, limite_envio.RAJADA, fila_envio.WORKERS,
+         fila_envio._saida.workers, webhooks.PRAZO_LIMITE_SINCRONO_S) = original
+        limite_envio.resetar()
+        nao_entregues.descartar()
+
+    textos = [c.get("text") for p, c, _ in _WahaFalso.recebidas]
+    print(f"⏳ Enviadas: {textos} em {duracao:.2f}s | guardadas: {guardadas}")
+    return (textos == ["sem fila 0", "sem fila 1", "sem fila 2"] and duracao >= 0.15
+            and sorted(guardadas) == ["sem fila 3", "sem fila 4"])
+
+
+def testar_agrupar_mensagens_do_turno():
+    """Caixa de saída: mensagens do turno saem juntas; o PIX vai sozinho e na ordem."""
+    from zapwaha.flows import agendamento
+    enviadas = []
+    guardado = {}
+    rotear_original = agendamento._rotear
+
+    def turno(send, chat_id, texto):
+        send(chat_id, "Reserva feita")
+        agendamento._send_separado(send, chat_id, "PIX copia e cola")
+        send(chat_id, "Aguardando pagamento")
+        send(chat_id, "x" * 3000)
+        send("5511999999999@c.us", "aviso ao admin")
+        guardado["send"] = send
+
+    agendamento._rotear = turno
+    try:
+        agendamento.route_message(lambda c, m: enviadas.append((c, m)), "5511000000081@c.us", "sim", agrupar=True)
+        por_turno = list(enviadas)
+        guardado["send"]("5511000000081@c.us", "depois do turno")  # caixa já descarregada: vai direto
+        depois = enviadas[len(por_turno):]
+        enviadas.clear()
+        agendamento.route_message(lambda c, m: enviadas.append((c, m)), "5511000000081@c.us", "sim", agrupar=False)
+        sem_agrupar = len(enviadas)
+    finally:
+        agendamento._rotear = rotear_original
+
+    textos = [m[:20] for c, m in por_turno if c.endswith("81@c.us")]
+    print(f"📦 {sem_agrupar} envios -> {len(por_turno)} | {textos}")
+    return (sem_agrupar == 5 and len(por_turno) == 4
+            and textos == ["Reserva feita", "PIX copia e cola", "Aguardando pagamento"]
+            and por_turno[2][1] == "Aguardando pagamento\n\n" + "x" * 3000
+            and por_turno[3] == ("5511999999999@c.us", "aviso ao admin")
+            and depois == [("5511000000081@c.us", "depois do turno")])
+
+
+def testar_fila_ordem_por_chat():
+    """Fila de envio: ordem FIFO por chat e chats diferentes em paralelo."""
+    fila_envio.resetar_estatisticas()
+    entregues = {}
+    ativos = set()
+    sobreposicao = []
+    lock = threading.Lock()
+
+    def enviar(chat_id, n):
+        with lock:
+            if chat_id in ativos:
+                sobreposicao.append(chat_id)
+            ativos.add(chat_id)
+        time.sleep(0.005)
+        with lock:
+            ativos.discard(chat_id)
+            entregues.setdefault(chat_id, []).append(n)
+
+    chats = [f"55110000000{i:02d}@c.us" for i in range(4)]
+    inicio = time.perf_counter()
+    for n in range(20):
+        for chat_id in chats:
+            fila_envio.enfileirar(chat_id, enviar, chat_id, n)
+    fila_envio.aguardar_vazia(10)
+    duracao = time.perf_counter() - inicio
+
+    em_ordem = all(entregues.get(c) == list(range(20)) for c in chats)
+    stats = fila_envio.estatisticas()
+    print(f"📬 Em ordem: {em_ordem} | sobreposição no mesmo chat: {len(sobreposicao)} | {duracao:.2f}s "
+          f"(sequencial ~{80 * 0.005:.2f}s) | profundidade máx: {stats['profundidade_max']} "
+          f"| envio médio: {stats['latencia_execucao_ms']}ms")
+    return em_ordem and not sobreposicao and stats["executadas"] == 80 and duracao < 80 * 0.005
+
+
+def testar_webhook_responde_sem_esperar_waha():
+    """Webhook responde ao enfileirar; as mensagens chegam depois, na ordem."""
+    from flask import Flask
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    webhooks.waha_service = None
+    _WahaFalso.atraso = 0.2
+
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    cliente = app.test_client()
+
+    inicio = time.perf_counter()
+    resposta = cliente.post("/test/incoming", json={"user_id": "5511000000009", "text": "menu"})
+    tempo_resposta = time.perf_counter() - inicio
+    fila_entrada.aguardar_vazia(10)
+    fila_envio.aguardar_vazia(10)
+
+    caminhos = [p for p, _, _ in _WahaFalso.recebidas]
+    print(f"⚡ Resposta em {tempo_resposta * 1000:.0f}ms | WAHA recebeu: {caminhos}")
+    # Fluxo rápido (menu): sem "digitando", só a resposta
+    return (resposta.status_code == 200 and tempo_resposta < _WahaFalso.atraso
+            and caminhos == ["/api/sendText"])
+
+
+def testar_digitando_so_em_fluxo_lento():
+    """Digitando: só em fluxo lento, um start por chat e stop apenas sem resposta."""
+    zerar_contadores()
+    webhooks.WAHA_API_URL = BASE
+    webhooks.waha_service = None
+    _WahaFalso.aceitar = "/api/sendText"
+    apos_original = webhooks.DIGITANDO_APOS_S
+    route_original = webhooks.route_message
+
+    def fluxo_lento(send, chat_id, texto):
+        # Outra parte do código pedindo "digitando" no meio: não duplica
+        webhooks._iniciar_digitando(chat_id)
+        time.sleep(0.3)
+        if texto == "responde":
+            send(chat_id, "pronto")
+
+    webhooks.DIGITANDO_APOS_S = 0.1
+    webhooks.route_message = fluxo_lento
+    try:
+        webhooks._processar_mensagem("5511000000051@c.us", "responde")
+        fila_envio.aguardar_vazia(10)
+        com_resposta = [p for p, _, _ in _WahaFalso.recebidas]
+        _WahaFalso.recebidas = []
+        webhooks._processar_mensagem("5511000000051@c.us", "silencio")
+        fila_envio.aguardar_vazia(10)
+        sem_resposta = [p for p, _, _ in _WahaFalso.recebidas]
+    finally:
+        webhooks.DIGITANDO_APOS_S = apos_original
+        webhooks.route_message = route_original
+
+    print(f"⌨️ Com resposta: {com_resposta} | sem resposta: {sem_resposta}")
+    return (com_resposta == ["/api/startTyping", "/api/sendText"]
+            and sem_resposta == ["/api/startTyping", "/api/stopTyping"]
+            and not webhooks._digitando_ativo)
+
+
+def _evento(chat_id, texto, msg_id):
+    return {"session": "default", "message": {"id": msg_id, "from": chat_id, "text": texto}}
+
+
+def testar_webhook_aceita_e_enfileira():
+    """Webhook do WAHA responde em ms; o fluxo roda depois, em ordem por chat."""
+    from flask import Flask
+    processadas = []
+    lock = threading.Lock()
+
+    def fluxo_lento(send, chat_id, texto):
+        time.sleep(0.1)
+        with lock:
+            processadas.append((chat_id, texto))
+
+    route_original = webhooks.route_message
+    webhooks.route_message = fluxo_lento
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    cliente = app.test_client()
+    try:
+        inicio = time.perf_counter()
+        for i, texto in enumerate(["1", "2", "3"]):
+            cliente.post("/chatbot/webhook/", json=_evento("5511000000021@c.us", texto, f"a{i}"))
+        r = cliente.post("/chatbot/webhook/", json=_evento("5511000000022@c.us", "oi", "b0"))
+        dup = cliente.post("/chatbot/webhook/", json=_evento("5511000000022@c.us", "oi", "b0"))
+        tempo = time.perf_counter() - inicio
+        fila_entrada.aguardar_vazia(10)
+        fila_envio.aguardar_vazia(10)
+    finally:
+        webhooks.route_message = route_original
+
+    chat_a = [t for c, t in processadas if c.endswith("21@c.us")]
+    print(f"📥 5 requisições em {tempo * 1000:.0f}ms | chat A: {chat_a} | total: {len(processadas)} "
+          f"| duplicada: {dup.get_json()}")
+    return (r.status_code == 200 and tempo < 0.1 and chat_a == ["1", "2", "3"]
+            and len(processadas) == 4 and dup.get_json()["deduped"] == 1)
+
+
+def testar_envelope_com_varias_mensagens():
+    """Envelope com várias mensagens: resultado por unidade, ordem por chat e chats em paralelo."""
+    from flask import Flask
+    processadas = []
+    lock = threading.Lock()
+
+    def fluxo_lento(send, chat_id, texto):
+        time.sleep(0.1)
+        with lock:
+            processadas.append((chat_id, texto))
+
+    chats = [f"55110000000{n}@c.us" for n in (91, 92, 93)]
+    mensagens = [{"id": f"lote-{c}-{i}", "from": c, "text": f"{i}"} for i in range(3) for c in chats]
+    mensagens.append(dict(mensagens[0]))                          # reenvio dentro do próprio lote
+    mensagens.append({"id": "ack-1", "from": chats[0], "ack": 3})  # sem texto
+
+    route_original = webhooks.route_message
+    webhooks.route_message = fluxo_lento
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    try:
+        inicio = time.perf_counter()
+        resposta = app.test_client().post(
+            "/chatbot/webhook/", json={"session": "default", "payload": {"messages": mensagens}}
+        ).get_json()
+        fila_entrada.aguardar_vazia(10)
+        duracao = time.perf_counter() - inicio
+    finally:
+        webhooks.route_message = route_original
+
+    status = [r["status"] for r in resposta["results"]]
+    em_ordem = all([t for c, t in processadas if c == chat] == ["0", "1", "2"] for chat in chats)
+    print(f"🗂️ {len(mensagens)} unidades -> {status} | em ordem: {em_ordem} | "
+          f"{duracao:.2f}s (sequencial ~{0.1 * 9:.1f}s)")
+    return (status == ["queued"] * 9 + ["deduped", "ignored"] and resposta["queued"] == 9
+            and em_ordem and len(processadas) == 9 and duracao < 0.6)
+
+
+def testar_rajada_e_enxurrada():
+    """Rajada do mesmo chat vira um turno só; enxurrada é descartada antes do fluxo."""
+    from flask import Flask
+    turnos = []
+    lock = threading.Lock()
+
+    def fluxo(send, chat_id, texto):
+        with lock:
+            turnos.append((chat_id, texto))
+
+    originais = (fila_entrada.DEBOUNCE_S, fila_entrada.DEBOUNCE_MAX_S,
+                 fila_entrada.LIMITE_RAJADA, fila_entrada.LIMITE_MSG_MIN)
+    route_original = webhooks.route_message
+    webhooks.route_message = fluxo
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    cliente = app.test_client()
+    chat_a, chat_b = "5511000000061@c.us", "5511000000062@c.us"
+    try:
+        fila_entrada.DEBOUNCE_S, fila_entrada.DEBOUNCE_MAX_S = 0.2, 1.0
+        fila_entrada.LIMITE_RAJADA, fila_entrada.LIMITE_MSG_MIN = 5, 20
+        fila_entrada.resetar_estatisticas()
+        for i, texto in enumerate(["oi", "bom dia", "quero agendar"]):
+            cliente.post("/chatbot/webhook/", json=_evento(chat_a, texto, f"raj-a{i}"))
+        limitadas = sum(
+            cliente.post("/chatbot/webhook/", json=_evento(chat_b, f"spam {i}", f"raj-b{i}")).get_json()["limited"]
+            for i in range(8)
+        )
+        fila_entrada.aguardar_vazia(10)
+        stats = fila_entrada.estatisticas()
+    finally:
+        webhooks.route_message = route_original
+        (fila_entrada.DEBOUNCE_S, fila_entrada.DEBOUNCE_MAX_S,
+         fila_entrada.LIMITE_RAJADA, fila_entrada.LIMITE_MSG_MIN) = originais
+        fila_entrada.resetar_estatisticas()
+
+    print(f"🌊 Turnos: {turnos} | limitadas: {limitadas} | agrupadas: {stats['agrupadas']} "
+          f"| descartadas: {stats['descartadas']}")
+    return (sorted(turnos) == [(chat_a, "oi\nbom dia\nquero agendar"),
+                               (chat_b, "\n".join(f"spam {i}" for i in range(5)))]
+            and limitadas == 3 and stats["agrupadas"] == 6 and stats["turnos_agrupados"] == 2
+            and stats["descartadas"] == 3 and stats["chats_descartados"] == 1)
+
+
+def testar_parser_formatos():
+    """Parser do webhook: detecta o envelope e extrai todos os campos numa passada."""
+    casos = [
+        ({"event": "message", "session": "default",
+          "payload": {"id": "x", "from": "5511999999999@c.us", "body": "oi"}},
+         ("payload", "5511999999999@c.us", "oi", None, "message", True)),
+        ({"data": {"message": {"key": {"id": "k1", "remoteJid": "5511888@s.whatsapp.net"}, "conversation": "olá"}}},
+         ("data", "5511888@c.us", "olá", "msg:k1", "", True)),
+        ({"from": "5511555", "text": "flat", "type": "Message", "session": "outra"},
+         ("flat", "5511555@c.us", "flat", None, "message", False)),
+        ({"event": {"eventId": "E1", "eventType": "message_ack"}, "payload": {"from": "5511@c.us"}},
+         ("payload", "5511@c.us", "", "evt:E1", "message_ack", True)),
+    ]
+    obtidos = []
+    for unidade, esperado in casos:
+        m = webhooks._parse_unit(unidade)
+        obtidos.append((m.formato, m.chat_id, m.text, m.event_id, m.event_type, m.session_matches()) == esperado)
+    print(f"🧩 Formatos reconhecidos: {obtidos}")
+    return all(obtidos)
+
+
+def testar_caixa_limita_chats():
+    """Caixa por chat: limite de chats pendentes e ordem mantida com a fila cheia."""
+    from services.fila_envio import FilaPorChat
+    liberar = threading.Event()
+    ordem = []
+
+    def tarefa(chat_id, n, bloquear=True):
+        if bloquear:
+            liberar.wait(5)
+        ordem.append((chat_id, n))
+
+    # Limite de 2 chats: o 3º espera vaga
+    caixa = FilaPorChat("teste_caixa", workers=4, max_pendentes=100, max_chaves=2)
+    caixa.enfileirar("A", tarefa, "A", 1)
+    caixa.enfileirar("B", tarefa, "B", 1)
+    terceiro = threading.Thread(target=caixa.enfileirar, args=("C", tarefa, "C", 1, False))
+    terceiro.start()
+    time.sleep(0.2)
+    c_esperou = terceiro.is_alive() and ("C", 1) not in ordem
+    liberar.set()
+    terceiro.join(5)
+    caixa.aguardar_vazia(5)
+
+    # Fila cheia: chat com pendência entra atrás dela; chat livre roda na hora
+    liberar.clear()
+    espera_original = fila_envio.ESPERA_FILA_S
+    fila_envio.ESPERA_FILA_S = 0.05
+    cheia = FilaPorChat("teste_cheia", workers=1, max_pendentes=1)
+    try:
+        cheia.enfileirar("A", tarefa, "A", 2)
+        time.sleep(0.05)
+        a_na_fila = cheia.enfileirar("A", tarefa, "A", 3, False)
+        b_na_fila = cheia.enfileirar("B", tarefa, "B", 2, False)
+        liberar.set()
+        cheia.aguardar_vazia(5)
+    finally:
+        fila_envio.ESPERA_FILA_S = espera_original
+
+    a = [n for c, n in ordem if c == "A"]
+    print(f"📫 C esperou vaga: {c_esperou} | A: {a} | A enfileirado: {a_na_fila} | B na hora: {not b_na_fila} | ordem: {ordem}")
+    return c_esperou and a == [1, 2, 3] and a_na_fila and not b_na_fila and ordem.index(("B", 2)) < ordem.index(("A", 2))
+
+
+def testar_reenvio_apos_falha_ao_enfileirar():
+    """Falha ao enfileirar: a unidade sai como erro e o reenvio do WAHA não é tratado como duplicado."""
+    from flask import Flask
+    processadas = []
+    route_original, lote_original = webhooks.route_message, fila_entrada.enfileirar_lote
+    webhooks.route_message = lambda send, chat_id, texto: processadas.append(texto)
+
+    def lote_com_falha(mensagens):
+        fila_entrada.enfileirar_lote = lote_original  # só a primeira chamada falha
+        raise OSError("disco cheio")
+
+    fila_entrada.enfileirar_lote = lote_com_falha
+    app = Flask(__name__)
+    app.register_blueprint(webhooks.web_bp)
+    cliente = app.test_client()
+    evento = _evento("5511000000081@c.us", "quero agendar", "falha-spool-1")
+    try:
+        primeira = cliente.post("/chatbot/webhook/", json=evento).get_json()
+        reenvio = cliente.post("/chatbot/webhook/", json=evento).get_json()
+        fila_entrada.aguardar_vazia(10)
+    finally:
+        webhooks.route_message, fila_entrada.enfileirar_lote = route_original, lote_original
+
+    status = [primeira["results"][0]["status"], reenvio["results"][0]["status"]]
+    print(f"♻️ Envio e reenvio: {status} | processadas: {processadas}")
+    return status == ["error", "queued"] and processadas == ["quero agendar"]
+
+
+def testar_dedup_ttl_e_entre_processos():
+    """Dedup: TTL e limite na memória; com sqlite, dois processos não processam o mesmo evento."""
+    import subprocess
+    memoria = dedup_eventos._BackendMemoria(ttl=0.2, maximo=3)
+    primeira = [memoria.marcar(i) for i in ("a", "b", "a")]
+    for i in ("c", "d"):
+        memoria.marcar(i)
+    limitado = memoria.tamanho()            # "a" saiu pelo limite
+    time.sleep(0.25)
+    depois_ttl = memoria.marcar("b")        # "b" venceu: novo de novo
+    memoria.esquecer("b")
+    esquecido = memoria.marcar("b")         # desmarcado: novo de novo
+
+    db = os.path.join(_TMP_DIR, "dedup.sqlite3")
+    codigo = (
+        "import sys; sys.path.insert(0, '.'); from services import dedup_eventos as d; "
+        "print(sum(not d.ja_visto(f'evt-{i}') for i in range(300)))"
+    )
+    env = {**os.environ, "DEDUP_BACKEND": "sqlite", "DEDUP_DB": db}
+    processos = [subprocess.Popen([sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=env, stdout=subprocess.PIPE, text=True) for _ in range(2)]
+    novos = [int(p.communicate(timeout=60)[0].strip().splitlines()[-1]) for p in processos]
+
+    print(f"🧾 Memória: {primeira}, {limitado} ids, após TTL: {depois_ttl} | sqlite: novos por processo {novos}")
+    return (primeira == [True, True, False] and limitado == 3 and depois_ttl and esquecido
+            and sum(novos) == 300)
+
+
+def testar_spool_sobrevive_reinicio():
+    """Spool durável: mensagens de um processo morto são reprocessadas ao iniciar."""
+    spool_path = os.path.join(_TMP_DIR, "entrada.sqlite3")
+    fila_entrada.SPOOL_PATH = spool_path
+    processadas = []
+    try:
+        spool = fila_entrada._obter_spool()
+        con = spool._conexao()
+        # Processo que morreu com 2 mensagens na fila e um worker vivo com 1
+        for dono, texto in [("999999:morto", "a"), ("999999:morto", "b"), (f"{os.getppid()}:vivo", "c")]:
+            con.execute("INSERT INTO entrada (chat_id, texto, dono, recebido_em) VALUES (?, ?, ?, ?)",
+                        ("5511000000031@c.us", texto, dono, time.time()))
+
+        recuperadas = fila_entrada.iniciar(lambda chat_id, texto: processadas.append(texto))
+        fila_entrada.aguardar_vazia(10)
+
+        # Mensagens novas (uma e um lote) passam pelo spool e saem dele após processadas
+        fila_entrada.enfileirar("5511000000031@c.us", "d")
+        fila_entrada.enfileirar_lote([("5511000000031@c.us", "e"), ("5511000000031@c.us", "f")])
+        fila_entrada.aguardar_vazia(10)
+        restantes = [t for (t,) in con.execute("SELECT texto FROM entrada").fetchall()]
+    finally:
+        fila_entrada.SPOOL_PATH = ""
+        fila_entrada.iniciar(webhooks._processar_mensagem)
+
+    print(f"💾 Recuperadas: {recuperadas} | processadas: {processadas} | no spool: {restantes}")
+    return recuperadas == 2 and processadas == ["a", "b", "d", "e", "f"] and restantes == ["c"]
+
+
+def testar_benchmark_latencia():
+    """Benchmark: latência por mensagem com requests.post solto x Session compartilhada."""
+    payload = {"session": "default", "chatId": "5511000000001@c.us", "text": "bench"}
+
+    zerar_contadores()
+    inicio = time.perf_counter()
+    for _ in range(N_MENSAGENS):
+        requests.post(f"{BASE}/api/sendText", json=payload, timeout=10)
+    solto_ms = (time.perf_counter() - inicio) * 1000 / N_MENSAGENS
+    conexoes_solto = _WahaFalso.conexoes
+
+    zerar_contadores()
+    inicio = time.perf_counter()
+    for _ in range(N_MENSAGENS):
+        waha_transporte.post(f"{BASE}/api/sendText", json=payload)
+    pool_ms = (time.perf_counter() - inicio) * 1000 / N_MENSAGENS
+    conexoes_pool = _WahaFalso.conexoes
+
+    print(f"⏱️ requests.post: {solto_ms:.2f} ms/msg ({conexoes_solto} conexões)")
+    print(f"⏱️ Session/pool:  {pool_ms:.2f} ms/msg ({conexoes_pool} conexões)")
+    return conexoes_solto == N_MENSAGENS and conexoes_pool == 1
+
+
+def main():
+    print("\n" + "🧪" * 30)
+    print("  TESTE DO TRANSPORTE WAHA  ")
+    print("🧪" * 30 + "\n")
+
+    testes = [
+        testar_envio_reaproveita_conexao,
+        testar_clientes_usam_transporte,
+        testar_variante_descoberta_uma_vez,
+        testar_waha_fora_do_ar,
+        testar_disjuntor,
+        testar_fila_estaciona_com_circuito_aberto,
+        testar_varias_sessoes,
+        testar_sessao_meio_aberta,
+        testar_prazo_limita_envio,
+        testar_timeout_de_leitura_nao_duplica,
+        testar_recusa_5xx_vai_para_nao_entregues,
+        testar_reenvio_e_nao_entregues,
+        testar_limite_prioriza_interativo,
+        testar_limite_sem_fila_nao_descarta,
+        testar_agrupar_mensagens_do_turno,
+        testar_fila_ordem_por_chat,
+        testar_webhook_responde_sem_esperar_waha,
+        testar_digitando_so_em_fluxo_lento,
+        testar_webhook_aceita_e_enfileira,
+        testar_envelope_com_varias_mensagens,
+        testar_rajada_e_enxurrada,
+        testar_parser_formatos,
+        testar_caixa_limita_chats,
+        testar_reenvio_apos_falha_ao_enfileirar,
+        testar_dedup_ttl_e_entre_processos,
+        testar_spool_sobrevive_reinicio,
+        testar_benchmark_latencia,
+    ]
+
+    testes_passados = 0
+    for teste in testes:
+        print("=" * 60)
+        print(f"🧪 {teste.__doc__}")
+        if teste():
+            print("✅ PASSOU\n")
+            testes_passados += 1
+        else:
+            print("❌ FALHOU\n")
+
+    print("=" * 60)
+    print(f"Testes passados: {testes_passados}/{len(testes)}")
+    return 0 if testes_passados == len(testes) else 1
+
+
+if __name__ == "__main__":
+    exit(main())